@@ -0,0 +1,84 @@
+# Backtesting script for AIVIVN's 5th competition: Server bandwidth and max user prediction
+# Replays the pipeline at historical cutoffs and reports the MAE/sMAPE of the following days per zone and horizon
+
+# Import libraries
+import xgboost as xgb
+from utils.preprocessing_df import load_csv
+from utils.pipeline import Pipeline
+from utils.backtest import backtest, rolling_cutoffs, error_table
+from main_combined import add_preprocessing_stages, PIPELINE_DIR, TRAIN_PATH, TREE_METHOD, TIME_PERIOD_SCHEME
+import sys, logging, warnings
+
+# Disable future warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+# Log configuration
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+# Cutoffs: the last N_CUTOFFS cutoffs STEP_DAYS days apart, each followed by HORIZON_DAYS days
+N_CUTOFFS = 6
+STEP_DAYS = 30
+HORIZON_DAYS = 30
+# Number of cutoffs replayed at the same time (one per core if None)
+N_WORKERS = None
+# Pipeline replayed: 'combined' (main_combined.py) or 'baseline' (xgboost_baseline.py)
+PIPELINE = 'combined'
+REPORT_PATH = 'backtest.csv'
+
+def make_models(pipeline):
+    """XGBoost models of a pipeline, one per target"""
+    depths = [4, 5] if pipeline == 'combined' else [5, 5]
+    return [xgb.XGBRegressor(
+        n_estimators = 1000,
+        eta = 0.01,
+        max_depth = depth,
+        min_child_weight = 1,
+        booster = 'gbtree',
+        subsample = 0.8,
+        colsample_bytree = 0.7,
+        tree_method = TREE_METHOD,
+        silent = 0,
+        gamma = 0,
+        random_state = None if pipeline == 'combined' else 1023
+    ) for depth in depths]
+
+# The combined pipeline has the time period feature of main_combined.py, the baseline
+# uses the medians without the bw per user ratios and no blending
+PIPELINE_CONFIGS = {
+    'combined': {'time_period_scheme': TIME_PERIOD_SCHEME},
+    'baseline': {'p': 1, 'zfeatures': ['median_user_1m', 'median_bw_1m', 'median_user_3m', 'median_bw_3m',
+                                       'median_user_6m', 'median_bw_6m', 'median_user_1y', 'median_bw_1y']}
+}
+
+# Main program
+if __name__ == "__main__":
+    # =========== LOAD THE DATA ===========
+    try:
+        # Preprocessed training data of main_combined.py, memoized in PIPELINE_DIR
+        pipeline = Pipeline(PIPELINE_DIR)
+        add_preprocessing_stages(pipeline)
+        outputs, status = pipeline.run(['special_days'])
+        df, hit = outputs['special_days']['train'], status['special_days'] == 'memoized'
+        raw = load_csv(TRAIN_PATH)
+        cutoffs = rolling_cutoffs(raw, N_CUTOFFS, STEP_DAYS, HORIZON_DAYS)
+        logging.info('Training data loaded{}. Cutoffs: {}.'.format(' from {}'.format(PIPELINE_DIR) if hit else '', ', '.join(str(c.date()) for c in cutoffs)))
+    except Exception as e:
+        logging.error('Could not load the data. {}'.format(e))
+        sys.exit()
+
+    # =========== BACKTEST ===========
+    try:
+        logging.info('Backtesting the {} pipeline...'.format(PIPELINE))
+        errors = backtest(df, raw, cutoffs, make_models(PIPELINE), HORIZON_DAYS, N_WORKERS, **PIPELINE_CONFIGS[PIPELINE])
+        for (cutoff, target), r in error_table(errors, by=['cutoff', 'target']).set_index(['cutoff', 'target']).iterrows():
+            logging.info('{} {}: MAE {:.2f}, sMAPE {:.3f}.'.format(cutoff.date(), target, r['mae'], r['smape']))
+    except Exception as e:
+        logging.error('Could not backtest the pipeline. {}'.format(e))
+        sys.exit()
+
+    # =========== REPORT ===========
+    try:
+        error_table(errors).to_csv(REPORT_PATH, index=False)
+        logging.info('Backtest report saved to {}.'.format(REPORT_PATH))
+    except Exception as e:
+        logging.error('Could not save the report. {}'.format(e))
+        sys.exit()
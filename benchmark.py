@@ -0,0 +1,185 @@
+# Benchmark script for AIVIVN's 5th competition: Server bandwidth and max user prediction
+# Times the preprocessing and non-ML functions and the entry points on synthetic data of growing size
+
+# Import libraries
+import argparse
+import json
+import shutil
+import subprocess
+import numpy as np
+import pandas as pd
+from utils.synthetic import write_dataset
+from utils.benchmark import time_call, save_results, load_results, compare
+from utils.preprocessing_df import *
+from utils.non_ml import *
+from utils.tensor import ZoneTensor
+from utils.training import feature_matrix, ZFEATURES, AUFEATURES
+from utils.flat_trees import FlatTrees
+import xgboost as xgb
+import sys, os, logging, warnings
+
+# Disable future warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+# Log configuration
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+# Data sizes: number of zones, days of history and gap rate
+SCALES = {
+    'small': {'n_zones': 10, 'days': 400, 'gap_rate': 0.03},
+    'medium': {'n_zones': 100, 'days': 400, 'gap_rate': 0.03},
+    'large': {'n_zones': 1000, 'days': 400, 'gap_rate': 0.03},
+    'xlarge': {'n_zones': 10000, 'days': 120, 'gap_rate': 0.03},
+}
+# Per-series functions (moving_*, median_estimation, ...) run on the series of at most this many zones
+SERIES_ZONES = 10
+# The tree predictors are timed on this many single-row calls, with a booster of the size of the trained models
+PREDICT_ROWS = 200
+PREDICT_PARAMS = {'n_estimators': 500, 'max_depth': 5, 'learning_rate': 0.1}
+# The entry points are only run up to this many zones
+ENTRY_POINT_MAX_ZONES = 10
+ENTRY_POINTS = ['main_combined.py', 'xgboost_baseline.py']
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = os.path.join('benchmarks', 'data')
+BASELINE_PATH = os.path.join('benchmarks', 'baseline.json')
+RESULTS_PATH = os.path.join('benchmarks', 'results.json')
+
+def function_cases(train_path):
+    """Benchmark cases of the utils functions on a dataset
+
+    Args:
+        train_path (STR): Path of the train.csv file
+    Return: a list of (name, function, setup) tuples
+    """
+    raw = load_csv(train_path)
+    filled = fill_missing_values(raw.copy())
+    featured = add_time_features(filled.copy())
+    featured['bw_log'] = np.log1p(featured['bandwidth_total'])
+    featured['u_log'] = np.log1p(featured['max_user'])
+
+    # Zones x days matrix of the log bandwidth at midnight and the autocorrelation windows
+    daily = featured[featured['hour_id'] == 0].pivot_table(index='zone_code', columns='update_time', values='bw_log').values
+    daily = daily[:, ~np.isnan(daily).any(axis=0)]
+    lengths = np.full(len(daily), daily.shape[1])
+    series = [g.reset_index(drop=True) for _, g in
+              featured[featured['zone_code'].isin(featured['zone_code'].unique()[:SERIES_ZONES])].groupby(['zone_code', 'hour_id'])['bw_log']]
+
+    # The same data as a zones x hours tensor
+    tensor = ZoneTensor.from_frame(raw)
+    filled_tensor = fill_missing_values(tensor)
+    log_tensor = filled_tensor.map(np.log1p)
+
+    # Single rows of the time features, predicted by a booster trained on the log bandwidth
+    X = feature_matrix(featured, ['hour_id', 'dow_norm', 'month', 'doy', 'year', 'day', 'week'])
+    booster = xgb.XGBRegressor(**PREDICT_PARAMS).fit(X, featured['bw_log'].values).get_booster()
+    trees = FlatTrees.from_booster(booster)
+    rows = [X[i:i + 1] for i in range(min(PREDICT_ROWS, len(X)))]
+
+    def each(fn, *args):
+        return lambda: [fn(s, *args) for s in series]
+
+    return [
+        ('preprocessing_df.load_csv', lambda: load_csv(train_path), None),
+        ('preprocessing_df.memory_report', lambda: memory_report(raw), None),
+        ('preprocessing_df.fill_missing_values', fill_missing_values, lambda: (raw.copy(),)),
+        ('preprocessing_df.add_time_features', add_time_features, lambda: (filled.copy(),)),
+        ('preprocessing_df.add_time_periods', add_time_periods, lambda: (featured[['hour_id']].copy(),)),
+        ('preprocessing_df.batch_autocorr', lambda: batch_autocorr(daily, lengths, [1, 3, 7]), None),
+        ('preprocessing_df.zone_features', lambda df: zone_features(df, ZFEATURES, AUFEATURES), lambda: (featured.copy(),)),
+        ('non_ml.geo_mean', each(geo_mean), None),
+        ('non_ml.moving_average', each(moving_average, 7), None),
+        ('non_ml.moving_median', each(moving_median, 7), None),
+        ('non_ml.moving_min', each(moving_min, 7), None),
+        ('non_ml.median_estimation', each(median_estimation, [1, 2]), None),
+        ('non_ml.rolling_geo_mean', lambda: rolling_geo_mean(daily, 7), None),
+        ('non_ml.rolling_average', lambda: rolling_average(daily, 7), None),
+        ('non_ml.rolling_median', lambda: rolling_median(daily, 7), None),
+        ('non_ml.rolling_min', lambda: rolling_min(daily, 7), None),
+        ('non_ml.batch_median_estimation', lambda: batch_median_estimation(featured, ['bw_log', 'u_log'], [1, 2]), None),
+        ('tensor.from_frame', lambda: ZoneTensor.from_frame(raw), None),
+        ('tensor.fill_missing_values', lambda: fill_missing_values(tensor), None),
+        ('tensor.zone_features', lambda: zone_features(filled_tensor, ZFEATURES, AUFEATURES), None),
+        ('tensor.batch_median_estimation', lambda: batch_median_estimation(log_tensor, ['bandwidth_total', 'max_user'], [1, 2]), None),
+        ('flat_trees.from_booster', lambda: FlatTrees.from_booster(booster), None),
+        ('flat_trees.predict_rows', lambda: [trees.predict(row) for row in rows], None),
+        ('xgboost.predict_rows', lambda: [booster.predict(xgb.DMatrix(row)) for row in rows], None),
+    ]
+
+def run_entry_point(script, run_dir):
+    """Run an entry point in a directory holding data/, return its wall time and stage times"""
+    report_path = os.path.join(run_dir, 'run_report.json' if script == 'main_combined.py' else 'run_report_baseline.json')
+    # No cached training data, memoized stages nor saved models from a previous run
+    shutil.rmtree(os.path.join(run_dir, 'data', 'cache'), ignore_errors=True)
+    shutil.rmtree(os.path.join(run_dir, 'data', 'pipeline'), ignore_errors=True)
+    shutil.rmtree(os.path.join(run_dir, 'models'), ignore_errors=True)
+    subprocess.check_call([sys.executable, os.path.join(REPO_DIR, script)], cwd=run_dir,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(report_path) as f:
+        report = json.load(f)
+    if report['status'] != 'ok':
+        raise RuntimeError('{} failed: {}'.format(script, report['status']))
+    times = {script: report['wall_time']}
+    for stage in report['stages']:
+        times['{}/{}'.format(script, stage['name'])] = stage['wall_time']
+    return times
+
+# Main program
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time the pipeline functions and entry points on synthetic data.')
+    parser.add_argument('-s', '--scales', nargs='+', default=['small', 'medium'], choices=sorted(SCALES), help='data sizes')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per function (the best one is kept)')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25, help='relative slowdown allowed against the baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--skip-entry-points', action='store_true', help='do not run the entry points')
+    args = parser.parse_args()
+
+    results = {}
+    for scale in args.scales:
+        # =========== DATA ===========
+        try:
+            run_dir = os.path.join(WORK_DIR, scale)
+            train_path = os.path.join(run_dir, 'data', 'train.csv')
+            if not os.path.exists(train_path):
+                write_dataset(os.path.join(run_dir, 'data'), **SCALES[scale])
+            logging.info('{} data ready: {}.'.format(scale, SCALES[scale]))
+        except Exception as e:
+            logging.error('Could not generate the {} data. {}'.format(scale, e))
+            sys.exit()
+
+        # =========== FUNCTIONS ===========
+        for name, fn, setup in function_cases(train_path):
+            try:
+                results['{}/{}'.format(scale, name)] = time_call(fn, setup, args.repeat)
+            except Exception as e:
+                logging.error('{} failed on the {} data. {}'.format(name, scale, e))
+        logging.info('{} functions timed.'.format(scale))
+
+        # =========== ENTRY POINTS ===========
+        if not args.skip_entry_points and SCALES[scale]['n_zones'] <= ENTRY_POINT_MAX_ZONES:
+            for script in ENTRY_POINTS:
+                try:
+                    for name, seconds in run_entry_point(script, run_dir).items():
+                        results['{}/{}'.format(scale, name)] = seconds
+                    logging.info('{} {} timed.'.format(scale, script))
+                except Exception as e:
+                    logging.error('{} failed on the {} data. {}'.format(script, scale, e))
+
+    # =========== COMPARISON WITH THE BASELINE ===========
+    if not os.path.exists(os.path.dirname(RESULTS_PATH)):
+        os.makedirs(os.path.dirname(RESULTS_PATH))
+    save_results(results, RESULTS_PATH)
+    if args.save_baseline:
+        save_results(results, BASELINE_PATH)
+        logging.info('Baseline saved to {}.'.format(BASELINE_PATH))
+    elif os.path.exists(BASELINE_PATH):
+        # Only the cases of this run are compared
+        baseline = {k: v for k, v in load_results(BASELINE_PATH).items() if k.split('/')[0] in args.scales}
+        table = compare(results, baseline, args.tolerance)
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(table.to_string(index=False))
+        regressions = table[table['status'] == 'regression']
+        if len(regressions):
+            logging.error('{} regressions against {}.'.format(len(regressions), BASELINE_PATH))
+            sys.exit(1)
+        logging.info('No regression against {}.'.format(BASELINE_PATH))
+    else:
+        logging.info('Results saved to {} (no baseline to compare with).'.format(RESULTS_PATH))
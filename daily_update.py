@@ -0,0 +1,68 @@
+# Daily update script for AIVIVN's 5th competition: Server bandwidth and max user prediction
+# Appends new hourly data to the saved per-zone state and writes the updated zone features and median estimates
+
+# Import libraries
+import argparse
+import numpy as np
+from utils.preprocessing_df import load_csv
+from utils.incremental import build_state, save_state, load_state
+from utils.training import ZFEATURES, AUFEATURES
+import sys, os, logging, warnings
+
+# Disable future warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+# Log configuration
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+# Set paths
+BASE_DIR = os.path.join('data')
+TRAIN_PATH = os.path.join(BASE_DIR, 'train.csv')
+STATE_PATH = os.path.join(BASE_DIR, 'state.pkl')
+OUTPUT_DIR = os.path.join(BASE_DIR, 'daily')
+
+WINDOWS = [1, 2]
+
+# Main program
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Append new hourly data and update the zone features and medians.')
+    parser.add_argument('input', nargs='?', default=None, help='csv file with the train.csv columns (only the new rows)')
+    parser.add_argument('-s', '--state', default=STATE_PATH, help='state file, built from the training data if missing')
+    parser.add_argument('-o', '--output', default=OUTPUT_DIR, help='output directory')
+    args = parser.parse_args()
+
+    # =========== LOAD THE STATE ===========
+    try:
+        if os.path.exists(args.state):
+            state = load_state(args.state)
+            logging.info('State loaded.')
+        else:
+            state = build_state(load_csv(TRAIN_PATH), WINDOWS)
+            logging.info('State built from the training data.')
+    except Exception as e:
+        logging.error('Could not load the state. {}'.format(e))
+        sys.exit()
+
+    # =========== APPEND THE NEW DATA ===========
+    if args.input is not None:
+        try:
+            new = state.update(load_csv(args.input))
+            logging.info('{} hourly rows appended.'.format(len(new)))
+        except Exception as e:
+            logging.error('Could not append the new data. {}'.format(e))
+            sys.exit()
+
+    # =========== SAVE THE STATE AND THE FEATURES ===========
+    try:
+        save_state(state, args.state)
+        if not os.path.exists(args.output):
+            os.makedirs(args.output)
+        zones, zones_autocorr = state.zone_features(ZFEATURES, AUFEATURES)
+        zones.to_csv(os.path.join(args.output, 'zones.csv'), index=False)
+        zones_autocorr.to_csv(os.path.join(args.output, 'zones_autocorr.csv'), index=False)
+        medians = np.expm1(state.median_estimates())
+        medians.columns = ['bandwidth_total_2', 'max_user_2']
+        medians.to_csv(os.path.join(args.output, 'medians.csv'))
+        logging.info('State and features saved.')
+    except Exception as e:
+        logging.error('Could not save the state or the features. {}'.format(e))
+        sys.exit()
@@ -0,0 +1,66 @@
+# Load generator for the forecast service started by serve.py
+# Sends concurrent requests built from a test_id.csv-style file and reports the latencies
+
+# Import libraries
+import json
+import time
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from urllib.request import Request, urlopen
+from utils.service import REQUEST_COLUMNS
+import os, logging
+
+# Log configuration
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+# Set paths
+BASE_DIR = os.path.join('data')
+TEST_PATH = os.path.join(BASE_DIR, 'test_id.csv')
+
+def post(url, rows):
+    """Send one prediction request"""
+    data = json.dumps({'instances': rows}).encode()
+    req = Request(url + '/predict', data=data, headers={'Content-Type': 'application/json'})
+    with urlopen(req) as res:
+        return json.loads(res.read().decode())
+
+def worker(url, rows, n_requests, batch_rows, latencies, seed):
+    rng = np.random.RandomState(seed)
+    for _ in range(n_requests):
+        sample = [rows[i] for i in rng.randint(len(rows), size=batch_rows)]
+        start = time.time()
+        post(url, sample)
+        latencies.append(time.time() - start)
+
+# Main program
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test the forecast service.')
+    parser.add_argument('input', nargs='?', default=TEST_PATH, help='csv file with the test_id.csv columns')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='service url')
+    parser.add_argument('-c', '--concurrency', type=int, default=16, help='number of concurrent clients')
+    parser.add_argument('-n', '--requests', type=int, default=100, help='number of requests per client')
+    parser.add_argument('-r', '--rows', type=int, default=1, help='rows per request')
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input)
+    df.rename(columns=lambda x: x.lower().strip(), inplace=True)
+    rows = df[REQUEST_COLUMNS].astype({'hour_id': int}).to_dict('records')
+
+    latencies = []
+    threads = [threading.Thread(target=worker, args=(args.url, rows, args.requests, args.rows, latencies, i))
+               for i in range(args.concurrency)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    latencies = np.array(latencies) * 1000
+    logging.info('{} requests in {:.2f}s ({:.0f} requests/s).'.format(len(latencies), elapsed, len(latencies) / elapsed))
+    logging.info('Client latency (ms): p50 {:.1f}, p90 {:.1f}, p99 {:.1f}, max {:.1f}.'.format(
+        *np.percentile(latencies, [50, 90, 99]), latencies.max()))
+    with urlopen(args.url + '/stats') as res:
+        logging.info('Service stats: {}'.format(res.read().decode()))
@@ -9,6 +9,16 @@ from sklearn.linear_model import Ridge
 from sklearn.preprocessing import LabelEncoder
 from utils.preprocessing_df import *
 from utils.non_ml import *
+from utils.special_days import SPECIAL_DAYS_PATH
+from utils import preprocessing_df, special_days, non_ml, training, sharding, tensor
+from utils.artifacts import save_artifacts, load_artifacts, LATEST_FILE
+from utils.training import FEATURES, ZFEATURES, AUFEATURES, RFEATURES, TARGETS
+from utils.training import zone_ids, zone_table, gather_matrix, fit_parallel, holdout_mask, tune_rounds, compare_tree_methods
+from utils.search import load_config
+from utils.training import holdout_mae, warm_start, drift_check
+from utils.profiling import start_run
+from utils.pipeline import Pipeline
+from utils.sharding import map_zones
 import sys, os, logging, warnings
 
 # Disable future warnings
@@ -21,70 +31,287 @@ BASE_DIR = os.path.join('data')
 TRAIN_PATH = os.path.join(BASE_DIR, 'train.csv')
 TEST_PATH = os.path.join(BASE_DIR, 'test_id.csv')
 
+# Processes of the per-zone preprocessing (gap filling, time/special days and zone features),
+# the zones being split into one shard per process (one per core if None, serial if 1)
+PREPROCESS_WORKERS = None
+# Number of threads of each XGBoost model trained in parallel, e.g. [12, 4] (cores split evenly if None)
+N_JOBS = None
+# Tree method of the XGBoost models, and number of days per zone held out to pick the
+# number of boosting rounds with early stopping on MAE (all n_estimators rounds if None)
+TREE_METHOD = 'exact'
+HOLDOUT_DAYS = None
+# With a holdout, also fit every tree method and save their fit times and holdout MAEs
+COMPARE_TREE_METHODS = False
+TREE_METHODS_REPORT = 'tree_methods.csv'
+# XGBoost parameters and blend weight found by search.py (the values below if the file does not exist)
+SEARCH_CONFIG = 'search_config.json'
+# Memoized output of every pipeline stage, reused while the stage's code, parameters and inputs do not change
+PIPELINE_DIR = os.path.join(BASE_DIR, 'pipeline')
+SUBMISSION_PATH = 'submission.csv'
+ARTIFACTS_DIR = os.path.join('models')
+# Periodic retraining: continue the latest saved boosters with WARM_START_ROUNDS rounds on the
+# last WARM_START_DAYS days of each zone, with the zone scaling and Ridge stacker of the saved models,
+# unless their MAE on the last DRIFT_DAYS days (held out of the continued training) is more than
+# DRIFT_THRESHOLD (relative) above the MAE of the saved models on the same days (then fully retrain)
+WARM_START = False
+WARM_START_ROUNDS = 100
+WARM_START_DAYS = 30
+DRIFT_DAYS = 7
+DRIFT_THRESHOLD = 0.1
+# JSON run report with the wall/CPU time, peak RSS growth and row counts of each stage, and optional
+# per-stage profiles in PROFILE_DIR (PROFILE_MODE 'cprofile' or 'sample', none if None)
+RUN_REPORT = 'run_report.json'
+PROFILE_MODE = None
+PROFILE_DIR = 'profiles'
+
+# Days of the median estimation windows
+WINDOWS = [1, 2]
+# Period of the day feature 'time_period': scheme name of TIME_PERIODS in utils/preprocessing_df.py (off if None)
+TIME_PERIOD_SCHEME = None
+
+# Pipeline stages: each one takes the outputs of its input stages and does not modify them
+
+def load_stage(train_path, test_path):
+    """Load the training and testing data"""
+    data = {'train': load_csv(train_path), 'test': load_csv(test_path)}
+    logging.info('Training data and testing data loaded.')
+    return data
+
+def fill_stage(data, n_workers=None):
+    """Fill the missing values of the training data"""
+    df = map_zones(fill_missing_values, data['train'].copy(), n_workers)
+    logging.info('Training data memory usage: {:.2f} MB.'.format(memory_report(df).loc['total', 'bytes'] / 2**20))
+    return df
+
+def time_features_stage(df, data, time_period_scheme=None, n_workers=None):
+    """Add the time features (and the periods of the day) to the filled training data and to the testing data"""
+    train, test = map_zones(add_time_features, df.copy(), n_workers), add_time_features(data['test'].copy(), test=True)
+    if time_period_scheme is not None:
+        train, test = add_time_periods(train, time_period_scheme), add_time_periods(test, time_period_scheme)
+    return {'train': train, 'test': test}
+
+def special_days_stage(data, n_workers=None):
+    """Add the special events features"""
+    return {'train': map_zones(add_special_days_features, data['train'].copy(), n_workers),
+            'test': add_special_days_features(data['test'].copy())}
+
+def previous_stage(artifacts_dir, version=None):
+    """The saved models continued by a warm start, None to fully retrain"""
+    if version is None:
+        return None
+    a = load_artifacts(artifacts_dir, version)
+    return {key: a[key] for key in ['version', 'le', 'scalers', 'ridge', 'boosters']}
+
+def zone_features_stage(data, previous, zfeatures, aufeatures, n_workers=None):
+    """Zone medians and autocorrelation features, with the scalers of the medians
+
+    When warm starting, the zone statistics are also scaled with the scalers of
+    the saved models (under 'warm'), the ones their trees were grown on.
+    """
+    zones, zones_autocorr = all_zone_statistics(data['train'], n_workers)
+    out = {}
+    if previous is not None:
+        warm = scale_zone_features(zones.copy(), zones_autocorr.copy(), zfeatures, aufeatures, previous['scalers'])
+        out['warm'] = dict(zip(['zones', 'zones_autocorr', 'scalers'], warm))
+    zones, zones_autocorr, scalers = scale_zone_features(zones, zones_autocorr, zfeatures, aufeatures)
+    out.update({'zones': zones, 'zones_autocorr': zones_autocorr, 'scalers': scalers})
+    return out
+
+def build_matrices(data, zone, le, features, zfeatures, rfeatures, aufeatures, targets, ridge=None):
+    """Feature matrices of the training and testing data, with the Ridge prediction features
+
+    The zone features are gathered by encoded zone id into one float32 matrix per
+    dataset (columns features + zfeatures + rfeatures + aufeatures), instead of
+    merging the zone tables into the data. The Ridge model and XGBoost both use
+    views of these matrices.
+
+    Args:
+        data (dict): Training and testing dataframes
+        zone (dict): Zone feature tables
+        le (LabelEncoder): Zone encoder
+        features, zfeatures, rfeatures, aufeatures (list): Feature columns
+        targets (list): Target columns
+        ridge (Ridge): Ridge stacker, fitted on the training data if None
+    Return: a dict of the training and testing rows (zone ids in zone_code), their matrices and the Ridge stacker
+    """
+    table = zone_table(zone['zones'], zone['zones_autocorr'], le)
+    columns = features + zfeatures + rfeatures + aufeatures
+
+    frames, matrices = {}, {}
+    for name, keep in [('train', ['ds', 'hour_id'] + targets), ('test', ['id', 'hour_id'])]:
+        df = data[name]
+        ids = zone_ids(df['zone_code'], le)
+        # Rows of zones without zone features are dropped, as the inner merge did
+        if (ids < 0).any():
+            df, ids = df[ids >= 0], ids[ids >= 0]
+        matrices[name] = gather_matrix(df, columns, ids, table, rfeatures)
+        frames[name] = df[keep].copy()
+        frames[name].insert(0, 'zone_code', ids)
+
+    # Add one more feature: linear regression prediction (one Ridge solve fits both targets)
+    n = len(features) + len(zfeatures)
+    if ridge is None:
+        ridge = Ridge(alpha=1)
+        ridge.fit(matrices['train'][:, :n], np.log1p(frames['train'][targets].values))
+    for X in matrices.values():
+        X[:, n:n + len(rfeatures)] = ridge.predict(X[:, :n])
+    return {'train': frames['train'], 'test': frames['test'], 'X_train': matrices['train'], 'X_test': matrices['test'],
+            'ridge': ridge}
+
+def ridge_stage(data, zone, previous, features, zfeatures, rfeatures, aufeatures, targets):
+    """Encode the zones and build the feature matrices with the Ridge prediction features
+
+    When warm starting from saved models with the same zones, the matrices are
+    also built with their zone scaling and Ridge stacker (under 'warm'): the
+    continued trees split on features with the meaning they were grown on.
+    """
+    # Label encoding of the zones with zone features
+    le1 = LabelEncoder()
+    le1.fit(zone['zones']['zone_code'])
+    out = build_matrices(data, zone, le1, features, zfeatures, rfeatures, aufeatures, targets)
+    out['le'] = le1
+    if previous is not None:
+        if list(previous['le'].classes_) == list(le1.classes_):
+            warm = build_matrices(data, zone['warm'], le1, features, zfeatures, rfeatures, aufeatures, targets, previous['ridge'])
+            out['warm'] = {key: warm[key] for key in ['X_train', 'X_test', 'ridge']}
+        else:
+            logging.info('The zones changed since the models {}, full retraining.'.format(previous['version']))
+    logging.info('New features added. Ready for training.')
+    return out
+
+def xgb_stage(data, previous, model_params, targets, n_jobs=None, holdout_days=None, compare=False,
+              warm_start_rounds=100, warm_start_days=30, drift_days=7, drift_threshold=0.1):
+    """Fit the XGBoost models (or continue the saved ones) and predict the testing data
+
+    Args:
+        data (dict): Output of the ridge stage
+        previous (dict): Output of the previous stage (saved models to continue, None to fully retrain)
+        model_params (list): Parameters of the XGBRegressor of each target
+        targets (list): Target columns
+        n_jobs (list): Threads of each model trained in parallel
+        holdout_days (int): Days per zone held out to pick the number of rounds, none if None
+        compare (bool): Also fit and report every tree method on the holdout
+        warm_start_rounds, warm_start_days, drift_days, drift_threshold: Warm start settings
+    Return: a dict of the models, the test predictions, the holdout MAEs, whether the models were warm started
+        and the tree methods report (None if not compared)
+    """
+    dfr, test = data['train'], data['test']
+    m1, m2 = [xgb.XGBRegressor(**params) for params in model_params]
+    logging.info("XGBoost training started...")
+    # Both targets are fitted at the same time on the shared feature matrix of the ridge stage
+    X_train, X_test = data['X_train'], data['X_test']
+    Y_train = np.log1p(dfr[targets].values)
+
+    full_retrain, maes = True, None
+
+    # Warm start from the saved models, on the features built with their scaling and Ridge stacker
+    if 'warm' in data:
+        X_warm = data['warm']['X_train']
+        boosters = [previous['boosters'][col] for col in targets]
+        window = holdout_mask(dfr, warm_start_days)
+        drift = holdout_mask(dfr, drift_days) & window
+        # The saved boosters and the ones continued without the drift days are scored on the same drift days
+        reference = holdout_mae(boosters, X_warm[drift], Y_train[drift])
+        checked = warm_start([m1, m2], boosters, X_warm[window], Y_train[window], warm_start_rounds,
+                             holdout=drift[window], n_jobs=n_jobs)
+        maes = holdout_mae([m.get_booster() for m in checked], X_warm[drift], Y_train[drift])
+        for col, mae, ref in zip(targets, maes, reference):
+            logging.info('{}: warm start drift MAE {:.5f}, saved models {:.5f}.'.format(col, mae, ref))
+        if drift_check(maes, reference, drift_threshold):
+            m1, m2 = warm_start([m1, m2], boosters, X_warm[window], Y_train[window], warm_start_rounds, n_jobs=n_jobs)
+            X_test = data['warm']['X_test']
+            full_retrain = False
+            logging.info('Models {} continued with {} rounds.'.format(previous['version'], warm_start_rounds))
+        else:
+            logging.info('Drift MAE degraded past {:.0%}, full retraining.'.format(drift_threshold))
+            maes = None
+
+    tree_methods = None
+    if full_retrain:
+        if holdout_days:
+            holdout = holdout_mask(dfr, holdout_days)
+            if compare:
+                tree_methods = compare_tree_methods([m1, m2], X_train, Y_train, holdout, targets, n_jobs=n_jobs)
+            report = tune_rounds([m1, m2], X_train, Y_train, holdout, n_jobs=n_jobs)
+            for col, r in zip(targets, report):
+                logging.info('{}: best iteration {best_iteration}, holdout MAE {holdout_mae:.5f}, fit time {fit_time:.1f}s.'.format(col, **r))
+            maes = [r['holdout_mae'] for r in report]
+        m1, m2 = fit_parallel([m1, m2], X_train, Y_train, n_jobs=n_jobs, fit_params={'eval_metric': 'mae'})
+
+    predictions = pd.DataFrame({col: np.expm1(m.predict(X_test)) for m, col in zip([m1, m2], targets)},
+                               index=test.index, columns=targets)
+    logging.info("XGBoost training complete.")
+    return {'models': [m1, m2], 'predictions': predictions, 'holdout_mae': maes, 'warm_start': not full_retrain,
+            'tree_methods': tree_methods}
+
+def median_stage(data, targets, windows):
+    """Median estimation of each target per zone and hour"""
+    logging.info('Non-ml prediction using median estimation...')
+    dfr = data['train'][['zone_code', 'hour_id', 'ds']].copy()
+    dfr['bw_log'] = np.log1p(data['train']['bandwidth_total'])
+    dfr['u_log'] = np.log1p(data['train']['max_user'])
+    medians = np.expm1(batch_median_estimation(dfr, ['bw_log', 'u_log'], windows))
+    medians.columns = [col + '_2' for col in targets]
+    return medians
+
+def blend_stage(data, models, medians, targets, p):
+    """Combine the XGBoost and median predictions"""
+    logging.info('Combining 2 predictions...')
+    test = data['test'][['id', 'zone_code', 'hour_id']].join(models['predictions'])
+    test = test.join(medians, on=['zone_code', 'hour_id'])
+    for col in targets:
+        test[col + '_final'] = p * test[col] + (1 - p) * test[col + '_2']
+    return test
+
+def write_stage(test, data, zone, models, medians, p, windows, targets, features, zfeatures, rfeatures, aufeatures,
+                time_period_scheme, artifacts_dir, submission_path, tree_methods_report):
+    """Save the models into a new version of the artifacts directory and write the submission file (and the tree methods report)"""
+    if models['tree_methods'] is not None:
+        models['tree_methods'].to_csv(tree_methods_report, index=False)
+        logging.info('Tree methods report saved to {}.'.format(tree_methods_report))
+    m1, m2 = models['models']
+    maes, le = models['holdout_mae'], data['le']
+    # Continued models keep the zone scaling and Ridge stacker of the saved ones
+    if models['warm_start']:
+        data, zone = data['warm'], zone['warm']
+    artifacts = {
+        'le': le, 'scalers': zone['scalers'], 'ridge': data['ridge'], 'zones': zone['zones'],
+        'zones_autocorr': zone['zones_autocorr'], 'medians': medians, 'p': p, 'windows': windows, 'targets': targets,
+        'holdout_mae': dict(zip(targets, maes)) if maes else None,
+        'features': features, 'zfeatures': zfeatures, 'rfeatures': rfeatures, 'aufeatures': aufeatures,
+        'time_period_scheme': time_period_scheme
+    }
+    path = save_artifacts(artifacts_dir, artifacts, {'bandwidth_total': m1.get_booster(), 'max_user': m2.get_booster()})
+    logging.info('Models saved to {}.'.format(path))
+
+    test = test.copy()
+    test['bandwidth_total_final'] = test['bandwidth_total_final'].round(2)
+    test['max_user_final'] = test['max_user_final'].round()
+    test['label'] = test['bandwidth_total_final'].astype(str) + ' ' + test['max_user_final'].astype(int).astype(str)
+    test[['id', 'label']].to_csv(submission_path, index=False)
+    return path
+
+def add_preprocessing_stages(pipeline):
+    """Add the stages of the preprocessed training and testing data (load -> fill -> time_features -> special_days)
+
+    backtest.py and search.py run them too, so they share the memoized outputs of main_combined.py.
+
+    Args:
+        pipeline (Pipeline): Pipeline to add the stages to
+    """
+    pipeline.add('load', load_stage, params={'train_path': TRAIN_PATH, 'test_path': TEST_PATH},
+                 files=[TRAIN_PATH, TEST_PATH], modules=[preprocessing_df, tensor])
+    pipeline.add('fill', fill_stage, ['load'], params={'n_workers': PREPROCESS_WORKERS},
+                 modules=[preprocessing_df, sharding, tensor])
+    pipeline.add('time_features', time_features_stage, ['fill', 'load'],
+                 params={'time_period_scheme': TIME_PERIOD_SCHEME, 'n_workers': PREPROCESS_WORKERS},
+                 modules=[preprocessing_df, sharding, tensor])
+    pipeline.add('special_days', special_days_stage, ['time_features'], params={'n_workers': PREPROCESS_WORKERS},
+                 files=[SPECIAL_DAYS_PATH], modules=[special_days, sharding])
+
 # Main program
 if __name__ == "__main__":
-    # =========== LOAD THE DATA ===========
-    try:
-        df, test_df = load_csv(TRAIN_PATH), load_csv(TEST_PATH)
-        logging.info('Training data and testing data loaded.')
-        
-        # Add missing values to the train data 
-        df = fill_missing_values(df)
-        logging.info('Missing values added.')
-    except Exception as e:
-        logging.error('Could not load the data. {}'.format(e))
-        sys.exit()
-    
-    # =========== FEATURE ENGINEERING ===========
-    try:
-        # Time features
-        df, test_df = add_time_features(df), add_time_features(test_df, test=True)
-        # df, test_df = add_time_periods(df), add_time_periods(test_df)
-
-        # Special events features
-        df, test_df = add_special_days_features(df), add_special_days_features(test_df)
-
-        # Zone features
-        zfeatures = ['median_user_1m', 'median_bw_1m', 'median_user_3m', 
-             'median_bw_3m', 'median_user_6m', 'median_bw_6m', 'median_user_1y', 'median_bw_1y', 
-             'median_bw_per_user_6m', 'median_bw_per_user_3m', 'median_bw_per_user_1m', 'median_bw_per_user_1y'
-             ]
-        aufeatures = ['lag_user_1d', 'lag_user_3d', 'lag_user_1w', 'lag_bw_1d', 'lag_bw_3d', 'lag_bw_1w']
-        zones, zones_autocorr = zone_features(df, zfeatures, aufeatures)
-
-        features = ['zone_code', 'hour_id', 'dow_norm', 'month', 'doy', 'year', 'day', 'week', 'abnormal_bw', 'abnormal_u', 'holiday']
-        rfeatures = ['ridge_bw', 'ridge_u']
-
-        # Merge the data with the zone features 
-        dfr = pd.merge(df,zones,on='zone_code')
-        dfr = dfr.merge(zones_autocorr, how='inner', on=['zone_code']).sort_values(by=['update_time','zone_code'], ascending=[True,True])
-
-        test = pd.merge(test_df,zones,on='zone_code')
-        test = test.merge(zones_autocorr, how='inner', on=['zone_code'])
-
-        # Label encoding for categorical features
-        le1 = LabelEncoder()
-        le1.fit(dfr['zone_code'])
-        # le2.fit(dfr['time_period'])
-        dfr['zone_code'] = le1.transform(dfr['zone_code'])
-        test['zone_code'] = le1.transform(test['zone_code'])
-        # dfr['time_period'] = le2.transform(dfr['time_period'])
-        # test['time_period'] = le2.transform(test['time_period'])
-
-        # Add one more feature: linear regression prediction
-        lr1 = Ridge(alpha=1)
-        lr1.fit(dfr[features + zfeatures], np.log1p(dfr['bandwidth_total']))
-        dfr['ridge_bw'] = lr1.predict(dfr[features + zfeatures])
-        test['ridge_bw'] = lr1.predict(test[features + zfeatures])
-
-        lr2 = Ridge(alpha=1)
-        lr2.fit(dfr[features + zfeatures], np.log1p(dfr['max_user']))
-        dfr['ridge_u'] = lr2.predict(dfr[features + zfeatures])
-        test['ridge_u'] = lr2.predict(test[features + zfeatures])
-        logging.info('New features added. Ready for training.')
-    except Exception as e:
-        logging.error('Something wrong with feature engineering. {}'.format(e))
-        sys.exit()
+    start_run('main_combined', RUN_REPORT, PROFILE_DIR, PROFILE_MODE)
 
     # =========== MODELLING ===========
     # Init the XGBoost models
@@ -97,7 +324,7 @@ if __name__ == "__main__":
         booster = 'gbtree',
         subsample = 0.8,
         colsample_bytree = 0.7,
-        tree_method = 'exact',
+        tree_method = TREE_METHOD,
         silent = 0,
         gamma = 0,
         # random_state = 1023
@@ -112,62 +339,64 @@ if __name__ == "__main__":
         booster = 'gbtree',
         subsample = 0.8,
         colsample_bytree = 0.7,
-        tree_method = 'exact',
+        tree_method = TREE_METHOD,
         silent = 0,
         gamma = 0,
         # random_state = 1023
     )
 
-    # Fit the XGBoost models to the data
-    try:
-        logging.info("XGBoost training started...")
-        for i, col in enumerate(['bandwidth_total', 'max_user']):
-            X_train = dfr[features+zfeatures+rfeatures+aufeatures]
-            y_train = dfr[col]
-            if i == 0:
-                m = m1
-                m.fit(X_train, np.log1p(y_train), eval_metric='mae')
-                test[col] = np.expm1(m.predict(test[features+zfeatures+rfeatures+aufeatures]))
-            else:
-                m = m2
-                m.fit(X_train, np.log1p(y_train), eval_metric='mae')
-                test[col] = np.expm1(m.predict(test[features+zfeatures+rfeatures+aufeatures]))
-        logging.info("XGBoost training complete.")
-    except Exception as e:
-        logging.error("Could not train the data. {}".format(e))
-        sys.exit()
+    # Searched parameters
+    search_config = load_config(SEARCH_CONFIG)
+    if search_config is not None:
+        m1.set_params(**search_config['params']['bandwidth_total'])
+        m2.set_params(**search_config['params']['max_user'])
+        logging.info('Model parameters loaded from {}.'.format(SEARCH_CONFIG))
+    # Blend weight of the XGBoost predictions
+    p = search_config['p'] if search_config is not None else 0.8
 
-    # Median/mean based prediction 
+    # =========== PIPELINE ===========
+    # load -> fill -> time_features -> special_days -> zone_features -> ridge -> xgb -> median -> blend -> write
+    # (previous: the saved models of a warm start, used by zone_features, ridge and xgb)
     try:
-        dfr['bw_log'] = np.log1p(dfr['bandwidth_total'])
-        dfr['u_log'] = np.log1p(dfr['max_user'])
-        logging.info('Non-ml prediction using median estimation...')
-        windows = [1,2]
-        for z in dfr.zone_code.unique():
-            zone = dfr[dfr.zone_code == z]
-            for h in df.hour_id.unique():
-                med_bw = median_estimation(zone[zone.hour_id == h]['bw_log'], windows)
-                med_u = median_estimation(zone[zone.hour_id == h]['u_log'], windows)
-                test.loc[(test['zone_code'] == z) & (test['hour_id'] == h), 'bandwidth_total_2'] = np.expm1(med_bw)
-                test.loc[(test['zone_code'] == z) & (test['hour_id'] == h), 'max_user_2'] = np.expm1(med_u)
+        # Warm start from the latest saved models
+        warm_start_from = None
+        if WARM_START and os.path.exists(os.path.join(ARTIFACTS_DIR, LATEST_FILE)):
+            with open(os.path.join(ARTIFACTS_DIR, LATEST_FILE)) as f:
+                warm_start_from = f.read().strip()
+
+        features = FEATURES + ['time_period'] if TIME_PERIOD_SCHEME is not None else FEATURES
+        pipeline = Pipeline(PIPELINE_DIR)
+        add_preprocessing_stages(pipeline)
+        pipeline.add('previous', previous_stage, params={'artifacts_dir': ARTIFACTS_DIR, 'version': warm_start_from},
+                     memo=False)
+        pipeline.add('zone_features', zone_features_stage, ['special_days', 'previous'],
+                     params={'zfeatures': ZFEATURES, 'aufeatures': AUFEATURES, 'n_workers': PREPROCESS_WORKERS},
+                     modules=[preprocessing_df, sharding, tensor])
+        pipeline.add('ridge', ridge_stage, ['special_days', 'zone_features', 'previous'],
+                     params={'features': features, 'zfeatures': ZFEATURES, 'rfeatures': RFEATURES,
+                             'aufeatures': AUFEATURES, 'targets': TARGETS}, modules=[training])
+        pipeline.add('xgb', xgb_stage, ['ridge', 'previous'], params={
+            'model_params': [m1.get_params(), m2.get_params()], 'targets': TARGETS, 'n_jobs': N_JOBS, 'holdout_days': HOLDOUT_DAYS, 'compare': COMPARE_TREE_METHODS,
+            'warm_start_rounds': WARM_START_ROUNDS, 'warm_start_days': WARM_START_DAYS, 'drift_days': DRIFT_DAYS,
+            'drift_threshold': DRIFT_THRESHOLD
+        }, modules=[training])
+        pipeline.add('median', median_stage, ['ridge'], params={'targets': TARGETS, 'windows': WINDOWS}, modules=[non_ml])
+        pipeline.add('blend', blend_stage, ['ridge', 'xgb', 'median'], params={'targets': TARGETS, 'p': p})
+        pipeline.add('write', write_stage, ['blend', 'ridge', 'zone_features', 'xgb', 'median'], params={
+            'p': p, 'windows': WINDOWS, 'targets': TARGETS, 'features': features, 'zfeatures': ZFEATURES,
+            'rfeatures': RFEATURES, 'aufeatures': AUFEATURES, 'time_period_scheme': TIME_PERIOD_SCHEME,
+            'artifacts_dir': ARTIFACTS_DIR, 'submission_path': SUBMISSION_PATH, 'tree_methods_report': TREE_METHODS_REPORT
+        }, memo=False)
     except Exception as e:
-        logging.error("Could not use mean/median tricks. {}".format(e))
+        logging.error('Could not build the pipeline. {}'.format(e))
         sys.exit()
 
-    # Combine 2 predictions 
-    p = 0.8
-    logging.info('Combining 2 predictions...')
-    test['bandwidth_total_final'] = p * test['bandwidth_total'] + (1 - p) * test['bandwidth_total_2']
-    test['max_user_final'] = p * test['max_user'] + (1 - p) * test['max_user_2']
-
-    # =========== SUBMISSION ===========
     try:
-        test['bandwidth_total_final'] = test['bandwidth_total_final'].round(2)
-        test['max_user_final'] = test['max_user_final'].round()
-        test['label'] = test['bandwidth_total_final'].astype(str) + ' ' + test['max_user_final'].astype(int).astype(str)
-        test[['id', 'label']].to_csv('submission.csv', index=False)
+        outputs, status = pipeline.run(['write'])
+        memoized = [name for name, s in status.items() if s == 'memoized']
+        if memoized:
+            logging.info('Stages loaded from {}: {}.'.format(PIPELINE_DIR, ', '.join(memoized)))
         logging.info('Submission file successfully created.')
     except Exception as e:
-        logging.error("Could not save the csv file. {}".format(e))
+        logging.error('{}'.format(e))
         sys.exit()
-
@@ -0,0 +1,55 @@
+# Prediction script for AIVIVN's 5th competition: Server bandwidth and max user prediction
+# Scores a test_id.csv-style file with the models saved by main_combined.py, without the training data
+
+# Import libraries
+import argparse
+from utils.preprocessing_df import load_csv
+from utils.artifacts import load_artifacts, score
+import sys, os, logging, warnings
+
+# Disable future warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+# Log configuration
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+# Set paths
+BASE_DIR = os.path.join('data')
+TEST_PATH = os.path.join(BASE_DIR, 'test_id.csv')
+ARTIFACTS_DIR = os.path.join('models')
+
+# Main program
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Predict the bandwidth and max users with the saved models.')
+    parser.add_argument('input', nargs='?', default=TEST_PATH, help='csv file with the test_id.csv columns')
+    parser.add_argument('-o', '--output', default='submission.csv', help='output csv file')
+    parser.add_argument('-m', '--models', default=ARTIFACTS_DIR, help='artifacts directory')
+    parser.add_argument('-v', '--version', default=None, help='version of the models (the latest if not given)')
+    args = parser.parse_args()
+
+    # =========== LOAD THE MODELS AND THE DATA ===========
+    try:
+        artifacts = load_artifacts(args.models, args.version)
+        test_df = load_csv(args.input)
+        logging.info('Models {} and data loaded.'.format(artifacts['version']))
+    except Exception as e:
+        logging.error('Could not load the models or the data. {}'.format(e))
+        sys.exit()
+
+    # =========== PREDICTION ===========
+    try:
+        test = score(test_df, artifacts)
+        logging.info('Predictions done.')
+    except Exception as e:
+        logging.error('Could not predict. {}'.format(e))
+        sys.exit()
+
+    # =========== SUBMISSION ===========
+    try:
+        test['bandwidth_total_final'] = test['bandwidth_total_final'].round(2)
+        test['max_user_final'] = test['max_user_final'].round()
+        test['label'] = test['bandwidth_total_final'].astype(str) + ' ' + test['max_user_final'].astype(int).astype(str)
+        test[['id', 'label']].to_csv(args.output, index=False)
+        logging.info('Submission file successfully created.')
+    except Exception as e:
+        logging.error("Could not save the csv file. {}".format(e))
+        sys.exit()
@@ -0,0 +1,75 @@
+# Search script for AIVIVN's 5th competition: Server bandwidth and max user prediction
+# Searches the XGBoost parameters and the blend weight over time-based folds and saves the best config
+
+# Import libraries
+from utils.preprocessing_df import load_csv
+from utils.pipeline import Pipeline
+from utils.backtest import rolling_cutoffs
+from utils.search import search, sample_trials, save_config, SEARCH_SPACE
+from main_combined import add_preprocessing_stages, PIPELINE_DIR, TRAIN_PATH
+from backtest import make_models, PIPELINE_CONFIGS
+import sys, logging, warnings
+
+# Disable future warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+# Log configuration
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+# Folds: the last N_FOLDS cutoffs STEP_DAYS days apart, each validated on the following HORIZON_DAYS days
+N_FOLDS = 3
+STEP_DAYS = 30
+HORIZON_DAYS = 30
+# Last days of each fold kept out of the early stopping, on which the blend weight is fitted
+BLEND_DAYS = 10
+# Number of parameter sets drawn from SEARCH_SPACE per target, and fraction kept after each fold
+N_TRIALS = 20
+KEEP = 0.5
+SEED = 0
+# Number of trials fitted at the same time (one per core if None)
+N_WORKERS = None
+# Pipeline searched: 'combined' (main_combined.py) or 'baseline' (xgboost_baseline.py)
+PIPELINE = 'combined'
+CONFIG_PATHS = {'combined': 'search_config.json', 'baseline': 'search_config_baseline.json'}
+TRIALS_REPORT = 'search_trials.csv'
+
+# Main program
+if __name__ == "__main__":
+    # =========== LOAD THE DATA ===========
+    try:
+        # Preprocessed training data of main_combined.py, memoized in PIPELINE_DIR
+        pipeline = Pipeline(PIPELINE_DIR)
+        add_preprocessing_stages(pipeline)
+        outputs, status = pipeline.run(['special_days'])
+        df, hit = outputs['special_days']['train'], status['special_days'] == 'memoized'
+        raw = load_csv(TRAIN_PATH)
+        cutoffs = rolling_cutoffs(raw, N_FOLDS, STEP_DAYS, HORIZON_DAYS)
+        logging.info('Training data loaded{}. Fold cutoffs: {}.'.format(' from {}'.format(PIPELINE_DIR) if hit else '', ', '.join(str(c.date()) for c in cutoffs)))
+    except Exception as e:
+        logging.error('Could not load the data. {}'.format(e))
+        sys.exit()
+
+    # =========== SEARCH ===========
+    try:
+        logging.info('Searching {} parameter sets per target for the {} pipeline...'.format(N_TRIALS, PIPELINE))
+        zfeatures = PIPELINE_CONFIGS[PIPELINE].get('zfeatures')
+        time_period_scheme = PIPELINE_CONFIGS[PIPELINE].get('time_period_scheme')
+        config, report = search(df, raw, cutoffs, make_models(PIPELINE), sample_trials(N_TRIALS, SEARCH_SPACE, SEED),
+                                HORIZON_DAYS, N_WORKERS, KEEP, zfeatures=zfeatures, time_period_scheme=time_period_scheme,
+                                blend_days=BLEND_DAYS)
+        if 'p' in PIPELINE_CONFIGS[PIPELINE]:
+            config['p'] = PIPELINE_CONFIGS[PIPELINE]['p']
+        for target, params in config['params'].items():
+            logging.info('{}: {}.'.format(target, params))
+        logging.info('Blend weight p = {:.3f}.'.format(config['p']))
+    except Exception as e:
+        logging.error('Could not search the parameters. {}'.format(e))
+        sys.exit()
+
+    # =========== SAVE THE CONFIG ===========
+    try:
+        save_config(config, CONFIG_PATHS[PIPELINE])
+        report.to_csv(TRIALS_REPORT, index=False)
+        logging.info('Config saved to {} and trials to {}.'.format(CONFIG_PATHS[PIPELINE], TRIALS_REPORT))
+    except Exception as e:
+        logging.error('Could not save the config. {}'.format(e))
+        sys.exit()
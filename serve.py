@@ -0,0 +1,40 @@
+# Forecast service for AIVIVN's 5th competition: Server bandwidth and max user prediction
+# Serves the models saved by main_combined.py over HTTP, scoring concurrent requests in micro-batches
+
+# Import libraries
+import argparse
+from utils.artifacts import load_artifacts
+from utils.service import make_server
+import sys, os, logging, warnings
+
+# Disable future warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+# Log configuration
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+# Set paths
+ARTIFACTS_DIR = os.path.join('models')
+
+# Main program
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve the bandwidth and max users forecasts over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1', help='host to bind')
+    parser.add_argument('--port', type=int, default=8000, help='port to bind')
+    parser.add_argument('-m', '--models', default=ARTIFACTS_DIR, help='artifacts directory')
+    parser.add_argument('-v', '--version', default=None, help='version of the models (the latest if not given)')
+    parser.add_argument('--max-batch', type=int, default=256, help='maximum number of rows per batch')
+    parser.add_argument('--max-wait', type=float, default=5, help='maximum milliseconds a batch waits for more requests')
+    args = parser.parse_args()
+
+    try:
+        artifacts = load_artifacts(args.models, args.version)
+        server = make_server(artifacts, args.host, args.port, args.max_batch, args.max_wait / 1000)
+    except Exception as e:
+        logging.error('Could not start the service. {}'.format(e))
+        sys.exit()
+
+    logging.info('Serving models {} on http://{}:{} (POST /predict, GET /stats).'.format(artifacts['version'], args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,62 @@
+# Zone features script for AIVIVN's 5th competition: Server bandwidth and max user prediction
+# Computes the zone features of training files larger than memory, read in chunks and spilled to disk by zone
+
+# Import libraries
+import argparse
+from utils.streaming import ZoneSpill
+from utils.profiling import peak_rss_mb
+from utils.training import ZFEATURES, AUFEATURES
+import sys, os, logging, warnings
+
+# Disable future warnings
+warnings.simplefilter(action='ignore', category=FutureWarning)
+# Log configuration
+logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
+
+# Set paths
+BASE_DIR = os.path.join('data')
+TRAIN_PATH = os.path.join(BASE_DIR, 'train.csv')
+OUTPUT_DIR = os.path.join(BASE_DIR, 'zones')
+# Approximate memory budget of the ingestion in MB
+MEMORY_MB = 512
+
+# Main program
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compute the zone features of csv files larger than memory.')
+    parser.add_argument('inputs', nargs='*', default=[TRAIN_PATH], help='csv files with the train.csv columns')
+    parser.add_argument('-m', '--memory', type=float, default=MEMORY_MB, help='memory budget of the ingestion in MB')
+    parser.add_argument('-s', '--spill', default=None, help='directory of the per-zone spill files, kept and appended to (temporary if not set)')
+    parser.add_argument('-o', '--output', default=OUTPUT_DIR, help='output directory')
+    args = parser.parse_args()
+
+    # =========== INGEST THE DATA ===========
+    try:
+        spill = ZoneSpill(args.spill, args.memory)
+        for path in args.inputs:
+            spill.ingest(path)
+            logging.info('{} ingested.'.format(path))
+        logging.info('{} rows of {} zones spilled to {}.'.format(spill.rows, len(spill.files), spill.spill_dir))
+    except Exception as e:
+        logging.error('Could not ingest the data. {}'.format(e))
+        sys.exit()
+
+    # =========== ZONE FEATURES ===========
+    try:
+        zones, zones_autocorr = spill.zone_features(ZFEATURES, AUFEATURES)
+        logging.info('Zone features computed. Peak memory {:.0f} MB.'.format(peak_rss_mb()))
+    except Exception as e:
+        logging.error('Could not compute the zone features. {}'.format(e))
+        sys.exit()
+    finally:
+        spill.close()
+
+    # =========== SAVE THE FEATURES ===========
+    try:
+        if not os.path.exists(args.output):
+            os.makedirs(args.output)
+        zones.to_csv(os.path.join(args.output, 'zones.csv'), index=False)
+        zones_autocorr.to_csv(os.path.join(args.output, 'zones_autocorr.csv'), index=False)
+        logging.info('Zone features saved to {}.'.format(args.output))
+    except Exception as e:
+        logging.error('Could not save the zone features. {}'.format(e))
+        sys.exit()
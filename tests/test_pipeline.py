@@ -0,0 +1,36 @@
+import sys
+import importlib
+from utils.pipeline import Pipeline
+
+STAGES = '''
+def scale(x):
+    return x * {factor}
+
+def double_stage():
+    return scale(21)
+'''
+
+def _run(module_dir, memo_dir, factor):
+    # Stage module written to disk, as the memo key hashes the source files
+    with open(str(module_dir.join('stages_mod.py')), 'w') as f:
+        f.write(STAGES.format(factor=factor))
+    sys.modules.pop('stages_mod', None)
+    importlib.invalidate_caches()
+    module = importlib.import_module('stages_mod')
+    pipeline = Pipeline(str(memo_dir))
+    pipeline.add('double', module.double_stage)
+    return pipeline.run(['double'])
+
+def test_helper_edit_invalidates_memo(tmpdir, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmpdir))
+    # The edits keep the file size: a cached .pyc of the same second would be reused
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    memo_dir = tmpdir.join('memo')
+    outputs, status = _run(tmpdir, memo_dir, 2)
+    assert outputs['double'] == 42 and status['double'] == 'computed'
+    outputs, status = _run(tmpdir, memo_dir, 2)
+    assert outputs['double'] == 42 and status['double'] == 'memoized'
+    # Only the helper changes, not the stage function
+    outputs, status = _run(tmpdir, memo_dir, 3)
+    assert outputs['double'] == 63 and status['double'] == 'computed'
+    sys.modules.pop('stages_mod', None)
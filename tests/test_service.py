@@ -0,0 +1,40 @@
+import threading
+from utils.service import MicroBatcher, check_row
+
+def _predict(rows):
+    if any(row['update_time'] == 'bad' for row in rows):
+        raise ValueError('Unknown datetime string format.')
+    return [row['hour_id'] for row in rows]
+
+def test_bad_request_does_not_fail_its_batch():
+    # A long wait puts both requests in the same batch
+    batcher = MicroBatcher(_predict, max_batch=256, max_wait=0.5)
+    requests = {
+        'good': [{'zone_code': 'ZONE01', 'update_time': '2019-03-10', 'hour_id': 3}],
+        'bad': [{'zone_code': 'ZONE01', 'update_time': 'bad', 'hour_id': 4}],
+    }
+    results = {}
+
+    def send(name):
+        try:
+            results[name] = batcher.submit(requests[name])
+        except Exception as e:
+            results[name] = e
+
+    threads = [threading.Thread(target=send, args=(name,)) for name in requests]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert batcher.stats.batches == 1
+    assert results['good'] == [3]
+    assert isinstance(results['bad'], ValueError)
+
+def test_check_row():
+    assert check_row({'zone_code': 'ZONE01', 'update_time': '2019-03-10', 'hour_id': 23}) is None
+    assert check_row({'zone_code': 'ZONE01', 'update_time': 'not a date', 'hour_id': 0}) is not None
+    assert check_row({'zone_code': 'ZONE01', 'update_time': None, 'hour_id': 0}) is not None
+    assert check_row({'zone_code': 'ZONE01', 'update_time': 'NaT', 'hour_id': 0}) is not None
+    assert check_row({'zone_code': 'ZONE01', 'update_time': '2019-03-10', 'hour_id': 300}) is not None
+    assert check_row({'zone_code': 'ZONE01', 'update_time': '2019-03-10', 'hour_id': '3'}) is not None
+    assert check_row({'zone_code': 'ZONE01', 'hour_id': 3}) is not None
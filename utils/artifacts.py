@@ -0,0 +1,140 @@
+# Saving and loading the trained pipeline, and scoring new data with it
+import os
+import time
+import json
+import pickle
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from utils.preprocessing_df import add_time_features, add_time_periods
+from utils.special_days import add_special_days_features
+from utils.training import zone_ids, zone_table, gather_matrix
+from utils.flat_trees import BoosterPredictor, FlatLinear
+
+ARTIFACTS_FILE = 'artifacts.pkl'
+META_FILE = 'meta.json'
+LATEST_FILE = 'LATEST'
+
+def save_artifacts(base_dir, artifacts, boosters):
+    """Save the trained pipeline into a new versioned directory
+
+    Args:
+        base_dir (STR): Artifacts directory
+        artifacts (dict): Fitted objects, tables and settings of the pipeline (pickled)
+        boosters (dict): XGBoost boosters by target, saved in the XGBoost model format
+    Return: the path of the version directory
+    """
+    version = time.strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(base_dir, version)
+    i = 1
+    while os.path.exists(path):
+        path = os.path.join(base_dir, '{}-{}'.format(version, i))
+        i += 1
+    os.makedirs(path)
+
+    with open(os.path.join(path, ARTIFACTS_FILE), 'wb') as f:
+        pickle.dump(artifacts, f)
+    for target, booster in boosters.items():
+        booster.save_model(os.path.join(path, '{}.model'.format(target)))
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump({'version': os.path.basename(path), 'xgboost': xgb.__version__, 'targets': list(boosters)}, f, indent=4)
+
+    # Point to the newest version
+    with open(os.path.join(base_dir, LATEST_FILE), 'w') as f:
+        f.write(os.path.basename(path))
+    return path
+
+def load_artifacts(base_dir, version=None):
+    """Load a trained pipeline saved by save_artifacts
+
+    Args:
+        base_dir (STR): Artifacts directory
+        version (STR): Version to load, the latest if None
+    Return: the artifacts dict, with the XGBoost boosters by target under 'boosters', and
+        the flat array models used by score under 'predictors' and 'stacker'
+    """
+    if version is None:
+        with open(os.path.join(base_dir, LATEST_FILE)) as f:
+            version = f.read().strip()
+    path = os.path.join(base_dir, version)
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    with open(os.path.join(path, ARTIFACTS_FILE), 'rb') as f:
+        artifacts = pickle.load(f)
+    artifacts['version'] = meta['version']
+    artifacts['boosters'] = {t: xgb.Booster(model_file=os.path.join(path, '{}.model'.format(t))) for t in meta['targets']}
+    return compile_models(artifacts)
+
+def compile_models(artifacts):
+    """Export the boosters and the Ridge stacker of a trained pipeline to flat array models (see flat_trees)
+
+    Args:
+        artifacts (dict): Trained pipeline
+    Return: the artifacts, with the predictors by target under 'predictors' and the Ridge under 'stacker'
+    """
+    artifacts['predictors'] = {t: BoosterPredictor(b) for t, b in artifacts['boosters'].items()}
+    artifacts['stacker'] = FlatLinear.from_sklearn(artifacts['ridge'])
+    return artifacts
+
+def build_features(test_df, artifacts):
+    """Feature matrix of new data with a trained pipeline, the zone features gathered by zone id
+
+    Args:
+        test_df (DataFrame): Input dataframe with the test_id.csv columns
+        artifacts (dict): Trained pipeline from load_artifacts
+    Return: the dataframe of the rows of known zones (zone ids in zone_code) with the medians,
+        and their feature matrix (columns features + zfeatures + rfeatures + aufeatures)
+    """
+    a = artifacts
+    features, zfeatures = a['features'], a['zfeatures']
+
+    # Same features as the training data
+    test = add_special_days_features(add_time_features(test_df, test=True))
+    if a.get('time_period_scheme') is not None:
+        test = add_time_periods(test, a['time_period_scheme'])
+    ids = zone_ids(test['zone_code'], a['le'])
+    test = test[ids >= 0].copy()
+    test['zone_code'] = ids[ids >= 0]
+    X = gather_matrix(test, feature_columns(a), test['zone_code'].values,
+                      zone_table(a['zones'], a['zones_autocorr'], a['le']), a['rfeatures'])
+    n = len(features) + len(zfeatures)
+    stacker = a['stacker'] if 'stacker' in a else FlatLinear.from_sklearn(a['ridge'])
+    X[:, n:n + len(a['rfeatures'])] = stacker.predict(X[:, :n])
+    return test.join(a['medians'], on=['zone_code', 'hour_id']), X
+
+def feature_columns(artifacts):
+    """Columns of the feature matrix of a trained pipeline"""
+    return artifacts['features'] + artifacts['zfeatures'] + artifacts['rfeatures'] + artifacts['aufeatures']
+
+def transform(test_df, artifacts):
+    """Add the features and the median predictions of a trained pipeline to new data
+
+    Args:
+        test_df (DataFrame): Input dataframe with the test_id.csv columns
+        artifacts (dict): Trained pipeline from load_artifacts
+    Return: the dataframe of the rows of known zones with all the model features and the medians
+    """
+    test, X = build_features(test_df, artifacts)
+    for j, col in enumerate(feature_columns(artifacts)):
+        if col != 'zone_code':
+            test[col] = X[:, j]
+    return test
+
+def score(test_df, artifacts):
+    """Predict the targets of new data with a trained pipeline
+
+    Args:
+        test_df (DataFrame): Input dataframe with the test_id.csv columns
+        artifacts (dict): Trained pipeline from load_artifacts
+    Return: the dataframe with the XGBoost, median and final (blended) predictions of each target
+    """
+    a = artifacts
+    test, X = build_features(test_df, a)
+
+    # XGBoost predictions, blended with the medians
+    if 'predictors' not in a:
+        compile_models(a)
+    for col in a['targets']:
+        test[col] = np.expm1(a['predictors'][col].predict(X))
+        test[col + '_final'] = a['p'] * test[col] + (1 - a['p']) * test[col + '_2']
+    return test
@@ -0,0 +1,165 @@
+# Rolling-origin backtesting: the whole pipeline is refitted at historical cutoffs and scored on the following days
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.linear_model import Ridge
+from sklearn.preprocessing import LabelEncoder
+from concurrent.futures import ProcessPoolExecutor
+from utils.preprocessing_df import zone_features, add_time_periods
+from utils.non_ml import batch_median_estimation
+from utils.artifacts import score
+from utils.cache import save_frame, load_frame, load_column
+from utils.training import FEATURES, ZFEATURES, AUFEATURES, RFEATURES, TARGETS
+from utils.training import zone_ids, zone_table, gather_matrix, split_cores
+
+
+def fit_features(df, zfeatures=ZFEATURES, windows=(1, 2), time_period_scheme=None):
+    """Fit the feature part of the main_combined.py pipeline (zone features, Ridge and medians)
+
+    Args:
+        df (DataFrame): Training data with the missing values filled and the time and special days features
+        zfeatures (list): Zone median features used by the models
+        windows (list): Windows of the median estimation
+        time_period_scheme (STR): Scheme of the 'time_period' feature (see add_time_periods), none if None
+    Return: the pipeline as a dict without the boosters and the blend weight, the training
+        dataframe (zone ids in zone_code) and its feature matrix
+    """
+    features = FEATURES
+    if time_period_scheme is not None:
+        df = add_time_periods(df.copy(), time_period_scheme)
+        features = FEATURES + ['time_period']
+    zones, zones_autocorr, scalers = zone_features(df, zfeatures, AUFEATURES, return_scalers=True)
+    le = LabelEncoder()
+    le.fit(zones['zone_code'])
+    ids = zone_ids(df['zone_code'], le)
+    dfr = df.loc[ids >= 0, ['hour_id', 'ds'] + TARGETS]
+    dfr.insert(0, 'zone_code', ids[ids >= 0])
+    X = gather_matrix(df[ids >= 0], features + zfeatures + RFEATURES + AUFEATURES, dfr['zone_code'].values,
+                      zone_table(zones, zones_autocorr, le), RFEATURES)
+
+    n = len(features) + len(zfeatures)
+    lr = Ridge(alpha=1)
+    lr.fit(X[:, :n], np.log1p(dfr[TARGETS].values))
+    X[:, n:n + len(RFEATURES)] = lr.predict(X[:, :n])
+
+    logs = pd.DataFrame({'zone_code': dfr['zone_code'], 'hour_id': dfr['hour_id'], 'ds': dfr['ds'],
+                         'bw_log': np.log1p(dfr['bandwidth_total']), 'u_log': np.log1p(dfr['max_user'])})
+    medians = np.expm1(batch_median_estimation(logs, ['bw_log', 'u_log'], list(windows)))
+    medians.columns = ['bandwidth_total_2', 'max_user_2']
+
+    artifacts = {
+        'le': le, 'scalers': scalers, 'ridge': lr, 'zones': zones, 'zones_autocorr': zones_autocorr,
+        'medians': medians, 'windows': list(windows), 'targets': TARGETS,
+        'features': features, 'zfeatures': zfeatures, 'rfeatures': RFEATURES, 'aufeatures': AUFEATURES,
+        'time_period_scheme': time_period_scheme
+    }
+    return artifacts, dfr, X
+
+def fit_pipeline(df, models, zfeatures=ZFEATURES, p=0.8, windows=(1, 2), time_period_scheme=None):
+    """Fit the pipeline of main_combined.py (zone features, Ridge, XGBoost models and medians)
+
+    Args:
+        df (DataFrame): Training data with the missing values filled and the time and special days features
+        models (list): Unfitted XGBoost models, one per target
+        zfeatures (list): Zone median features used by the models
+        p (float): Weight of the XGBoost predictions in the blend with the medians
+        windows (list): Windows of the median estimation
+        time_period_scheme (STR): Scheme of the 'time_period' feature (see add_time_periods), none if None
+    Return: the pipeline as a dict, in the format of load_artifacts
+    """
+    artifacts, dfr, X = fit_features(df, zfeatures, windows, time_period_scheme)
+    Y = np.log1p(dfr[TARGETS].values)
+    boosters = {}
+    for i, (col, model) in enumerate(zip(TARGETS, models)):
+        boosters[col] = clone(model).fit(X, Y[:, i]).get_booster()
+    artifacts.update({'p': p, 'boosters': boosters})
+    return artifacts
+
+def rolling_cutoffs(df, n_cutoffs, step_days=30, horizon_days=30):
+    """Cutoff days of a rolling-origin backtest, the last one leaving horizon_days days of data
+
+    Args:
+        df (DataFrame): Input dataframe with the update_time column
+        n_cutoffs (int): Number of cutoffs
+        step_days (int): Days between 2 cutoffs
+        horizon_days (int): Forecast horizon in days
+    Return: the list of cutoff Timestamps, oldest first
+    """
+    last = pd.Timestamp(df['update_time'].max()).normalize() - pd.Timedelta(days=horizon_days - 1)
+    return [last - pd.Timedelta(days=step_days * i) for i in reversed(range(n_cutoffs))]
+
+def _run_cutoff(data_dir, cutoff, horizon_days, models, config):
+    """Fit the pipeline on the data before a cutoff and score the following days (runs in a worker process)"""
+    # Only the rows of the cutoff are copied out of the shared memory-mapped files
+    end = cutoff + pd.Timedelta(days=horizon_days)
+    train_dir, raw_dir = os.path.join(data_dir, 'train'), os.path.join(data_dir, 'raw')
+    df = load_frame(train_dir, load_column(train_dir, 'update_time') < np.datetime64(cutoff))
+    times = load_column(raw_dir, 'update_time')
+    raw = load_frame(raw_dir, (times >= np.datetime64(cutoff)) & (times < np.datetime64(end)))
+    artifacts = fit_pipeline(df.reset_index(drop=True), models, **config)
+
+    # Only the observed rows of the known zones are scored
+    actual = raw[raw['zone_code'].isin(artifacts['zones']['zone_code'])].reset_index(drop=True)
+    request = actual[['zone_code', 'update_time', 'hour_id']].copy()
+    request['row'] = np.arange(len(request))
+    pred = score(request, artifacts).set_index('row').reindex(request['row'])
+
+    out = []
+    for col in TARGETS:
+        out.append(pd.DataFrame({
+            'cutoff': cutoff,
+            'zone_code': np.asarray(actual['zone_code'], dtype=object),
+            'horizon': (actual['update_time'] - cutoff).dt.days.values + 1,
+            'target': col,
+            'actual': actual[col].values.astype(np.float64),
+            'forecast': pred[col + '_final'].values.astype(np.float64)
+        }))
+    return pd.concat(out, ignore_index=True)
+
+def backtest(df, raw, cutoffs, models, horizon_days=30, n_workers=None, **config):
+    """Replay the pipeline at historical cutoffs, each cutoff in its own process
+
+    The data is written once as memory-mapped column files shared by all the workers,
+    each of which only copies the rows of its cutoff.
+
+    Args:
+        df (DataFrame): Training data with the missing values filled and the time and special days features
+        raw (DataFrame): Observed data as loaded by load_csv, used as the actual values
+        cutoffs (list): Cutoff days, the models are fitted on the days before each one
+        models (list): Unfitted XGBoost models, one per target
+        horizon_days (int): Number of days forecast after each cutoff
+        n_workers (int): Number of processes, one per core if None
+        config: Extra arguments of fit_pipeline
+    Return: a dataframe with the actual and forecast value of each scored row, target and cutoff
+    """
+    n_workers = min(n_workers or os.cpu_count() or 1, len(cutoffs))
+    threads = split_cores(n_workers)
+    models = [clone(m).set_params(n_jobs=threads[-1]) for m in models]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        save_frame(df, os.path.join(tmp_dir, 'train'))
+        save_frame(raw, os.path.join(tmp_dir, 'raw'))
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(_run_cutoff, tmp_dir, pd.Timestamp(c), horizon_days, models, config) for c in cutoffs]
+            return pd.concat([f.result() for f in futures], ignore_index=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def error_table(errors, by=('zone_code', 'horizon', 'target')):
+    """MAE and sMAPE of backtest forecasts
+
+    Args:
+        errors (DataFrame): Output of backtest
+        by (list): Columns to group by
+    Return: a dataframe with the number of rows, MAE and sMAPE (in %) of each group
+    """
+    e = errors.dropna(subset=['forecast']).copy()
+    e['ae'] = (e['forecast'] - e['actual']).abs()
+    denom = e['forecast'].abs() + e['actual'].abs()
+    e['sape'] = np.where(denom > 0, 200 * e['ae'] / denom.where(denom > 0, 1), 0)
+    table = e.groupby(list(by)).agg({'ae': ['count', 'mean'], 'sape': 'mean'})
+    table.columns = ['n', 'mae', 'smape']
+    return table.reset_index()
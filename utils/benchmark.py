@@ -0,0 +1,70 @@
+# Timing of benchmark cases and comparison with saved baselines
+import json
+import time
+import platform
+import numpy as np
+import pandas as pd
+
+def time_call(fn, setup=None, repeat=3):
+    """Best wall time of a function over some runs
+
+    Args:
+        fn (callable): Function to time, called with the arguments returned by setup
+        setup (callable): Function returning a tuple of fresh arguments before each run (not timed)
+        repeat (int): Number of runs
+    Return: the best time in seconds
+    """
+    best = np.inf
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def save_results(results, path):
+    """Save benchmark times with the machine they were measured on
+
+    Args:
+        results (dict): Seconds by case name
+        path (STR): JSON file path
+    """
+    with open(path, 'w') as f:
+        json.dump({
+            'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor()},
+            'results': results
+        }, f, indent=4, sort_keys=True)
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+def compare(results, baseline, tolerance=0.25, min_seconds=0.01):
+    """Compare benchmark times with a baseline
+
+    A case is a regression when it is more than `tolerance` (relative) and
+    `min_seconds` slower than the baseline, faster when it is as much faster.
+
+    Args:
+        results (dict): Seconds by case name
+        baseline (dict): Baseline seconds by case name
+        tolerance (float): Allowed relative slowdown
+        min_seconds (float): Differences below this are noise
+    Return: a dataframe with the baseline and new time, ratio and status of each case
+    """
+    rows = []
+    for name in sorted(set(results) | set(baseline)):
+        new, base = results.get(name), baseline.get(name)
+        if new is None or base is None:
+            status = 'new' if base is None else 'missing'
+            ratio = None
+        else:
+            ratio = new / base if base > 0 else np.inf
+            if new - base > min_seconds and ratio > 1 + tolerance:
+                status = 'regression'
+            elif base - new > min_seconds and ratio < 1 / (1 + tolerance):
+                status = 'faster'
+            else:
+                status = 'ok'
+        rows.append({'case': name, 'baseline': base, 'time': new, 'ratio': ratio, 'status': status})
+    return pd.DataFrame(rows, columns=['case', 'baseline', 'time', 'ratio', 'status'])
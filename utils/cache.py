@@ -0,0 +1,113 @@
+# Content hashes of files and code, and dataframes saved as bundles of NumPy column files
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+META_FILE = 'meta.json'
+
+def file_hash(path, chunk_size=1 << 20):
+    """Compute the SHA-1 hash of a file
+
+    Args:
+        path (STR): File path
+        chunk_size (int): Number of bytes read at a time
+    Return: the hex digest
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def code_version(*modules):
+    """Version of the feature code, taken as the hash of the modules' source files
+
+    Args:
+        modules: Python modules (or config file paths) which build the data
+    Return: the hex digest
+    """
+    h = hashlib.sha1()
+    for m in modules:
+        h.update(file_hash(getattr(m, '__file__', m)).encode())
+    return h.hexdigest()
+
+def save_frame(df, path):
+    """Save a dataframe as a bundle of NumPy column files
+
+    Numeric and datetime columns are stored as they are, object and categorical
+    columns as integer codes plus their unique values.
+
+    Args:
+        df (DataFrame): Input dataframe
+        path (STR): Output directory, replaced if it exists
+    """
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    meta = {'columns': [], 'index': 'index.npy'}
+    np.save(os.path.join(tmp, 'index.npy'), df.index.values)
+    for i, col in enumerate(df.columns):
+        values = df[col].values
+        entry = {'name': col, 'file': '{}.npy'.format(i)}
+        if isinstance(values, pd.Categorical):
+            entry['categories'] = '{}_categories.npy'.format(i)
+            np.save(os.path.join(tmp, entry['categories']), np.asarray(values.categories, dtype=object))
+            values = values.codes
+        elif values.dtype == object:
+            codes, uniques = pd.factorize(values)
+            entry['uniques'] = '{}_uniques.npy'.format(i)
+            np.save(os.path.join(tmp, entry['uniques']), np.asarray(uniques, dtype=object))
+            values = codes
+        np.save(os.path.join(tmp, entry['file']), values)
+        meta['columns'].append(entry)
+    with open(os.path.join(tmp, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+
+def load_column(path, name):
+    """Memory-mapped values of a numeric or datetime column of a bundle saved by save_frame
+
+    Args:
+        path (STR): Bundle directory
+        name (STR): Column name
+    Return: the read-only array
+    """
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    entry = [e for e in meta['columns'] if e['name'] == name][0]
+    return np.load(os.path.join(path, entry['file']), mmap_mode='r')
+
+def load_frame(path, rows=None):
+    """Load a dataframe saved by save_frame
+
+    The column files are memory-mapped, so with rows only the selected rows are
+    read and copied into the dataframe.
+
+    Args:
+        path (STR): Bundle directory
+        rows (array): Boolean mask or positions of the rows to load (all the rows if None)
+    Return: the dataframe
+    """
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    data = {}
+    for entry in meta['columns']:
+        values = np.load(os.path.join(path, entry['file']), mmap_mode='r')
+        if rows is not None:
+            values = values[rows]
+        if 'uniques' in entry:
+            uniques = np.load(os.path.join(path, entry['uniques']), allow_pickle=True)
+            values = uniques.take(values)
+        elif 'categories' in entry:
+            categories = np.load(os.path.join(path, entry['categories']), allow_pickle=True)
+            values = pd.Categorical.from_codes(values, categories)
+        data[entry['name']] = values
+    index = np.load(os.path.join(path, meta['index']), allow_pickle=True)
+    if rows is not None:
+        index = index[rows]
+    return pd.DataFrame(data, index=index, columns=[e['name'] for e in meta['columns']])
@@ -0,0 +1,163 @@
+# Trained models exported to flat arrays and evaluated with NumPy, without the per-call overhead of XGBoost and sklearn
+import json
+import numpy as np
+import xgboost as xgb
+
+# Objectives whose prediction is the raw margin
+IDENTITY_OBJECTIVES = ['reg:linear', 'reg:squarederror']
+# Rows per traversal block, to bound the (rows x trees) node arrays
+BLOCK_ROWS = 4096
+# Largest batch (rows x trees) predicted with the flat trees, larger ones go to the booster
+FLAT_MAX_PAIRS = 4096
+
+class FlatTrees(object):
+    """Tree ensemble as flat arrays of complete trees, evaluated on a batch with vectorized traversal
+
+    Every tree is padded to a complete binary tree of the maximum depth (a leaf
+    above it becomes splits whose subtrees all hold its value), so the node at
+    position q of a level has the children 2q and 2q+1 and the traversal needs no
+    child arrays. At each level every (row, tree) pair moves down with the rule
+    of XGBoost: right if the float32 feature value is not below the float32 split
+    condition, the default side if it is missing. The leaf values are then added
+    tree by tree in float32 to the base score, in the order of XGBoost, so the
+    predictions are the ones of Booster.predict bit for bit.
+
+    Args:
+        feature (list): Split feature of the nodes of each level, (trees x 2**level) arrays
+        threshold (list): Split condition of the nodes of each level
+        default (list): Side of the missing values (0 left, 1 right) of the nodes of each level
+        value (array): (trees x 2**depth) leaf values
+        base_score (float): Global bias
+    """
+
+    def __init__(self, feature, threshold, default, value, base_score=0.5):
+        self.feature = [f.ravel() for f in feature]
+        self.threshold = [t.ravel() for t in threshold]
+        self.default = [d.ravel() for d in default]
+        self.value = value.ravel()
+        self.n_trees, self.depth = len(value), len(feature)
+        self.base_score = np.float32(base_score)
+
+    @classmethod
+    def from_booster(cls, booster, base_score=None):
+        """Export a trained booster (tree boosters with an identity objective)
+
+        Args:
+            booster (Booster): Trained booster
+            base_score (float): Global bias, read from the booster config if None (0.5 if the
+                XGBoost version has no config)
+        Return: the FlatTrees
+        """
+        if hasattr(booster, 'save_config'):
+            config = json.loads(booster.save_config())['learner']
+            if config['objective']['name'] not in IDENTITY_OBJECTIVES:
+                raise ValueError('Objective {} not supported.'.format(config['objective']['name']))
+            if base_score is None:
+                base_score = float(config['learner_model_param']['base_score'])
+        names = {name: i for i, name in enumerate(booster.feature_names or [])}
+        trees = [json.loads(tree) for tree in booster.get_dump(dump_format='json')]
+
+        def tree_depth(node):
+            return 1 + max(tree_depth(c) for c in node['children']) if 'children' in node else 0
+        depth = max(tree_depth(tree) for tree in trees)
+
+        feature = [np.zeros((len(trees), 2**level), dtype=np.intp) for level in range(depth)]
+        threshold = [np.zeros((len(trees), 2**level), dtype=np.float32) for level in range(depth)]
+        default = [np.zeros((len(trees), 2**level), dtype=np.intp) for level in range(depth)]
+        value = np.zeros((len(trees), 2**depth), dtype=np.float32)
+        for t, tree in enumerate(trees):
+            todo = [(tree, 0, 0)]
+            while todo:
+                node, level, q = todo.pop()
+                if level == depth:
+                    value[t, q] = node['leaf']
+                elif 'leaf' in node:
+                    # Padding split: both subtrees hold the leaf value
+                    todo.extend([(node, level + 1, 2 * q), (node, level + 1, 2 * q + 1)])
+                else:
+                    split = node['split']
+                    feature[level][t, q] = names[split] if split in names else int(split[1:])
+                    threshold[level][t, q] = node['split_condition']
+                    children = {c['nodeid']: c for c in node['children']}
+                    default[level][t, q] = int(node['missing'] == node['no'])
+                    todo.extend([(children[node['yes']], level + 1, 2 * q), (children[node['no']], level + 1, 2 * q + 1)])
+        return cls(feature, threshold, default, value, 0.5 if base_score is None else base_score)
+
+    def leaves(self, X):
+        """Leaf of each row in each tree, as an index of the flat leaf array (rows x trees)"""
+        n_rows, n_cols = X.shape
+        X = X.ravel()
+        rows = (np.arange(n_rows) * n_cols)[:, None]
+        missing = np.isnan(X).any()
+        # Node q of tree t at a level is t * 2**level + q in the level arrays: its children are 2 * node (+ 1)
+        node = np.tile(np.arange(self.n_trees), (n_rows, 1))
+        for level in range(self.depth):
+            x = X[self.feature[level][node] + rows]
+            right = x >= self.threshold[level][node]
+            if missing:
+                right = np.where(np.isnan(x), self.default[level][node], right)
+            node = 2 * node + right
+        return node
+
+    def predict(self, X):
+        """Predict a batch
+
+        Args:
+            X (array): 2-D float32 feature matrix, in the column order of the training matrix
+        Return: the float32 predictions
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        out = np.empty(len(X), dtype=np.float32)
+        for start in range(0, len(X), BLOCK_ROWS):
+            block = X[start:start + BLOCK_ROWS]
+            values = np.empty((len(block), self.n_trees + 1), dtype=np.float32)
+            values[:, 0] = self.base_score
+            values[:, 1:] = self.value[self.leaves(block)]
+            # cumsum adds sequentially (np.sum is pairwise): the float32 rounding of XGBoost
+            out[start:start + BLOCK_ROWS] = np.cumsum(values, axis=1, dtype=np.float32)[:, -1]
+        return out
+
+class BoosterPredictor(object):
+    """Booster predicting small batches with its flat trees
+
+    A DMatrix is built at every Booster.predict call, a fixed cost larger than the
+    traversal of a few rows. The flat traversal costs more per row than the one of
+    XGBoost though, so batches above max_pairs (rows x trees) use the booster. Both
+    give the same predictions.
+
+    Args:
+        booster (Booster): Trained booster
+        max_pairs (int): Largest batch (rows x trees) predicted with the flat trees
+    """
+
+    def __init__(self, booster, max_pairs=FLAT_MAX_PAIRS):
+        self.booster = booster
+        self.trees = FlatTrees.from_booster(booster)
+        self.max_pairs = max_pairs
+
+    def predict(self, X):
+        """Predict a 2-D float32 feature matrix"""
+        if len(X) * self.trees.n_trees <= self.max_pairs:
+            return self.trees.predict(X)
+        return self.booster.predict(xgb.DMatrix(X))
+
+class FlatLinear(object):
+    """Linear model (such as the Ridge stacker) as its coefficient arrays
+
+    Args:
+        coef (array): (targets x features) coefficients
+        intercept (array): Intercept of each target
+    """
+
+    def __init__(self, coef, intercept):
+        self.coef = coef
+        self.intercept = intercept
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Export a fitted sklearn linear model"""
+        return cls(np.asarray(model.coef_), np.asarray(model.intercept_))
+
+    def predict(self, X):
+        """Predict a batch, the same operations as the sklearn predict"""
+        return np.dot(X, self.coef.T) + self.intercept
@@ -0,0 +1,276 @@
+# Per-zone state of the gap filling, zone features and median estimates, updated a day at a time
+import pickle
+import bisect
+import numpy as np
+import pandas as pd
+from collections import deque
+from sklearn.preprocessing import MinMaxScaler
+from utils.preprocessing_df import fill_missing_values, ZONE_WINDOWS, AUTOCORR_WINDOW, AUTOCORR_LAGS
+
+TARGETS = ['max_user', 'bandwidth_total']
+WEEK_HOURS = 24 * 7
+
+def _hours(ds):
+    """Datetimes as integer hours since the epoch"""
+    return pd.to_datetime(ds).values.astype('datetime64[h]').astype(np.int64)
+
+def _window_hours(delta):
+    return int(pd.Timedelta(delta) / pd.Timedelta(hours=1))
+
+def _median(values):
+    """Median of a sorted list, as np.median computes it"""
+    n = len(values)
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2
+
+class IncrementalState(object):
+    """State kept per zone so that appending new hourly data costs time proportional to the new rows
+
+    - the last known value at each hour of the week, to fill the gaps of the new rows
+    - a time-ordered buffer of the last year, with sorted copies of each zone median
+      window and running sums and lagged products of the autocorrelation window
+    - the last values of each (zone, hour) log series, for the median estimation
+
+    The zone features and median estimates match zone_features and
+    batch_median_estimation run on the whole filled history.
+    """
+
+    def __init__(self, windows=(1, 2)):
+        self.windows = list(windows)
+        self.tail_size = max(max(self.windows), self.windows[0])
+        self.window_hours = [_window_hours(delta) for _, delta in ZONE_WINDOWS]
+        self.autocorr_hours = _window_hours(AUTOCORR_WINDOW)
+        self.lags = [lag for _, lag in AUTOCORR_LAGS]
+        self.zones = {}
+        self.max_time = None
+
+    def _new_zone(self, first):
+        z = {
+            'first': first, 'last': first - 1,
+            'slots': np.full((WEEK_HOURS, len(TARGETS)), np.nan),
+            'base': 0, 'ds': deque(), 'values': deque(),
+            'starts': [0] * len(self.window_hours), 'end': 0,
+            'sorted': [[[] for _ in TARGETS] for _ in self.window_hours],
+            'ac_start': 0, 'shift': None,
+            'sums': np.zeros(len(TARGETS)), 'squares': np.zeros(len(TARGETS)),
+            'lagged': np.zeros((len(TARGETS), len(self.lags))),
+            'hours': [{'avail': np.zeros(len(TARGETS), dtype=np.int64), 'tail': deque(maxlen=self.tail_size)} for _ in range(24)],
+        }
+        return z
+
+    def update(self, df):
+        """Append new hourly data
+
+        Args:
+            df (DataFrame): New rows as loaded by load_csv, later than the rows already seen in their zone
+        Return: the new rows with their gaps filled, as fill_missing_values returns them
+        """
+        df = df.copy()
+        df['ds'] = pd.to_datetime(df['update_time']) + pd.to_timedelta(df['hour_id'].astype(np.int64), unit='h')
+        filled = []
+        for code, rows in df.groupby(df['zone_code'].astype(str), sort=False):
+            hours = _hours(rows['ds'])
+            z = self.zones.get(code)
+            if z is None:
+                z = self.zones[code] = self._new_zone(hours.min())
+            if hours.min() <= z['last']:
+                raise ValueError('Zone {} already has data up to {}.'.format(code, pd.Timestamp(np.datetime64(int(z['last']), 'h'))))
+
+            # Fill the gaps with the same hour in the previous weeks
+            new = np.arange(z['last'] + 1, hours.max() + 1)
+            values = np.full((len(new), len(TARGETS)), np.nan, dtype=rows[TARGETS[0]].dtype)
+            values[hours - new[0]] = rows[TARGETS].values
+            for i, t in enumerate(new):
+                slot = (t - z['first']) % WEEK_HOURS
+                known = ~np.isnan(values[i])
+                z['slots'][slot, known] = values[i, known]
+                values[i] = z['slots'][slot]
+            assert not np.isnan(values).any(), 'Error in asserting. There are still nans.'
+            z['last'] = new[-1]
+            z['ds'].extend(new.tolist())
+            z['values'].extend(values.astype(np.float64).tolist())
+            if z['shift'] is None:
+                z['shift'] = values[0].astype(np.float64)
+
+            # Median estimation series, one value per day at each hour
+            logs = np.log1p(values)
+            for t, v in zip(new.tolist(), logs.tolist()):
+                h = z['hours'][t % 24]
+                h['tail'].append(v)
+                h['avail'] += (h['avail'] > 0) | (np.array(v) != 0)
+
+            out = pd.DataFrame({'ds': new.astype('datetime64[h]').astype('datetime64[ns]'), 'zone_code': code})
+            out['hour_id'] = out['ds'].dt.hour
+            for i, col in enumerate(TARGETS):
+                out[col] = values[:, i]
+            filled.append(out)
+
+        self.max_time = max(z['last'] for z in self.zones.values()) // 24 * 24
+        for z in self.zones.values():
+            self._slide(z)
+        return pd.concat(filled, ignore_index=True)[['ds', 'zone_code', 'hour_id', 'bandwidth_total', 'max_user']]
+
+    def _value(self, z, i):
+        return z['values'][i - z['base']]
+
+    def _ds(self, z, i):
+        return z['ds'][i - z['base']]
+
+    def _slide(self, z):
+        """Move the windows of a zone to end at the current max time
+
+        The rows [start, end) of each window are the ones added to its sorted
+        lists or sums; rows leaving a window are removed before new rows are added.
+        """
+        old_end, end = z['end'], z['end']
+        while end - z['base'] < len(z['ds']) and self._ds(z, end) <= self.max_time:
+            end += 1
+
+        # Median windows
+        for w, hours in enumerate(self.window_hours):
+            start, sorted_values = z['starts'][w], z['sorted'][w]
+            while start < old_end and self._ds(z, start) < self.max_time - hours:
+                for j, v in enumerate(self._value(z, start)):
+                    del sorted_values[j][bisect.bisect_left(sorted_values[j], v)]
+                start += 1
+            while start < end and self._ds(z, start) < self.max_time - hours:
+                start += 1
+            for i in range(max(start, old_end), end):
+                for j, v in enumerate(self._value(z, i)):
+                    bisect.insort(sorted_values[j], v)
+            z['starts'][w] = start
+
+        # Autocorrelation window: running sums and lagged products of the shifted values
+        start = z['ac_start']
+        x = lambda i: np.array(self._value(z, i)) - z['shift']
+        while start < old_end and self._ds(z, start) < self.max_time - self.autocorr_hours:
+            xs = x(start)
+            z['sums'] -= xs
+            z['squares'] -= xs * xs
+            for l, lag in enumerate(self.lags):
+                if start + lag < old_end:
+                    z['lagged'][:, l] -= xs * x(start + lag)
+            start += 1
+        while start < end and self._ds(z, start) < self.max_time - self.autocorr_hours:
+            start += 1
+        for i in range(max(start, old_end), end):
+            xi = x(i)
+            z['sums'] += xi
+            z['squares'] += xi * xi
+            for l, lag in enumerate(self.lags):
+                if i - lag >= start:
+                    z['lagged'][:, l] += xi * x(i - lag)
+        z['ac_start'] = start
+        z['end'] = end
+
+        # Drop the rows no window needs anymore
+        first = min(min(z['starts']), z['ac_start'])
+        while z['base'] < first:
+            z['ds'].popleft()
+            z['values'].popleft()
+            z['base'] += 1
+
+    def _autocorr(self, z):
+        """Autocorrelations of the window at each lag, as pd.Series.autocorr computes them"""
+        start, end = z['ac_start'], z['end']
+        n = end - start
+        out = np.full((len(TARGETS), len(self.lags)), np.nan)
+        for l, lag in enumerate(self.lags):
+            m = n - lag
+            if m < 2:
+                continue
+            # Sums of the trailing x[lag:] and leading x[:-lag] parts from the first and last lag values
+            head = np.array([self._value(z, i) for i in range(start, start + lag)]).reshape(-1, len(TARGETS)) - z['shift']
+            tail = np.array([self._value(z, i) for i in range(end - lag, end)]).reshape(-1, len(TARGETS)) - z['shift']
+            sum_a, sum_b = z['sums'] - head.sum(axis=0), z['sums'] - tail.sum(axis=0)
+            sq_a, sq_b = z['squares'] - (head * head).sum(axis=0), z['squares'] - (tail * tail).sum(axis=0)
+            var = (sq_a - sum_a ** 2 / m) * (sq_b - sum_b ** 2 / m)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out[:, l] = np.where(var > 0, (z['lagged'][:, l] - sum_a * sum_b / m) / np.sqrt(var), np.nan)
+        return out.ravel().tolist()
+
+    def zone_features(self, zfeatures, aufeatures):
+        """Zone features of all the data seen so far
+
+        Args:
+            zfeatures (list): List of zone median features
+            aufeatures (list): List of zone autocorr features
+        Return: 2 dataframes, as preprocessing_df.zone_features returns them
+        """
+        codes, zone_rows, autocorr_rows = [], [], []
+        for code in sorted(self.zones):
+            z = self.zones[code]
+            if any(not s[0] for s in z['sorted']):
+                continue
+            row = []
+            for sorted_values in z['sorted']:
+                median_user, median_bw = _median(sorted_values[0]), _median(sorted_values[1])
+                row += [median_user, median_bw, median_bw / median_user]
+            codes.append(code)
+            zone_rows.append(row)
+            autocorr_rows.append(self._autocorr(z))
+
+        zcols = ['median_{}_{}'.format(stat, name) for name, _ in ZONE_WINDOWS for stat in ['user', 'bw', 'bw_per_user']]
+        zones = pd.DataFrame(zone_rows, columns=zcols)
+        zones.insert(0, 'zone_code', codes)
+        aucols = ['lag_{}_{}'.format(stat, name) for stat in ['user', 'bw'] for name, _ in AUTOCORR_LAGS]
+        zones_autocorr = pd.DataFrame(autocorr_rows, columns=aucols).fillna(0)
+        zones_autocorr.insert(0, 'zone_code', codes)
+
+        # Scale the zone features
+        scale1, scale2 = MinMaxScaler(), MinMaxScaler()
+        zones[zfeatures] = scale1.fit_transform(zones[zfeatures])
+        zones_autocorr[aufeatures] = scale2.fit_transform(zones_autocorr[aufeatures])
+        return zones, zones_autocorr
+
+    def median_estimates(self):
+        """Median estimation of the log targets of every zone and hour
+
+        Return: a dataframe indexed by (zone_code, hour_id) with the bw_log and u_log
+            columns, as non_ml.batch_median_estimation returns it
+        """
+        index, rows = [], []
+        for code in sorted(self.zones):
+            for hour, h in enumerate(self.zones[code]['hours']):
+                if not h['tail']:
+                    continue
+                tail = np.array(h['tail'])
+                res = []
+                for j, avail in enumerate(h['avail']):
+                    if avail == 0:
+                        res.append(np.nan)
+                    elif avail < self.windows[0]:
+                        # Median of the values after the first nonzero one
+                        res.append(np.median(tail[len(tail) - avail + 1:, j]) if avail > 1 else np.nan)
+                    else:
+                        M = []
+                        for w in self.windows:
+                            if w > avail:
+                                break
+                            M.append(np.median(tail[len(tail) - w:, j]))
+                        res.append(np.median(M))
+                index.append((code, hour))
+                rows.append(res)
+        index = pd.MultiIndex.from_tuples(index, names=['zone_code', 'hour_id'])
+        return pd.DataFrame(rows, index=index, columns=['u_log', 'bw_log'])[['bw_log', 'u_log']]
+
+def build_state(df, windows=(1, 2)):
+    """Build the incremental state from the whole history
+
+    Args:
+        df (DataFrame): Input dataframe as loaded by load_csv
+        windows (list): Windows of the median estimation
+    Return: the state
+    """
+    state = IncrementalState(windows)
+    state.update(df)
+    return state
+
+def save_state(state, path):
+    with open(path, 'wb') as f:
+        pickle.dump(state, f)
+
+def load_state(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
@@ -1,13 +1,17 @@
 # Some function for estimating the predictions using non-ML approaches
+import warnings
 import numpy as np
 import pandas as pd
+from utils.tensor import ZoneTensor
 
 def geo_mean(iterable):
     """
         Calculate geometric mean of a series
     """
-    a = np.array(iterable)
-    return a.prod()**(1.0/len(a))
+    a = np.array(iterable, dtype=np.float64)
+    # Mean in the log domain, the product overflows on bandwidth values
+    with np.errstate(divide='ignore'):
+        return np.exp(np.log(a).mean())
 
 def moving_average(series, n, gmean=False):
     """
@@ -27,6 +31,48 @@ def moving_median(series, n):
 def moving_min(series, n):
     return np.amin(series[-n:])
 
+def _rolling(X, n, stat):
+    """
+        Apply a pandas rolling statistic along the last axis of a 1-D or 2-D array (one series per row).
+        The first n-1 steps use the observations available so far.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    R = getattr(pd.DataFrame(np.atleast_2d(X).T).rolling(n, min_periods=1), stat)()
+    return R.values.T.reshape(X.shape)
+
+def rolling_geo_mean(X, n):
+    """
+        Geometric mean of the last n observations at every timestep, computed in the log domain
+    """
+    X = np.asarray(X, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = np.log(X)
+    zero = np.isneginf(logs)
+    res = np.exp(_rolling(np.where(zero, 0, logs), n, 'mean'))
+    res[_rolling(zero, n, 'max') > 0] = 0
+    return res
+
+def rolling_average(X, n, gmean=False):
+    """
+        Average of the last n observations at every timestep, for one series or a 2-D array of series
+    """
+    if gmean:
+        return rolling_geo_mean(X, n)
+    else:
+        return _rolling(X, n, 'mean')
+
+def rolling_median(X, n):
+    """
+        Median of the last n observations at every timestep (skiplist based, O(log n) per step)
+    """
+    return _rolling(X, n, 'median')
+
+def rolling_min(X, n):
+    """
+        Minimum of the last n observations at every timestep (monotonic queue based, O(1) amortized per step)
+    """
+    return _rolling(X, n, 'min')
+
 # Based on this kernel: https://www.kaggle.com/safavieh/median-estimation-by-fibonacci-et-al-lb-44-9
 def median_estimation(series, windows):
     """
@@ -43,4 +89,72 @@ def median_estimation(series, windows):
             break
         M.append(series.iloc[-w:].median())
     res = np.median(M)
-    return res
\ No newline at end of file
+    return res
+
+def _series_medians(A, windows):
+    """Median estimation of the series of the rows of A, aligned on their last value (NaN before their first one)"""
+    n_days = A.shape[1]
+    # Number of values from the first nonzero one to the end of each series
+    nonzero = (A != 0) & ~np.isnan(A)
+    avail = np.where(nonzero.any(axis=1), n_days - nonzero.argmax(axis=1), 0)
+
+    # Medians of the last w values, only for the windows before the first one too long
+    fits = np.cumprod([avail >= w for w in windows], axis=0).astype(bool)
+    M = np.stack([np.median(A[:, max(n_days - w, 0):], axis=1) for w in windows])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        res = np.nanmedian(np.where(fits, M, np.nan), axis=0)
+
+    # Series shorter than the first window: median after the first nonzero value
+    short = np.flatnonzero((avail < windows[0]) & (avail > 0))
+    tail = np.where(np.arange(n_days) >= n_days - avail[short, None] + 1, A[short], np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        res[short] = np.nanmedian(tail, axis=1)
+    res[avail == 0] = np.nan
+    return res
+
+def _tensor_median_estimation(tensor, cols, windows):
+    """batch_median_estimation on a ZoneTensor: the series of a zone and hour is
+    the hour view of the zone, its values moved to the end of the days axis"""
+    n_zones, n_days = len(tensor.zones), tensor.n_hours // 24
+    out = {}
+    for col in cols:
+        # (zones x days x hours) -> (zone, hour) x days
+        S = tensor.values[col].reshape(n_zones, n_days, 24).transpose(0, 2, 1).reshape(n_zones * 24, n_days)
+        present = ~np.isnan(S)
+        A = np.take_along_axis(S.astype(np.float64), np.argsort(present, axis=1, kind='mergesort'), axis=1)
+        out[col] = _series_medians(A, windows)
+    counts = present.sum(axis=1)
+    index = pd.MultiIndex.from_product([tensor.zones, np.arange(24)], names=['zone_code', 'hour_id'])
+    return pd.DataFrame(out, index=index, columns=cols)[counts > 0]
+
+def batch_median_estimation(df, cols, windows, time_col='ds'):
+    """
+        Median estimation for every zone and hour at once.
+        The values are pivoted into a zone x hour x day array (days aligned on the
+        last observation) and the medians of all windows are taken along the days.
+        df can also be a ZoneTensor, whose hour views are that array already.
+        Return: a dataframe indexed by (zone_code, hour_id) with one column per value column
+    """
+    if isinstance(df, ZoneTensor):
+        return _tensor_median_estimation(df, cols, windows)
+    zone_codes, zones = pd.factorize(df['zone_code'], sort=True)
+    hours = df['hour_id'].values.astype(np.int64)
+    group = zone_codes * 24 + hours
+    order = np.lexsort((df[time_col].values, group))
+    group = group[order]
+    counts = np.bincount(group, minlength=len(zones) * 24)
+    n_days = max(counts.max(), 1)
+    # Position of each row from the end of its series
+    from_end = counts[group] - 1 - (np.arange(len(group)) - (np.cumsum(counts) - counts)[group])
+    day = n_days - 1 - from_end
+
+    out = {}
+    for col in cols:
+        A = np.full((len(zones) * 24, n_days), np.nan)
+        A[group, day] = df[col].values[order]
+        out[col] = _series_medians(A, windows)
+
+    index = pd.MultiIndex.from_product([zones, np.arange(24)], names=['zone_code', 'hour_id'])
+    return pd.DataFrame(out, index=index, columns=cols)[counts > 0]
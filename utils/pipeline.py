@@ -0,0 +1,177 @@
+# Pipeline of named stages run in dependency order, with the output of each stage memoized on disk
+import os
+import json
+import pickle
+import hashlib
+import inspect
+from collections import OrderedDict
+from utils.cache import file_hash, code_version
+from utils.profiling import stage
+
+class Pipeline(object):
+    """DAG of named stages whose outputs are memoized on disk
+
+    A stage is a function called with the outputs of its input stages (in order)
+    and its keyword parameters. Its memo key is the hash of its name, source code
+    (with the functions of its module it calls), modules, parameters, the constant
+    module globals they read, input files and the content hashes of its inputs'
+    outputs, so a stage only reruns when something upstream of it changed, and the
+    stages after a rerun stage whose output did not change are still loaded from disk. Side effects (writing files) belong to the
+    stages added with memo=False, which always run.
+
+    Args:
+        memo_dir (STR): Memo directory, nothing is memoized if None
+    """
+
+    def __init__(self, memo_dir=None):
+        self.memo_dir = memo_dir
+        self.stages = OrderedDict()
+
+    def add(self, name, fn, inputs=(), params=None, files=(), modules=(), memo=True):
+        """Add a stage after its inputs
+
+        Args:
+            name (STR): Stage name
+            fn (callable): Function called as fn(*input outputs, **params)
+            inputs (list): Names of the stages whose outputs are passed to fn
+            params (dict): Keyword parameters of fn (JSON serializable values)
+            files (list): Paths of the files read by fn, hashed into the memo key
+            modules (list): Python modules (or config file paths) used by fn, hashed into the memo key
+            memo (bool): Whether the output is memoized (stages with side effects always run)
+        """
+        assert name not in self.stages, 'Stage {} already added.'.format(name)
+        for i in inputs:
+            assert i in self.stages, 'Stage {} needs the unknown stage {}.'.format(name, i)
+        self.stages[name] = {
+            'fn': fn, 'inputs': list(inputs), 'params': dict(params or {}),
+            'files': list(files), 'modules': list(modules), 'memo': memo
+        }
+
+    def upstream(self, targets):
+        """Names of the target stages and of all the stages they depend on"""
+        needed, todo = set(), list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in needed:
+                needed.add(name)
+                todo.extend(self.stages[name]['inputs'])
+        return needed
+
+    def key(self, name, input_hashes):
+        """Memo key of a stage given the content hashes of its inputs' outputs"""
+        s = self.stages[name]
+        h = hashlib.sha1(name.encode())
+        fns = stage_functions(s['fn'])
+        for fn in fns:
+            h.update(inspect.getsource(fn).encode())
+        if s['modules']:
+            h.update(code_version(*s['modules']).encode())
+        h.update(json.dumps(s['params'], sort_keys=True, default=repr).encode())
+        for fn in fns:
+            h.update(json.dumps(global_values(fn), sort_keys=True, default=repr).encode())
+        for path in s['files']:
+            h.update(file_hash(path).encode())
+        for input_hash in input_hashes:
+            h.update(input_hash.encode())
+        return h.hexdigest()[:16]
+
+    def _paths(self, name, key):
+        base = os.path.join(self.memo_dir, name, key)
+        return base + '.pkl', base + '.json'
+
+    def run(self, targets=None):
+        """Run the stages needed by the targets, loading memoized outputs when their key did not change
+
+        Args:
+            targets (list): Names of the stages to run, all the stages if None
+        Return: the outputs of the target stages by name, and the status of every stage run
+            ('memoized' or 'computed')
+        """
+        targets = list(self.stages) if targets is None else list(targets)
+        needed = self.upstream(targets)
+        hashes, values, memoized, status = {}, {}, {}, OrderedDict()
+
+        def value(name):
+            # Memoized outputs are only read when a stage needs them
+            if name not in values:
+                with open(memoized[name], 'rb') as f:
+                    values[name] = pickle.load(f)
+            return values[name]
+
+        for name, s in self.stages.items():
+            if name not in needed:
+                continue
+            key = self.key(name, [hashes[i] for i in s['inputs']])
+            memo = s['memo'] and self.memo_dir is not None
+            with stage(name) as counters:
+                if memo:
+                    data_path, meta_path = self._paths(name, key)
+                    if os.path.exists(meta_path):
+                        with open(meta_path) as f:
+                            hashes[name] = json.load(f)['hash']
+                        memoized[name] = data_path
+                        status[name] = counters['memo'] = 'memoized'
+                        continue
+                try:
+                    output = s['fn'](*[value(i) for i in s['inputs']], **s['params'])
+                except Exception as e:
+                    raise RuntimeError('Stage {} failed. {}'.format(name, e))
+                values[name] = output
+                status[name] = counters['memo'] = 'computed'
+                if hasattr(output, 'shape'):
+                    counters['rows'] = output.shape[0]
+                if memo:
+                    data = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+                    hashes[name] = hashlib.sha1(data).hexdigest()[:16]
+                    _write(data, data_path, meta_path, {'stage': name, 'key': key, 'hash': hashes[name]})
+                else:
+                    hashes[name] = key
+        return {name: value(name) for name in targets}, status
+
+def _code_names(code):
+    """Global names read by a code object and by the functions and lambdas nested in it"""
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names.extend(_code_names(const))
+    return names
+
+def stage_functions(fn):
+    """A stage function and the functions of its module it calls, directly or through each other
+
+    Helpers defined next to a stage are part of its code: their source is hashed
+    with the stage's (those of other modules are covered by the stage's modules).
+    """
+    fns, todo = [], [fn]
+    while todo:
+        f = todo.pop(0)
+        if f in fns:
+            continue
+        fns.append(f)
+        for name in _code_names(f.__code__):
+            value = f.__globals__.get(name)
+            if inspect.isfunction(value) and value.__module__ == fn.__module__:
+                todo.append(value)
+    return fns
+
+def global_values(fn):
+    """Values of the constant module globals (strings, numbers, containers) read by a function
+
+    Settings should be passed to the stages as parameters; these are hashed so that
+    a stage reading one directly still reruns when it changes.
+    """
+    values = {}
+    for name in _code_names(fn.__code__):
+        value = fn.__globals__.get(name)
+        if isinstance(value, (str, int, float, bool, list, tuple, dict)):
+            values[name] = value
+    return values
+
+def _write(data, data_path, meta_path, meta):
+    # The meta file is written last: an interrupted write leaves no memo entry
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    with open(data_path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(data_path + '.tmp', data_path)
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
@@ -3,6 +3,7 @@ import numpy as np
 import pandas as pd 
 from functools import reduce
 from sklearn.preprocessing import MinMaxScaler
+from utils.special_days import add_special_days_features
 
 def load_csv(path):
     """Load dataframe from a csv file
@@ -38,46 +39,6 @@ def add_time_features(df):
 
     return df 
 
-def add_special_days_features(df):
-    """Add special events and holidays features
-    
-    Args:
-        df (DataFrame): Input dataframe
-    Return: the modified df
-    """
-    # Days when there were sudden decrease/increase in bandwidth/max users
-    range1 = pd.date_range('2018-02-10', '2018-02-27')
-    range2 = pd.date_range('2019-01-30', '2019-02-12')
-    abnormals = range1.union(range2)
-
-    # For zone 1 only
-    # range3 = pd.date_range('2017-12-23', '2017-12-25')
-
-    # Init 2 new columns
-    df['abnormal_bw'], df['abnormal_u'] = 0,0
-    # Set the abnormal weights for each zone (negative if decrease, positive if increase)
-    # For total bandwidth
-    df.loc[df['zone_code'].isin(['ZONE01']) ,'abnormal_bw'] = df[df['zone_code'].isin(['ZONE01'])].update_time.apply(lambda date: -1 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE02']) ,'abnormal_bw'] = df[df['zone_code'].isin(['ZONE02'])].update_time.apply(lambda date: 0.8 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE03']) ,'abnormal_bw'] = df[df['zone_code'].isin(['ZONE03'])].update_time.apply(lambda date: 0.2 if pd.to_datetime(date) in abnormals else 0)
-
-    # For max users
-    df.loc[df['zone_code'].isin(['ZONE01']) ,'abnormal_u'] = df[df['zone_code'].isin(['ZONE01'])].update_time.apply(lambda date: -1 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE02']) ,'abnormal_u'] = df[df['zone_code'].isin(['ZONE02'])].update_time.apply(lambda date: 0.8 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE03']) ,'abnormal_u'] = df[df['zone_code'].isin(['ZONE03'])].update_time.apply(lambda date: 0.6 if pd.to_datetime(date) in abnormals else 0)
-
-    # Holidays
-    holidays = pd.to_datetime(['2018-01-01', '2017-12-23', '2017-12-24', '2017-12-25',
-                           '2018-02-14', '2018-02-15', '2018-02-16', '2018-02-17', '2018-02-18', '2018-02-19', '2018-02-20',
-                           '2018-03-27', '2018-04-30', '2018-05-01', '2018-09-02', '2018-09-03', '2018-12-31',
-                           '2019-01-01', '2019-02-04', '2019-02-05', '2019-02-06', '2019-02-07', '2019-02-08',
-                           '2019-04-15', 
-                           '2019-04-29', '2019-04-30', '2019-05-01', '2019-09-02',
-                          ])
-    df['holiday'] = df.update_time.apply(lambda date: 1 if pd.to_datetime(date) in holidays else 0)
-
-    return df
-
 def zone_features(df, zfeatures, aufeatures):
     """Create zone features from the data
     
@@ -3,6 +3,8 @@ import numpy as np
 import pandas as pd 
 from functools import reduce
 from sklearn.preprocessing import MinMaxScaler
+from utils.special_days import add_special_days_features
+from utils.preprocessing_df import add_time_periods, fill_missing_values
 
 def load_csv(path):
     """Load dataframe from a csv file
@@ -17,43 +19,6 @@ def load_csv(path):
 
     return df
 
-def fill_missing_values(df):
-    """Fill the missing data points
-    
-    Args:
-        df: Input dataframe
-    Return: the modified dataframe
-    """
-    # Get datetime col
-    df['ds'] = pd.to_datetime(df['update_time']) + df['hour_id'].astype('timedelta64[h]')
-    pdlist = []
-    for z in df.zone_code.unique():
-        zone = df[df['zone_code'] == z]
-        r = pd.date_range(zone.ds.min(), zone.ds.max(), freq='H')
-        ds_range = pd.DataFrame({'ds': r, 'zone_code': z})
-        zone_merged = ds_range.merge(zone, how='left', on=['ds', 'zone_code'])
-        zone_merged['hour_id'] = zone_merged['ds'].dt.hour
-        
-        # Fill the null values 
-        for col in ['bandwidth_total', 'max_user']:
-            for index, row in zone_merged[zone_merged[col].isnull()].iterrows():
-                shifted_index = index - (24*7)
-                flag = True
-                while flag:
-                    fill_val = zone_merged.loc[shifted_index, col]
-                    if pd.isnull(fill_val):
-                        shifted_index -= (24*7)
-                        continue
-                    zone_merged.loc[index, col] = fill_val
-                    flag = False
-
-        pdlist.append(zone_merged)
-
-    out = pd.concat(pdlist)
-    out.drop(['update_time'], axis=1, inplace=True)
-    assert not out.isnull().values.any(), 'Error in asserting. There are still nans.'
-    return out
-
 def add_time_features(df, test=False):
     """Add time features for the data
     
@@ -79,66 +44,6 @@ def add_time_features(df, test=False):
 
     return df 
 
-def add_time_periods(df):
-    """Add time periods of a day 
-    
-    Args:
-        df (DataFrame): Input dataframe
-    Return: the modified df
-    """
-    df['hour_id'] = pd.to_numeric(df['hour_id'])
-    conditions = [
-        (df['hour_id'] >= 21) | (df['hour_id'] < 1),
-        (df['hour_id'] >= 1) & (df['hour_id'] < 6),
-        (df['hour_id'] >= 6) & (df['hour_id'] < 11),
-        (df['hour_id'] >= 11) & (df['hour_id'] < 14),
-        (df['hour_id'] >= 14) & (df['hour_id'] < 17),
-        (df['hour_id'] >= 17) & (df['hour_id'] < 19),
-        (df['hour_id'] >= 19) & (df['hour_id'] < 21),
-    ]
-    choices = ['21h-1h', '1h-6h', '6h-11h', '11h-14h', '14h-17h', '17h-19h', '19h-21h']
-    df['time_period'] = 'default'
-    for cond, ch in zip(conditions, choices):
-        df.loc[cond, 'time_period'] = ch
-    return df
-
-def add_special_days_features(df):
-    """Add special events and holidays features
-    
-    Args:
-        df (DataFrame): Input dataframe
-    Return: the modified df
-    """
-    # Days when there were sudden decrease/increase in bandwidth/max users
-    range1 = pd.date_range('2018-02-10', '2018-02-27')
-    range2 = pd.date_range('2019-01-30', '2019-02-12')
-    abnormals = range1.union(range2)
-
-    # Init 2 new columns
-    df['abnormal_bw'], df['abnormal_u'] = 0,0
-    # Set the abnormal weights for each zone (negative if decrease, positive if increase)
-    # For total bandwidth
-    df.loc[df['zone_code'].isin(['ZONE01']) ,'abnormal_bw'] = df[df['zone_code'].isin(['ZONE01'])].update_time.apply(lambda date: -1 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE02']) ,'abnormal_bw'] = df[df['zone_code'].isin(['ZONE02'])].update_time.apply(lambda date: 0.8 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE03']) ,'abnormal_bw'] = df[df['zone_code'].isin(['ZONE03'])].update_time.apply(lambda date: 0.2 if pd.to_datetime(date) in abnormals else 0)
-
-    # For max users
-    df.loc[df['zone_code'].isin(['ZONE01']) ,'abnormal_u'] = df[df['zone_code'].isin(['ZONE01'])].update_time.apply(lambda date: -1 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE02']) ,'abnormal_u'] = df[df['zone_code'].isin(['ZONE02'])].update_time.apply(lambda date: 0.8 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE03']) ,'abnormal_u'] = df[df['zone_code'].isin(['ZONE03'])].update_time.apply(lambda date: 0.6 if pd.to_datetime(date) in abnormals else 0)
-
-    # Holidays
-    holidays = pd.to_datetime(['2018-01-01', '2017-12-23', '2017-12-24', '2017-12-25',
-                           '2018-02-14', '2018-02-15', '2018-02-16', '2018-02-17', '2018-02-18', '2018-02-19', '2018-02-20',
-                           '2018-03-27', '2018-04-30', '2018-05-01', '2018-09-02', '2018-09-03', '2018-12-31',
-                           '2019-01-01', '2019-02-04', '2019-02-05', '2019-02-06', '2019-02-07', '2019-02-08',
-                           '2019-04-15', 
-                           '2019-04-29', '2019-04-30', '2019-05-01', '2019-09-02',
-                          ])
-    df['holiday'] = df.update_time.apply(lambda date: 1 if pd.to_datetime(date) in holidays else 0)
-
-    return df
-
 def zone_features(df, zfeatures, aufeatures):
     """Create zone features from the data
     
@@ -1,8 +1,40 @@
 # Some utilites functions for loading the data, adding features
+import warnings
 import numpy as np 
 import pandas as pd 
-from functools import reduce
 from sklearn.preprocessing import MinMaxScaler
+from utils.special_days import add_special_days_features
+from utils.sharding import map_zones
+from utils.tensor import ZoneTensor, WEEK_HOURS
+
+# Compact dtypes of the csv columns (lowercase names) and of the time features. The targets
+# stay float64: float32 rounds the bandwidth values, which go through log1p and the medians
+CSV_DTYPES = {
+    'zone_code': 'category',
+    'hour_id': np.int8,
+    'bandwidth_total': np.float64,
+    'max_user': np.float64,
+}
+CSV_DATES = ['update_time']
+TIME_DTYPES = {
+    'hour_id': np.int8,
+    'dow': np.int8,
+    'month': np.int8,
+    'doy': np.int16,
+    'year': np.int16,
+    'day': np.int8,
+    'week': np.int8,
+}
+
+# Zone median windows (ending at the last day of the data) and autocorrelation lags in hours
+ZONE_WINDOWS = [('1m', '30 days'), ('3m', '90 days'), ('6m', '180 days'), ('1y', '365 days')]
+AUTOCORR_WINDOW = '90 days'
+AUTOCORR_LAGS = [('1d', 24), ('3d', 3*24), ('1w', 24*7)]
+# Periods of the day by scheme: (label, first hour) by increasing first hour, each period lasting
+# until the next one starts and the last one wrapping around midnight
+TIME_PERIODS = {
+    'default': [('1h-6h', 1), ('6h-11h', 6), ('11h-14h', 11), ('14h-17h', 14), ('17h-19h', 17), ('19h-21h', 19), ('21h-1h', 21)],
+}
 
 def load_csv(path):
     """Load dataframe from a csv file
@@ -10,48 +42,100 @@ def load_csv(path):
     Args:
         path (STR): File path
     """
+    # Map the csv column names to the lowercase names of the schema
+    names = {c: c.lower().strip() for c in pd.read_csv(path, nrows=0).columns}
+    dtype = {c: CSV_DTYPES[n] for c, n in names.items() if n in CSV_DTYPES}
+    parse_dates = [c for c, n in names.items() if n in CSV_DATES]
+
     # Load the file
-    df = pd.read_csv(path)
+    df = pd.read_csv(path, dtype=dtype, parse_dates=parse_dates)
     # Lowercase column names
-    df.rename(columns=lambda x: x.lower().strip(), inplace=True)
+    df.rename(columns=names, inplace=True)
 
     return df
 
-def fill_missing_values(df):
+def memory_report(df):
+    """Report the memory usage of a dataframe
+    
+    Args:
+        df (DataFrame): Input dataframe
+    Return: a dataframe with the dtype, bytes and bytes per row of each column, and a total row
+    """
+    usage = df.memory_usage(index=True, deep=True)
+    report = pd.DataFrame({
+        'dtype': df.dtypes.astype(str).reindex(usage.index).fillna(''),
+        'bytes': usage
+    })
+    report.loc['total'] = ['', usage.sum()]
+    report['bytes_per_row'] = report['bytes'] / max(len(df), 1)
+    return report
+
+def fill_missing_values(df, return_gaps=False):
     """Fill the missing data points
     
+    Every zone is reindexed onto a complete hourly range and each gap takes the
+    value of the same hour in the previous week, going back further week by week
+    until a value exists. All zones are filled in one pass.
+
     Args:
-        df: Input dataframe
-    Return: the modified dataframe
+        df: Input dataframe (or ZoneTensor, filled in place of the long format)
+        return_gaps (bool): Also return the number of filled gaps per zone
+    Return: the modified dataframe (and the per-zone gap counts if return_gaps)
     """
+    if isinstance(df, ZoneTensor):
+        return _fill_tensor(df, return_gaps)
+
     # Get datetime col
     df['ds'] = pd.to_datetime(df['update_time']) + df['hour_id'].astype('timedelta64[h]')
-    pdlist = []
-    for z in df.zone_code.unique():
-        zone = df[df['zone_code'] == z]
-        r = pd.date_range(zone.ds.min(), zone.ds.max(), freq='H')
-        ds_range = pd.DataFrame({'ds': r, 'zone_code': z})
-        zone_merged = ds_range.merge(zone, how='left', on=['ds', 'zone_code'])
-        zone_merged['hour_id'] = zone_merged['ds'].dt.hour
-        
-        # Fill the null values 
-        for col in ['bandwidth_total', 'max_user']:
-            for index, row in zone_merged[zone_merged[col].isnull()].iterrows():
-                shifted_index = index - (24*7)
-                flag = True
-                while flag:
-                    fill_val = zone_merged.loc[shifted_index, col]
-                    if pd.isnull(fill_val):
-                        shifted_index -= (24*7)
-                        continue
-                    zone_merged.loc[index, col] = fill_val
-                    flag = False
-
-        pdlist.append(zone_merged)
-
-    out = pd.concat(pdlist)
+    # A zone has one row per hour: the last one of duplicated hours is kept
+    df = df.drop_duplicates(['zone_code', 'ds'], keep='last')
+
+    # Build the complete hourly range of every zone at once
+    zone_codes = df.zone_code.unique()
+    bounds = df.groupby('zone_code')['ds'].agg(['min', 'max']).loc[zone_codes]
+    lengths = ((bounds['max'] - bounds['min']) // pd.Timedelta(hours=1)).values.astype(np.int64) + 1
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    ds_range = pd.DataFrame({
+        'ds': np.repeat(bounds['min'].values, lengths) + offsets.astype('timedelta64[h]'),
+        'zone_code': np.repeat(zone_codes, lengths)
+    })
+    out = ds_range.merge(df, how='left', on=['ds', 'zone_code'])
+    out['hour_id'] = out['ds'].dt.hour
+
+    # Fill the null values: the rows of a zone sharing the same hour of the week
+    # form a weekly series, so a forward fill along it walks back week by week
+    cols = ['bandwidth_total', 'max_user']
+    gaps = out[cols].isnull().groupby(out['zone_code'].values, sort=False).sum().astype(np.int64)
+    gaps.index.name = 'zone_code'
+    out[cols] = out.groupby([out['zone_code'].values, offsets % (24*7)])[cols].ffill()
+    out.index = offsets
+
     out.drop(['update_time'], axis=1, inplace=True)
     assert not out.isnull().values.any(), 'Error in asserting. There are still nans.'
+    if return_gaps:
+        return out, gaps
+    return out
+
+def _fill_tensor(tensor, return_gaps=False):
+    """fill_missing_values on a ZoneTensor: the gaps between the first and last hour of
+    each zone take the last value of the same hour of the week, along the weeks axis"""
+    first, last = tensor.bounds()
+    hours = np.arange(tensor.n_hours)
+    inside = (hours >= first[:, None]) & (hours <= last[:, None])
+    n_weeks = tensor.n_hours // WEEK_HOURS
+    values, gaps = {}, {}
+    for col, v in tensor.values.items():
+        gaps[col] = (np.isnan(v) & inside).sum(axis=1)
+        # Week of the last value of each hour of the week, up to every week
+        weeks = v.reshape(len(v), n_weeks, WEEK_HOURS)
+        last_week = np.maximum.accumulate(np.where(np.isnan(weeks), 0, np.arange(n_weeks)[:, None]), axis=1)
+        filled = np.take_along_axis(weeks, last_week, axis=1).reshape(v.shape)
+        values[col] = np.where(inside, filled, np.nan).astype(v.dtype)
+        assert not np.isnan(values[col][inside]).any(), 'Error in asserting. There are still nans.'
+    out = ZoneTensor(tensor.zones, tensor.start, values)
+    if return_gaps:
+        gaps = pd.DataFrame(gaps, index=pd.Index(tensor.zones, name='zone_code'), columns=list(tensor.values))
+        return out, gaps
     return out
 
 def add_time_features(df, test=False):
@@ -64,7 +148,7 @@ def add_time_features(df, test=False):
     if test:
         df['ds'] = pd.to_datetime(df['update_time']) + df['hour_id'].astype('timedelta64[h]')
     else:
-        df['update_time'] = df['ds'].dt.date
+        df['update_time'] = df['ds'].dt.normalize()
     df['dow'] = df['ds'].dt.dayofweek
     df['month'] = df['ds'].dt.month
     df['doy'] = df['ds'].dt.dayofyear
@@ -72,6 +156,8 @@ def add_time_features(df, test=False):
     df['day'] = df['ds'].dt.day
     df['week'] = df['ds'].dt.week
     # df['weekend'] = df['dow'] // 5 == 1
+    for col, dtype in TIME_DTYPES.items():
+        df[col] = df[col].astype(dtype)
 
     # Normalise day of week col
     week_period = 7 / (2 * np.pi)
@@ -79,138 +165,278 @@ def add_time_features(df, test=False):
 
     return df 
 
-def add_time_periods(df):
+def period_tables(scheme='default', zone_schemes=None, schemes=TIME_PERIODS):
+    """Lookup arrays of the period code of every hour, one per scheme used
+
+    The codes index one label list shared by all the schemes used.
+
+    Args:
+        scheme (STR): Scheme of the zones without their own
+        zone_schemes (dict): Scheme name by zone code
+        schemes (dict): Periods by scheme name, see TIME_PERIODS
+    Return: the scheme names, the (schemes x 24) int8 array of codes and the labels
+    """
+    names = [scheme] + sorted(set((zone_schemes or {}).values()) - {scheme})
+    labels, tables = [], np.empty((len(names), 24), dtype=np.int8)
+    for i, name in enumerate(names):
+        periods = schemes[name]
+        for label, _ in periods:
+            if label not in labels:
+                labels.append(label)
+        # Hours before the first start belong to the last period
+        index = np.searchsorted([start for _, start in periods], np.arange(24), side='right') - 1
+        tables[i] = np.array([labels.index(label) for label, _ in periods])[index]
+    return names, tables, labels
+
+def add_time_periods(df, scheme='default', zone_schemes=None, schemes=TIME_PERIODS):
     """Add time periods of a day 
-    
+
+    The int8 period code of each row is gathered from the lookup array of its
+    zone's scheme, indexed by hour_id (see period_tables for the labels).
+
     Args:
         df (DataFrame): Input dataframe
+        scheme (STR): Scheme of the zones without their own
+        zone_schemes (dict): Scheme name by zone code
+        schemes (dict): Periods by scheme name, see TIME_PERIODS
     Return: the modified df
     """
-    df['hour_id'] = pd.to_numeric(df['hour_id'])
-    conditions = [
-        (df['hour_id'] >= 21) | (df['hour_id'] < 1),
-        (df['hour_id'] >= 1) & (df['hour_id'] < 6),
-        (df['hour_id'] >= 6) & (df['hour_id'] < 11),
-        (df['hour_id'] >= 11) & (df['hour_id'] < 14),
-        (df['hour_id'] >= 14) & (df['hour_id'] < 17),
-        (df['hour_id'] >= 17) & (df['hour_id'] < 19),
-        (df['hour_id'] >= 19) & (df['hour_id'] < 21),
-    ]
-    choices = ['21h-1h', '1h-6h', '6h-11h', '11h-14h', '14h-17h', '17h-19h', '19h-21h']
-    df['time_period'] = 'default'
-    for cond, ch in zip(conditions, choices):
-        df.loc[cond, 'time_period'] = ch
+    names, tables, _ = period_tables(scheme, zone_schemes, schemes)
+    hours = df['hour_id'].values.astype(np.intp)
+    if len(names) == 1:
+        df['time_period'] = tables[0][hours]
+    else:
+        codes, zones = pd.factorize(df['zone_code'])
+        zone_scheme = np.array([names.index(zone_schemes.get(z, scheme)) for z in zones], dtype=np.intp)
+        df['time_period'] = tables[zone_scheme[codes], hours]
     return df
 
-def add_special_days_features(df):
-    """Add special events and holidays features
+def batch_autocorr(X, lengths, lags=None):
+    """Autocorrelation of many series at once, as pd.Series.autocorr computes it
     
+    The lagged products of all the series come from a single FFT, so the cost
+    does not grow with the number of lags.
+
     Args:
-        df (DataFrame): Input dataframe
-    Return: the modified df
+        X (array): 2-D array with one series per row, padded after its length
+        lengths (array): Length of each series
+        lags (list): Lags to return, all lags from 0 if None
+    Return: a 2-D array (series x lags), NaN where the lag is too long or a series is constant
     """
-    # Days when there were sudden decrease/increase in bandwidth/max users
-    range1 = pd.date_range('2018-02-10', '2018-02-27')
-    range2 = pd.date_range('2019-01-30', '2019-02-12')
-    abnormals = range1.union(range2)
-
-    # Init 2 new columns
-    df['abnormal_bw'], df['abnormal_u'] = 0,0
-    # Set the abnormal weights for each zone (negative if decrease, positive if increase)
-    # For total bandwidth
-    df.loc[df['zone_code'].isin(['ZONE01']) ,'abnormal_bw'] = df[df['zone_code'].isin(['ZONE01'])].update_time.apply(lambda date: -1 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE02']) ,'abnormal_bw'] = df[df['zone_code'].isin(['ZONE02'])].update_time.apply(lambda date: 0.8 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE03']) ,'abnormal_bw'] = df[df['zone_code'].isin(['ZONE03'])].update_time.apply(lambda date: 0.2 if pd.to_datetime(date) in abnormals else 0)
-
-    # For max users
-    df.loc[df['zone_code'].isin(['ZONE01']) ,'abnormal_u'] = df[df['zone_code'].isin(['ZONE01'])].update_time.apply(lambda date: -1 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE02']) ,'abnormal_u'] = df[df['zone_code'].isin(['ZONE02'])].update_time.apply(lambda date: 0.8 if pd.to_datetime(date) in abnormals else 0)
-    df.loc[df['zone_code'].isin(['ZONE03']) ,'abnormal_u'] = df[df['zone_code'].isin(['ZONE03'])].update_time.apply(lambda date: 0.6 if pd.to_datetime(date) in abnormals else 0)
-
-    # Holidays
-    holidays = pd.to_datetime(['2018-01-01', '2017-12-23', '2017-12-24', '2017-12-25',
-                           '2018-02-14', '2018-02-15', '2018-02-16', '2018-02-17', '2018-02-18', '2018-02-19', '2018-02-20',
-                           '2018-03-27', '2018-04-30', '2018-05-01', '2018-09-02', '2018-09-03', '2018-12-31',
-                           '2019-01-01', '2019-02-04', '2019-02-05', '2019-02-06', '2019-02-07', '2019-02-08',
-                           '2019-04-15', 
-                           '2019-04-29', '2019-04-30', '2019-05-01', '2019-09-02',
-                          ])
-    df['holiday'] = df.update_time.apply(lambda date: 1 if pd.to_datetime(date) in holidays else 0)
+    X = np.asarray(X, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    width = X.shape[1]
+    lags = np.arange(width) if lags is None else np.asarray(lags, dtype=np.int64)
 
-    return df
+    # Center the series (the correlation does not change) and zero the padding
+    mask = np.arange(width) < lengths[:, None]
+    X = np.where(mask, X, 0)
+    X = np.where(mask, X - (X.sum(axis=1) / np.maximum(lengths, 1))[:, None], 0)
 
-def zone_features(df, zfeatures, aufeatures):
-    """Create zone features from the data
+    # Sum of x[i + lag] * x[i] for every lag
+    nfft = 1 << int(np.ceil(np.log2(max(2 * width - 1, 1))))
+    f = np.fft.rfft(X, n=nfft, axis=1)
+    # (the power spectrum from real products: the complex product rounds differently with the number of rows)
+    lagged = np.fft.irfft(f.real ** 2 + f.imag ** 2, n=nfft, axis=1)[:, :width]
+
+    # Sums and sums of squares of the leading x[:-lag] and trailing x[lag:] parts
+    zeros = np.zeros((len(X), 1))
+    s1 = np.hstack([zeros, np.cumsum(X, axis=1)])
+    s2 = np.hstack([zeros, np.cumsum(X * X, axis=1)])
+    k = np.broadcast_to(np.minimum(lags, width), (len(X), len(lags)))
+    n = np.broadcast_to(lengths[:, None], k.shape)
+    m = np.clip(n - k, 0, width)
+    gather = lambda a, i: np.take_along_axis(a, i, axis=1)
+    sum_a, sum_b = gather(s1, n) - gather(s1, k), gather(s1, m)
+    sq_a, sq_b = gather(s2, n) - gather(s2, k), gather(s2, m)
+    prod = gather(lagged, np.minimum(k, width - 1))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = prod - sum_a * sum_b / m
+        var = (sq_a - sum_a ** 2 / m) * (sq_b - sum_b ** 2 / m)
+        corr = np.where((m >= 2) & (var > 0), cov / np.sqrt(var), np.nan)
+    return corr
+
+def zone_statistics(df, max_time=None, width=None):
+    """Zone medians and autocorrelation features before scaling
     
+    The rows are sorted by zone and time once; the windows of every zone are then
+    slices of that sorted view ending at the last day of the data.
+
     Args:
-        df (DataFrame): Input dataframe
-        zfeatures (list): List of zone median features
-        aufeatures (list): List of zone autocorr features
-    Return: 2 dataframes
+        df (DataFrame): Input dataframe (hourly data without gaps), or ZoneTensor
+        max_time (datetime64): Last day of the windows, the last day of df if None
+        width (int): Padded width of the autocorrelation windows (see autocorr_width), the
+            longest window of df if None. It sets the FFT length, so the zones split into
+            parts get the results of the whole data with the width of the whole data
+    Return: 2 dataframes, ordered by zone code
     """
+    if isinstance(df, ZoneTensor):
+        return _tensor_statistics(df, max_time)
+    if max_time is None:
+        max_time = np.datetime64(df['ds'].max().floor('D'))
 
-    # Creates time variables
-    max_time = df['ds'].max().floor('D')
-    delta1m = pd.Timedelta('30 days')
-    delta3m = pd.Timedelta('90 days')
-    delta6m = pd.Timedelta('180 days')
-    delta1y = pd.Timedelta('365 days')
+    # Sort the rows by zone and time, zone z occupies the rows bounds[z]:bounds[z+1]
+    codes, uniques = pd.factorize(df['zone_code'], sort=True)
+    ds = df['ds'].values
+    order = np.lexsort((ds, codes))
+    codes, ds = codes[order], ds[order]
+    users = df['max_user'].values.astype(np.float64)[order]
+    bws = df['bandwidth_total'].values.astype(np.float64)[order]
+    bounds = np.searchsorted(codes, np.arange(len(uniques) + 1))
 
-    past_1m = max_time - delta1m
-    past_3m = max_time - delta3m
-    past_6m = max_time - delta6m
-    past_1y = max_time - delta1y
+    # First row of each zone at or after a time (last row + 1 if side is right)
+    def window_start(t, side='left'):
+        before = ds <= t if side == 'right' else ds < t
+        return bounds[:-1] + np.add.reduceat(before.astype(np.int64), bounds[:-1])
+    ends = window_start(max_time, side='right')
+    starts = [window_start(max_time - np.timedelta64(pd.Timedelta(delta))) for _, delta in ZONE_WINDOWS]
+    # Zones without data in one of the windows are left out
+    keep = np.flatnonzero(np.all([s < ends for s in starts], axis=0))
 
     # Medians from the last 1,3,6,12 months
-    zones_1y = df[(df['ds'] >= past_1y) & (df['ds'] <= max_time)].groupby(['zone_code'], as_index=False).agg({
-        'max_user': 'median', 
-        'bandwidth_total': 'median' 
-    })
-    zones_1y.columns = ['zone_code','median_user_1y','median_bw_1y']
-    zones_1y['median_bw_per_user_1y'] = zones_1y['median_bw_1y'] / zones_1y['median_user_1y']
+    zone_rows = []
+    for z in keep:
+        row = []
+        for start in starts:
+            median_user, median_bw = np.median(users[start[z]:ends[z]]), np.median(bws[start[z]:ends[z]])
+            row += [median_user, median_bw, median_bw / median_user]
+        zone_rows.append(row)
+    zcols = ['median_{}_{}'.format(stat, name) for name, _ in ZONE_WINDOWS for stat in ['user', 'bw', 'bw_per_user']]
+    zones = pd.DataFrame(zone_rows, columns=zcols)
+    zones.insert(0, 'zone_code', uniques.take(keep))
 
-    zones_1m = df[(df['ds'] >= past_1m) & (df['ds'] <= max_time)].groupby(['zone_code'], as_index=False).agg({
-        'max_user': 'median', 
-        'bandwidth_total': 'median' 
-    })
-    zones_1m.columns = ['zone_code','median_user_1m','median_bw_1m']
-    zones_1m['median_bw_per_user_1m'] = zones_1m['median_bw_1m'] / zones_1m['median_user_1m']
+    # Autocorrelation features: the windows of all zones are padded into one array
+    start = window_start(max_time - np.timedelta64(pd.Timedelta(AUTOCORR_WINDOW)))[keep]
+    lengths = ends[keep] - start
+    if width is None:
+        width = max(lengths.max(), 1) if len(keep) else 1
+    assert not len(keep) or width >= lengths.max(), 'The autocorrelation windows are longer than the width.'
+    idx = np.minimum(start[:, None] + np.arange(width), len(ds) - 1)
+    lags = [lag for _, lag in AUTOCORR_LAGS]
+    autocorr = np.hstack([batch_autocorr(x[idx], lengths, lags) for x in [users, bws]])
+    aucols = ['lag_{}_{}'.format(stat, name) for stat in ['user', 'bw'] for name, _ in AUTOCORR_LAGS]
+    zones_autocorr = pd.DataFrame(autocorr, columns=aucols).fillna(0)
+    zones_autocorr.insert(0, 'zone_code', uniques.take(keep))
+    return zones, zones_autocorr
 
-    zones_3m = df[(df['ds'] >= past_3m) & (df['ds'] <= max_time)].groupby(['zone_code'], as_index=False).agg({
-        'max_user': 'median', 
-        'bandwidth_total': 'median' 
-    })
-    zones_3m.columns = ['zone_code','median_user_3m','median_bw_3m']
-    zones_3m['median_bw_per_user_3m'] = zones_3m['median_bw_3m'] / zones_3m['median_user_3m']
+def autocorr_width(df, max_time):
+    """Padded width of the autocorrelation windows zone_statistics uses on df
 
-    zones_6m = df[(df['ds'] >= past_6m) & (df['ds'] <= max_time)].groupby(['zone_code'], as_index=False).agg({
-        'max_user': 'median',
-        'bandwidth_total': 'median' 
-    })
-    zones_6m.columns = ['zone_code','median_user_6m','median_bw_6m']
-    zones_6m['median_bw_per_user_6m'] = zones_6m['median_bw_6m'] / zones_6m['median_user_6m']
-
-    # Autocorrelation features
-    zones_autocorr = df[(df['ds'] >= past_3m) & (df['ds'] <= max_time)].groupby(['zone_code'], as_index=False).agg({
-        'max_user': {
-            'lag_user_1d' :lambda x: pd.Series.autocorr(x, 24),
-            'lag_user_3d' :lambda x: pd.Series.autocorr(x, 3*24),
-            'lag_user_1w' :lambda x: pd.Series.autocorr(x, 24*7),
-        }, 
-        'bandwidth_total': {
-            'lag_bw_1d' :lambda x: pd.Series.autocorr(x, 24),
-            'lag_bw_3d' :lambda x: pd.Series.autocorr(x, 3*24),
-            'lag_bw_1w' :lambda x: pd.Series.autocorr(x, 24*7),
-        }
-    }).fillna(0)
-    zones_autocorr.columns.droplevel()
-    zones_autocorr.reset_index()
-    zones_autocorr.columns = ['zone_code','lag_user_1d','lag_user_3d','lag_user_1w','lag_bw_1d','lag_bw_3d','lag_bw_1w']
-    zones = reduce(lambda x,y: pd.merge(x,y, on='zone_code', how='inner'), [zones_1m, zones_3m, zones_6m, zones_1y])
-
-    # Scale the zone features
-    scale1, scale2 = MinMaxScaler(), MinMaxScaler()
-    zones[zfeatures] = scale1.fit_transform(zones[zfeatures])
-    zones_autocorr[aufeatures] = scale2.fit_transform(zones_autocorr[aufeatures])
-
-    return zones, zones_autocorr
\ No newline at end of file
+    The longest autocorrelation window of the zones it keeps (those with data in
+    the shortest zone window, all the windows ending at max_time).
+
+    Args:
+        df (DataFrame): Input dataframe (hourly data without gaps)
+        max_time (datetime64): Last day of the windows
+    Return: the width
+    """
+    codes, uniques = pd.factorize(df['zone_code'])
+    ds = df['ds'].values
+    shortest = min(pd.Timedelta(delta) for _, delta in ZONE_WINDOWS)
+    window = (ds >= max_time - np.timedelta64(pd.Timedelta(AUTOCORR_WINDOW))) & (ds <= max_time)
+    recent = (ds >= max_time - np.timedelta64(shortest)) & (ds <= max_time)
+    lengths = np.bincount(codes[window], minlength=len(uniques))
+    kept = np.bincount(codes[recent], minlength=len(uniques)) > 0
+    return int(max(lengths[kept].max(), 1)) if kept.any() else 1
+
+def _tensor_statistics(tensor, max_time=None, block=1024):
+    """zone_statistics on a ZoneTensor: the windows are column ranges of the tensor, taken
+    for blocks of zones (the autocorrelations match up to floating point rounding)"""
+    if max_time is None:
+        max_time = (tensor.start + tensor.bounds()[1].max()).astype('datetime64[D]')
+    max_time = np.datetime64(max_time, 'D')
+    end = tensor.hour(max_time) + 1
+    starts = [max(tensor.hour(max_time - np.timedelta64(pd.Timedelta(delta))), 0) for _, delta in ZONE_WINDOWS]
+    start = max(tensor.hour(max_time - np.timedelta64(pd.Timedelta(AUTOCORR_WINDOW))), 0)
+    users, bws = tensor.values['max_user'], tensor.values['bandwidth_total']
+    lags = [lag for _, lag in AUTOCORR_LAGS]
+
+    medians, autocorr, keep = [], [], []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for z in range(0, len(tensor.zones), block):
+            rows = slice(z, z + block)
+            # Zones without data in one of the windows are left out
+            counts = np.array([(~np.isnan(users[rows, s:end])).sum(axis=1) for s in starts])
+            kept = np.flatnonzero((counts > 0).all(axis=0))
+            # Medians from the last 1,3,6,12 months
+            block_medians = []
+            for s in starts:
+                median_user = np.nanmedian(users[rows, s:end][kept].astype(np.float64), axis=1)
+                median_bw = np.nanmedian(bws[rows, s:end][kept].astype(np.float64), axis=1)
+                block_medians += [median_user, median_bw, median_bw / median_user]
+            medians.append(np.column_stack(block_medians))
+            # Autocorrelation features: the values of each window moved to its start
+            block_autocorr = []
+            for x in [users, bws]:
+                window = x[rows, start:end][kept].astype(np.float64)
+                present = ~np.isnan(window)
+                X = np.take_along_axis(window, np.argsort(~present, axis=1, kind='mergesort'), axis=1)
+                block_autocorr.append(batch_autocorr(X, present.sum(axis=1), lags))
+            autocorr.append(np.hstack(block_autocorr))
+            keep.append(z + kept)
+    keep = np.concatenate(keep) if keep else np.array([], dtype=np.int64)
+
+    zcols = ['median_{}_{}'.format(stat, name) for name, _ in ZONE_WINDOWS for stat in ['user', 'bw', 'bw_per_user']]
+    zones = pd.DataFrame(np.vstack(medians) if medians else None, columns=zcols)
+    zones.insert(0, 'zone_code', tensor.zones.take(keep))
+    aucols = ['lag_{}_{}'.format(stat, name) for stat in ['user', 'bw'] for name, _ in AUTOCORR_LAGS]
+    zones_autocorr = pd.DataFrame(np.vstack(autocorr) if autocorr else None, columns=aucols).fillna(0)
+    zones_autocorr.insert(0, 'zone_code', tensor.zones.take(keep))
+    return zones, zones_autocorr
+
+def zone_features(df, zfeatures, aufeatures, return_scalers=False, n_workers=1, scalers=None):
+    """Create zone features from the data
+    
+    Args:
+        df (DataFrame): Input dataframe (hourly data without gaps)
+        zfeatures (list): List of zone median features
+        aufeatures (list): List of zone autocorr features
+        return_scalers (bool): Also return the 2 fitted MinMaxScalers
+        n_workers (int): Processes computing the statistics of the zones split by zone (one per core if None)
+        scalers (tuple): 2 fitted MinMaxScalers to apply, fitted on the data if None
+    Return: 2 dataframes (and the scalers if return_scalers)
+    """
+    zones, zones_autocorr = all_zone_statistics(df, n_workers)
+    zones, zones_autocorr, scalers = scale_zone_features(zones, zones_autocorr, zfeatures, aufeatures, scalers)
+    if return_scalers:
+        return zones, zones_autocorr, scalers
+    return zones, zones_autocorr
+
+def all_zone_statistics(df, n_workers=1):
+    """Unscaled zone statistics of all the zones, in order of zone code
+
+    Args:
+        df (DataFrame or ZoneTensor): Input data (hourly data without gaps)
+        n_workers (int): Processes computing the statistics of the zones split by zone (one per core if None)
+    Return: 2 dataframes
+    """
+    if isinstance(df, ZoneTensor):
+        return zone_statistics(df)
+    max_time = np.datetime64(df['ds'].max().floor('D'))
+    # The shards use the autocorrelation width of the whole data
+    width = autocorr_width(df, max_time) if n_workers != 1 else None
+    zones, zones_autocorr = map_zones(zone_statistics, df, n_workers, max_time=max_time, width=width)
+    if n_workers != 1:
+        # The shards are in order of first row, the zones of the whole data in order of zone code
+        order = np.argsort(pd.factorize(zones['zone_code'], sort=True)[0], kind='mergesort')
+        zones, zones_autocorr = zones.iloc[order].reset_index(drop=True), zones_autocorr.iloc[order].reset_index(drop=True)
+    return zones, zones_autocorr
+
+def scale_zone_features(zones, zones_autocorr, zfeatures, aufeatures, scalers=None):
+    """Scale the zone statistics of all the zones into [0, 1]
+
+    Args:
+        zones (DataFrame): Zone medians from zone_statistics (modified)
+        zones_autocorr (DataFrame): Zone autocorrelation features from zone_statistics (modified)
+        zfeatures (list): List of zone median features
+        aufeatures (list): List of zone autocorr features
+        scalers (tuple): 2 fitted MinMaxScalers to apply, fitted on these zones if None
+    Return: the 2 dataframes and the 2 MinMaxScalers
+    """
+    if scalers is None:
+        scalers = MinMaxScaler().fit(zones[zfeatures]), MinMaxScaler().fit(zones_autocorr[aufeatures])
+    zones[zfeatures] = scalers[0].transform(zones[zfeatures])
+    zones_autocorr[aufeatures] = scalers[1].transform(zones_autocorr[aufeatures])
+    return zones, zones_autocorr, scalers
@@ -0,0 +1,232 @@
+# Stage timings and resource counters of a run, saved as a JSON run report
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import platform
+import threading
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+def peak_rss_mb(who='self'):
+    """Peak resident set size of the process (or of its waited-for children) in MB"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    return usage.ru_maxrss * RSS_UNIT / 2**20
+
+def cpu_times():
+    """CPU seconds of the process and of its waited-for children"""
+    t = os.times()
+    return t.user + t.system, t.children_user + t.children_system
+
+class StackSampler(object):
+    """Sampling profiler: records the stack of a thread every `interval` seconds
+
+    The stacks are counted in the folded format of flame graph tools
+    ('file:function;file:function count' per line, outermost call first).
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append('{}:{}'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+class RunProfiler(object):
+    """Wall time, CPU time, peak RSS growth and counters of the stages of a run
+
+    Args:
+        name (STR): Run name
+        profile_dir (STR): Directory of the per-stage profiles, none if None
+        mode (STR): 'cprofile' (a .prof file per stage) or 'sample' (a .folded stack file per stage)
+        interval (float): Seconds between 2 samples of the sampling profiler
+    """
+
+    def __init__(self, name, profile_dir=None, mode=None, interval=0.005):
+        assert mode in (None, 'cprofile', 'sample'), 'Unknown profiling mode {}.'.format(mode)
+        self.name = name
+        self.profile_dir = profile_dir if mode else None
+        self.mode = mode
+        self.interval = interval
+        self.stages = []
+        self.status = 'running'
+        self._stack = []
+        self._cprofile_active = False
+        self._start = time.time()
+        self._cpu = cpu_times()
+
+    @contextmanager
+    def stage(self, name):
+        """Measure a stage; the yielded dict takes extra counters such as 'rows'
+
+        Stages can be nested, their names are then joined with '/'. The peak RSS
+        of a process only grows, so a stage records the peak of the run so far at
+        its end (max_rss_so_far_mb) and by how much the stage raised it
+        (peak_rss_increase_mb, 0 if the stage stayed below an earlier peak).
+        """
+        self._stack.append(name)
+        full_name = '/'.join(self._stack)
+        counters = {}
+        profiler = self._start_profiler()
+        start, (cpu, children_cpu) = time.time(), cpu_times()
+        rss, children_rss = peak_rss_mb(), peak_rss_mb('children')
+        record = {'name': full_name, 'status': 'ok'}
+        try:
+            yield counters
+        except BaseException as e:
+            record['status'] = 'error'
+            record['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+            raise
+        finally:
+            end_cpu, end_children_cpu = cpu_times()
+            end_rss, end_children_rss = peak_rss_mb(), peak_rss_mb('children')
+            record.update({
+                'wall_time': time.time() - start,
+                'cpu_time': end_cpu - cpu,
+                'children_cpu_time': end_children_cpu - children_cpu,
+                'max_rss_so_far_mb': end_rss,
+                'peak_rss_increase_mb': end_rss - rss if rss is not None else None,
+                'children_max_rss_so_far_mb': end_children_rss,
+                'children_peak_rss_increase_mb': end_children_rss - children_rss if children_rss is not None else None,
+                'counters': counters
+            })
+            if profiler is not None:
+                record['profile'] = self._stop_profiler(profiler, full_name)
+            self.stages.append(record)
+            self._stack.pop()
+
+    def _start_profiler(self):
+        if self.profile_dir is None:
+            return None
+        if self.mode == 'cprofile':
+            # Only one cProfile can run at a time: nested stages are part of the outer profile
+            if self._cprofile_active:
+                return None
+            self._cprofile_active = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler(threading.current_thread().ident, self.interval)
+            profiler.start()
+        return profiler
+
+    def _stop_profiler(self, profiler, name):
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        path = os.path.join(self.profile_dir, name.replace('/', '.'))
+        if self.mode == 'cprofile':
+            profiler.disable()
+            self._cprofile_active = False
+            path += '.prof'
+            profiler.dump_stats(path)
+        else:
+            profiler.stop()
+            path += '.folded'
+            profiler.dump(path)
+        return path
+
+    def report(self):
+        """The run report as a dict"""
+        cpu, children_cpu = cpu_times()
+        return {
+            'run': self.name,
+            'status': self.status,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self._start)),
+            'argv': sys.argv,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'versions': _package_versions(),
+            'wall_time': time.time() - self._start,
+            'cpu_time': cpu - self._cpu[0],
+            'children_cpu_time': children_cpu - self._cpu[1],
+            'peak_rss_mb': peak_rss_mb(),
+            'children_peak_rss_mb': peak_rss_mb('children'),
+            'stages': self.stages
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=4)
+
+def _package_versions():
+    versions = {}
+    for name in ['numpy', 'pandas', 'sklearn', 'xgboost']:
+        module = sys.modules.get(name)
+        if module is not None:
+            versions[name] = getattr(module, '__version__', None)
+    return versions
+
+# Profiler of the current run, used by stage()
+_run = None
+
+def start_run(name, report_path=None, profile_dir=None, mode=None):
+    """Start profiling the stages of a run
+
+    Args:
+        name (STR): Run name
+        report_path (STR): Path of the JSON run report, written when the program exits
+        profile_dir (STR): Directory of the per-stage profiles
+        mode (STR): None, 'cprofile' or 'sample'
+    Return: the RunProfiler
+    """
+    global _run
+    _run = RunProfiler(name, profile_dir, mode)
+    if report_path is not None:
+        def save():
+            if _run.status == 'running':
+                _run.status = 'ok' if not any(s['status'] == 'error' for s in _run.stages) else 'error'
+            _run.save(report_path)
+        atexit.register(save)
+    return _run
+
+@contextmanager
+def stage(name):
+    """Measure a stage of the current run (does nothing if no run was started)
+
+    Usage:
+        with stage('fill_missing_values') as counters:
+            df = fill_missing_values(df)
+            counters['rows'] = len(df)
+    """
+    if _run is None:
+        yield {}
+    else:
+        with _run.stage(name) as counters:
+            yield counters
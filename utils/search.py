@@ -0,0 +1,211 @@
+# Hyperparameter and blend weight search over time-based folds
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from concurrent.futures import ProcessPoolExecutor
+from utils.artifacts import build_features
+from utils.backtest import fit_features
+from utils.training import split_cores, TARGETS
+
+SEARCH_SPACE = {
+    'max_depth': [3, 4, 5, 6],
+    'eta': [0.01, 0.02, 0.05],
+    'subsample': [0.6, 0.7, 0.8, 0.9, 1.0],
+    'colsample_bytree': [0.5, 0.6, 0.7, 0.8, 1.0]
+}
+
+def sample_trials(n_trials, space=SEARCH_SPACE, seed=0):
+    """Draw distinct parameter sets from a search space
+
+    Args:
+        n_trials (int): Number of parameter sets
+        space (dict): Candidate values of each parameter
+        seed (int): Random seed
+    Return: the list of parameter dicts
+    """
+    rng = np.random.RandomState(seed)
+    n_trials = min(n_trials, int(np.prod([len(v) for v in space.values()])))
+    trials = []
+    while len(trials) < n_trials:
+        params = {k: v[rng.randint(len(v))] for k, v in sorted(space.items())}
+        params = {k: v.item() if hasattr(v, 'item') else v for k, v in params.items()}
+        if params not in trials:
+            trials.append(params)
+    return trials
+
+def build_folds(df, raw, cutoffs, horizon_days, fold_dir, zfeatures=None, time_period_scheme=None, blend_days=10):
+    """Build the feature matrices of each fold once, as .npy files shared by all the trials
+
+    Fold k is trained on the days before cutoffs[k] and validated on the observed
+    rows of the following horizon_days days. The rows of the last blend_days of
+    them are marked (B_val.npy) to be kept out of the early stopping.
+
+    Args:
+        df (DataFrame): Training data with the missing values filled and the time and special days features
+        raw (DataFrame): Observed data as loaded by load_csv
+        cutoffs (list): Cutoff days
+        horizon_days (int): Number of validation days after each cutoff
+        fold_dir (STR): Output directory
+        zfeatures (list): Zone median features (those of fit_features if None)
+        time_period_scheme (STR): Scheme of the 'time_period' feature (see add_time_periods), none if None
+        blend_days (int): Number of last validation days held out of the early stopping
+    Return: the list of fold directories
+    """
+    assert 0 < blend_days < horizon_days, 'blend_days must be between 0 and horizon_days.'
+    paths = []
+    for k, cutoff in enumerate(cutoffs):
+        cutoff = pd.Timestamp(cutoff)
+        config = {'time_period_scheme': time_period_scheme}
+        if zfeatures is not None:
+            config['zfeatures'] = zfeatures
+        artifacts, dfr, X_train = fit_features(df[df['update_time'] < cutoff].reset_index(drop=True), **config)
+
+        actual = raw[(raw['update_time'] >= cutoff) & (raw['update_time'] < cutoff + pd.Timedelta(days=horizon_days))]
+        actual = actual[actual['zone_code'].isin(artifacts['zones']['zone_code'])].reset_index(drop=True)
+        val, X_val = build_features(actual, artifacts)
+
+        path = os.path.join(fold_dir, str(k))
+        os.makedirs(path)
+        np.save(os.path.join(path, 'X_train.npy'), X_train)
+        np.save(os.path.join(path, 'Y_train.npy'), np.log1p(dfr[TARGETS].values))
+        np.save(os.path.join(path, 'X_val.npy'), X_val)
+        np.save(os.path.join(path, 'Y_val.npy'), np.log1p(val[TARGETS].values.astype(np.float64)))
+        np.save(os.path.join(path, 'M_val.npy'), val[[t + '_2' for t in TARGETS]].values.astype(np.float64))
+        blend_start = cutoff + pd.Timedelta(days=horizon_days - blend_days)
+        np.save(os.path.join(path, 'B_val.npy'), (val['update_time'] >= blend_start).values)
+        paths.append(path)
+    return paths
+
+def _run_trial(model, params, fold_path, i, early_stopping_rounds):
+    """Fit a model on a fold with early stopping on the validation MAE (runs in a worker process)
+
+    The early stopping only sees the validation rows before the blend days; the
+    predictions and the holdout MAE are those of the blend days.
+    """
+    X = np.load(os.path.join(fold_path, 'X_train.npy'), mmap_mode='r')
+    y = np.load(os.path.join(fold_path, 'Y_train.npy'), mmap_mode='r')[:, i]
+    X_val = np.load(os.path.join(fold_path, 'X_val.npy'), mmap_mode='r')
+    y_val = np.load(os.path.join(fold_path, 'Y_val.npy'), mmap_mode='r')[:, i]
+    blend = np.load(os.path.join(fold_path, 'B_val.npy'))
+    model = clone(model).set_params(**params)
+    model.fit(X, y, eval_set=[(X_val[~blend], y_val[~blend])], eval_metric='mae',
+              early_stopping_rounds=early_stopping_rounds, verbose=False)
+    pred = model.predict(X_val[blend])
+    return {'mae': model.best_score, 'best_iteration': model.best_iteration,
+            'holdout_mae': float(np.mean(np.abs(pred - y_val[blend]))), 'pred': np.expm1(pred)}
+
+def blend_weight(preds, medians, actuals):
+    """Weight p of the model predictions in the blend p * pred + (1 - p) * median
+
+    p minimizes the squared relative error of the blend (closed form), which
+    follows the sMAPE of the competition, and is clipped to [0, 1].
+
+    Args:
+        preds (array): Model predictions
+        medians (array): Median predictions
+        actuals (array): Actual values
+    Return: the weight (float)
+    """
+    ok = ~(np.isnan(preds) | np.isnan(medians)) & (actuals > 0)
+    d, r = (preds - medians)[ok], (actuals - medians)[ok]
+    w = 1 / actuals[ok] ** 2
+    if not np.sum(w * d * d) > 0:
+        return 1.0
+    return float(np.clip(np.sum(w * d * r) / np.sum(w * d * d), 0, 1))
+
+def search(df, raw, cutoffs, models, trials, horizon_days=30, n_workers=None,
+           keep=0.5, early_stopping_rounds=50, zfeatures=None, time_period_scheme=None, blend_days=10):
+    """Search the XGBoost parameters of each target and the blend weight over time-based folds
+
+    The trials of both targets run in parallel processes, one fold at a time
+    starting from the most recent one; after each fold only the best `keep`
+    fraction of the trials of each target goes on to the next fold (successive
+    halving). The number of rounds of each trial comes from early stopping on
+    the validation MAE of the days before the last blend_days of each fold. The
+    blend weight is fitted on the predictions of the best trials for those last
+    days, without retraining: they were not used to pick the rounds, so p is not
+    fitted on predictions tuned to the same rows (the holdout MAE of the report
+    comes from them too).
+
+    Args:
+        df (DataFrame): Training data with the missing values filled and the time and special days features
+        raw (DataFrame): Observed data as loaded by load_csv
+        cutoffs (list): Cutoff days of the folds
+        models (list): Unfitted XGBoost models with the base parameters, one per target
+        trials (list): Parameter dicts to try (see sample_trials)
+        horizon_days (int): Number of validation days after each cutoff
+        n_workers (int): Number of processes, one per core if None
+        keep (float): Fraction of the trials kept after each fold
+        early_stopping_rounds (int): Rounds without improvement before stopping
+        zfeatures (list): Zone median features (those of fit_features if None)
+        time_period_scheme (STR): Scheme of the 'time_period' feature (see add_time_periods), none if None
+        blend_days (int): Number of last validation days of each fold held out of the early
+            stopping, used for the blend weight
+    Return: the best config (dict with the parameters of each target and the blend weight p)
+        and a dataframe with the early stopping and holdout MAE of each trial and fold
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    threads = split_cores(n_workers)[-1]
+    models = [clone(m).set_params(n_jobs=threads) for m in models]
+    folds = sorted(cutoffs, reverse=True)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        paths = build_folds(df, raw, folds, horizon_days, tmp_dir, zfeatures, time_period_scheme, blend_days)
+        alive = {i: list(range(len(trials))) for i in range(len(TARGETS))}
+        results = {}
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            for k, path in enumerate(paths):
+                futures = {(i, t): pool.submit(_run_trial, models[i], trials[t], path, i, early_stopping_rounds)
+                           for i in alive for t in alive[i]}
+                for key, f in futures.items():
+                    results[key + (k,)] = f.result()
+                if k < len(paths) - 1:
+                    for i in alive:
+                        n_keep = max(int(np.ceil(len(alive[i]) * keep)), 1)
+                        alive[i] = sorted(alive[i], key=lambda t: np.mean([results[(i, t, j)]['mae'] for j in range(k + 1)]))[:n_keep]
+
+        rows = []
+        for (i, t, k), r in sorted(results.items()):
+            row = {'target': TARGETS[i], 'trial': t, 'cutoff': folds[k], 'mae': r['mae'], 'holdout_mae': r['holdout_mae'],
+                   'best_iteration': r['best_iteration']}
+            row.update(trials[t])
+            rows.append(row)
+        report = pd.DataFrame(rows)
+
+        # Best trial of each target, then the blend weight from their predictions of the blend days
+        config = {'params': {}}
+        preds, medians, actuals = [], [], []
+        for i, col in enumerate(TARGETS):
+            best = min(alive[i], key=lambda t: np.mean([results[(i, t, k)]['mae'] for k in range(len(paths))]))
+            params = dict(trials[best])
+            params['n_estimators'] = int(np.mean([results[(i, best, k)]['best_iteration'] for k in range(len(paths))])) + 1
+            config['params'][col] = params
+            for k, path in enumerate(paths):
+                blend = np.load(os.path.join(path, 'B_val.npy'))
+                preds.append(results[(i, best, k)]['pred'])
+                medians.append(np.load(os.path.join(path, 'M_val.npy'))[blend, i])
+                actuals.append(np.expm1(np.load(os.path.join(path, 'Y_val.npy'))[blend, i]))
+        config['p'] = blend_weight(np.concatenate(preds), np.concatenate(medians), np.concatenate(actuals))
+        return config, report
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def save_config(config, path):
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=4)
+
+def load_config(path):
+    """Load a config saved by save_config
+
+    Args:
+        path (STR): Config file path
+    Return: the config dict, or None if the file does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
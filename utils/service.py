@@ -0,0 +1,215 @@
+# Local HTTP forecast service: requests are grouped into micro-batches scored by the trained pipeline
+import json
+import time
+import queue
+import threading
+import numpy as np
+import pandas as pd
+from collections import deque
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from utils.artifacts import score
+
+REQUEST_COLUMNS = ['zone_code', 'update_time', 'hour_id']
+
+def predict_rows(artifacts, rows):
+    """Predict the targets of request rows with a trained pipeline
+
+    Args:
+        artifacts (dict): Trained pipeline from load_artifacts
+        rows (list): Dicts with the zone_code, update_time and hour_id of each row
+    Return: a list with a dict of the final predictions per row (None for unknown zones)
+    """
+    df = pd.DataFrame(rows, columns=REQUEST_COLUMNS)
+    df['update_time'] = pd.to_datetime(df['update_time'])
+    df['hour_id'] = df['hour_id'].astype(np.int8)
+    df['row'] = np.arange(len(df))
+    cols = [t + '_final' for t in artifacts['targets']]
+    known = df[df['zone_code'].isin(artifacts['zones']['zone_code'])]
+    out = score(known, artifacts).set_index('row') if len(known) else pd.DataFrame(columns=cols)
+    out = out.reindex(np.arange(len(df)))
+    return [{t: (None if np.isnan(v) else float(v)) for t, v in zip(artifacts['targets'], values)}
+            for values in out[cols].values.astype(np.float64)]
+
+def check_row(row):
+    """Check the fields of a request row
+
+    Args:
+        row (dict): Request row
+    Return: an error message, None if the row is valid
+    """
+    missing = [c for c in REQUEST_COLUMNS if c not in row]
+    if missing:
+        return 'Missing fields: {}.'.format(missing)
+    try:
+        update_time = pd.Timestamp(row['update_time'])
+    except (ValueError, TypeError) as e:
+        return 'Invalid update_time {!r}. {}'.format(row['update_time'], e)
+    # None, '' and 'NaT' parse to NaT without an error
+    if pd.isnull(update_time):
+        return 'Invalid update_time {!r}, a date expected.'.format(row['update_time'])
+    hour_id = row['hour_id']
+    if isinstance(hour_id, bool) or not isinstance(hour_id, (int, np.integer)) or not 0 <= hour_id < 24:
+        return 'Invalid hour_id {!r}, an integer from 0 to 23 expected.'.format(hour_id)
+    return None
+
+class ServiceStats(object):
+    """Thread-safe request latencies and batch sizes of the service (the last `size` of each)"""
+
+    def __init__(self, size=10000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=size)
+        self.batch_sizes = deque(maxlen=size)
+        self.requests, self.batches, self.rows = 0, 0, 0
+
+    def record_request(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.requests += 1
+
+    def record_batch(self, size):
+        with self.lock:
+            self.batch_sizes.append(size)
+            self.batches += 1
+            self.rows += size
+
+    def summary(self):
+        """Latency percentiles in ms and batch size stats"""
+        with self.lock:
+            latencies, sizes = np.array(self.latencies) * 1000, np.array(self.batch_sizes)
+            out = {'requests': self.requests, 'batches': self.batches, 'rows': self.rows}
+        if len(latencies):
+            for q in [50, 90, 99]:
+                out['latency_p{}_ms'.format(q)] = float(np.percentile(latencies, q))
+            out['latency_max_ms'] = float(latencies.max())
+        if len(sizes):
+            out['batch_size_mean'] = float(sizes.mean())
+            out['batch_size_max'] = int(sizes.max())
+        return out
+
+class MicroBatcher(object):
+    """Group the rows of concurrent requests into batches scored by a single call
+
+    A batch is closed when it has max_batch rows or max_wait seconds after its
+    first request arrived.
+    """
+
+    def __init__(self, predict_fn, max_batch=256, max_wait=0.005, stats=None):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = stats or ServiceStats()
+        self.queue = queue.Queue()
+        worker = threading.Thread(target=self._run)
+        worker.daemon = True
+        worker.start()
+
+    def submit(self, rows):
+        """Queue the rows of a request and wait for their predictions"""
+        item = {'rows': rows, 'done': threading.Event(), 'result': None, 'error': None}
+        self.queue.put(item)
+        item['done'].wait()
+        if item['error'] is not None:
+            raise item['error']
+        return item['result']
+
+    def _next_batch(self):
+        items = [self.queue.get()]
+        n_rows = len(items[0]['rows'])
+        deadline = time.time() + self.max_wait
+        while n_rows < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            items.append(item)
+            n_rows += len(item['rows'])
+        return items, n_rows
+
+    def _run(self):
+        while True:
+            items, n_rows = self._next_batch()
+            try:
+                preds = self.predict_fn([row for item in items for row in item['rows']])
+                start = 0
+                for item in items:
+                    item['result'] = preds[start:start + len(item['rows'])]
+                    start += len(item['rows'])
+            except Exception:
+                # Score each request on its own, so an error only reaches the request that caused it
+                for item in items:
+                    try:
+                        item['result'] = self.predict_fn(item['rows'])
+                    except Exception as e:
+                        item['error'] = e
+            self.stats.record_batch(n_rows)
+            for item in items:
+                item['done'].set()
+
+class ForecastHandler(BaseHTTPRequestHandler):
+    """POST /predict with a row or {"instances": [rows]}, GET /stats and GET /health"""
+
+    def _send(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, self.server.batcher.stats.summary())
+        elif self.path == '/health':
+            self._send(200, {'status': 'ok', 'version': self.server.version})
+        else:
+            self._send(404, {'error': 'Not found.'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send(404, {'error': 'Not found.'})
+            return
+        start = time.time()
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+            rows = body['instances'] if 'instances' in body else [body]
+            errors = [check_row(row) for row in rows]
+            errors = ['Row {}: {}'.format(i, e) for i, e in enumerate(errors) if e is not None]
+            if errors:
+                self._send(400, {'error': ' '.join(errors)})
+                return
+        except (ValueError, TypeError, KeyError) as e:
+            self._send(400, {'error': 'Invalid request. {}'.format(e)})
+            return
+        try:
+            preds = self.server.batcher.submit(rows)
+        except Exception as e:
+            self._send(500, {'error': str(e)})
+            return
+        self.server.batcher.stats.record_request(time.time() - start)
+        self._send(200, {'predictions': preds})
+
+    def log_message(self, format, *args):
+        pass
+
+class ForecastServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def make_server(artifacts, host='127.0.0.1', port=8000, max_batch=256, max_wait=0.005):
+    """Create the forecast HTTP server of a trained pipeline
+
+    Args:
+        artifacts (dict): Trained pipeline from load_artifacts
+        host (STR): Host to bind
+        port (int): Port to bind
+        max_batch (int): Maximum number of rows per batch
+        max_wait (float): Maximum seconds a batch waits for more requests
+    Return: the server, to run with serve_forever()
+    """
+    server = ForecastServer((host, port), ForecastHandler)
+    server.batcher = MicroBatcher(lambda rows: predict_rows(artifacts, rows), max_batch, max_wait)
+    server.version = artifacts.get('version')
+    return server
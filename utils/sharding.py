@@ -0,0 +1,68 @@
+# Per-zone work split by zone over a process pool, the shards passed as memory-mapped column files
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from utils.cache import save_frame, load_frame
+
+def zone_shards(df, n_shards):
+    """Split the zones into contiguous groups of about the same number of rows
+
+    Args:
+        df (DataFrame): Input dataframe with a zone_code column
+        n_shards (int): Number of groups
+    Return: the shard number of every row, the zones being numbered in order of their first row
+    """
+    codes, zones = pd.factorize(df['zone_code'])
+    rows = np.cumsum(np.bincount(codes, minlength=len(zones)))
+    # Zone z goes to the shard holding its last row when the rows are cut into equal parts
+    shard = (rows - 1) * n_shards // rows[-1]
+    return shard[codes]
+
+def _run_shard(fn, in_path, out_path, kwargs):
+    result = fn(load_frame(in_path).copy(), **kwargs)
+    frames = result if isinstance(result, tuple) else (result,)
+    for i, frame in enumerate(frames):
+        save_frame(frame, '{}_{}'.format(out_path, i))
+    return isinstance(result, tuple), len(frames)
+
+def map_zones(fn, df, n_workers=None, **kwargs):
+    """Apply a per-zone function to a dataframe split by zone in a process pool
+
+    The zones are split into one shard per worker, in order of their first row.
+    The shards are sent to and returned by the workers as memory-mapped column
+    files (see save_frame) instead of pickled dataframes, then concatenated in
+    order, so the result is the one of fn on the whole dataframe as long as fn
+    works zone by zone and keeps the rows of each zone together.
+
+    Args:
+        fn (callable): Module level function taking the dataframe (and kwargs),
+            returning a dataframe or a tuple of dataframes
+        df (DataFrame): Input dataframe with a zone_code column
+        n_workers (int): Number of processes (one per core if None, fn is called directly if 1)
+    Return: the output of fn
+    """
+    n_workers = min(n_workers or os.cpu_count() or 1, df['zone_code'].nunique())
+    if n_workers <= 1:
+        return fn(df, **kwargs)
+
+    shard = zone_shards(df, n_workers)
+    order = np.argsort(shard, kind='mergesort')
+    bounds = np.searchsorted(shard[order], np.arange(n_workers + 1))
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        paths = []
+        # A shard is empty when a large zone covers its share of the rows
+        for i in np.flatnonzero(np.diff(bounds)):
+            paths.append((os.path.join(tmp_dir, 'in_{}'.format(i)), os.path.join(tmp_dir, 'out_{}'.format(i))))
+            save_frame(df.iloc[order[bounds[i]:bounds[i+1]]], paths[-1][0])
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(_run_shard, fn, in_path, out_path, kwargs) for in_path, out_path in paths]
+            is_tuple, n_frames = [f.result() for f in futures][0]
+        frames = tuple(pd.concat([load_frame('{}_{}'.format(out_path, j)) for _, out_path in paths])
+                       for j in range(n_frames))
+        return frames if is_tuple else frames[0]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,77 @@
+# Calendar of special days (abnormal periods, holidays) and the per-zone abnormal weights
+import os
+import json
+import numpy as np
+import pandas as pd
+
+SPECIAL_DAYS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'special_days.json')
+
+def load_calendar(path=SPECIAL_DAYS_PATH):
+    """Load the special days config file
+
+    Args:
+        path (STR): Path of the json config file
+    Return: 2 dataframes: the day table ('abnormal' and 'holiday' flags, one row per
+        day from the first to the last special day) and the zone weight table
+        ('abnormal_bw' and 'abnormal_u', one row per zone code)
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    # Days when there were sudden decrease/increase in bandwidth/max users
+    abnormals = pd.DatetimeIndex([])
+    for start, end in config['abnormal_periods']:
+        abnormals = abnormals.union(pd.date_range(start, end))
+    holidays = pd.to_datetime(config['holidays'])
+
+    special = abnormals.union(holidays)
+    days = pd.date_range(special.min(), special.max()) if len(special) else special
+    table = pd.DataFrame({
+        'abnormal': days.isin(abnormals).astype(np.int8),
+        'holiday': days.isin(holidays).astype(np.int8)
+    }, index=days, columns=['abnormal', 'holiday'])
+
+    # Abnormal weights of each zone (negative if decrease, positive if increase)
+    weights = pd.DataFrame.from_dict(config['abnormal_weights'], orient='index')
+    weights = weights.reindex(columns=['abnormal_bw', 'abnormal_u']).fillna(0).astype(np.float32)
+    weights.index.name = 'zone_code'
+
+    return table, weights
+
+def gather_days(table, dates):
+    """Look up the day table rows of some dates
+
+    Args:
+        table (DataFrame): Day table from load_calendar
+        dates: Array-like of dates
+    Return: an array with one row per date, zeros for the dates outside the table
+    """
+    dates = pd.to_datetime(dates).values.astype('datetime64[D]')
+    out = np.zeros((len(dates), table.shape[1]), dtype=table.values.dtype)
+    if len(table):
+        pos = (dates - table.index.values[0].astype('datetime64[D]')).astype(np.int64)
+        inside = (pos >= 0) & (pos < len(table))
+        out[inside] = table.values[pos[inside]]
+    return out
+
+def add_special_days_features(df, path=SPECIAL_DAYS_PATH):
+    """Add special events and holidays features
+
+    Args:
+        df (DataFrame): Input dataframe
+        path (STR): Path of the special days config file
+    Return: the modified df
+    """
+    table, weights = load_calendar(path)
+    flags = gather_days(table, df['update_time'])
+
+    # Zones without weights are not affected by the abnormal periods
+    codes, uniques = pd.factorize(df['zone_code'])
+    zone_weights = weights.reindex(np.asarray(uniques)).fillna(0).values[codes]
+
+    abnormal = flags[:, 0].astype(np.float32)
+    df['abnormal_bw'] = abnormal * zone_weights[:, 0]
+    df['abnormal_u'] = abnormal * zone_weights[:, 1]
+    df['holiday'] = flags[:, 1]
+
+    return df
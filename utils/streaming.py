@@ -0,0 +1,138 @@
+# Streaming ingestion of training files larger than memory: the rows are routed by zone into per-zone spill files
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from utils.preprocessing_df import CSV_DTYPES, CSV_DATES, fill_missing_values, zone_statistics, scale_zone_features
+
+# Binary record of a spilled row
+SPILL_DTYPE = np.dtype([('update_time', 'M8[ns]'), ('hour_id', np.int8), ('bandwidth_total', np.float64), ('max_user', np.float64)])
+INDEX_FILE = 'zones.json'
+
+class ZoneSpill(object):
+    """Rows of train.csv-like files routed by zone into per-zone binary files
+
+    The csv files are read in chunks and the rows of each zone appended to its
+    own file, so a single zone has to fit in memory, not the whole data.
+
+    Args:
+        spill_dir (STR): Directory of the spill files, reused if it holds some (a temporary one if None)
+        memory_mb (float): Approximate memory budget: a quarter for the csv chunk being parsed,
+            a quarter for the rows buffered before being appended to the spill files
+    """
+
+    def __init__(self, spill_dir=None, memory_mb=512):
+        self.memory_mb = memory_mb
+        self.temporary = spill_dir is None
+        self.spill_dir = tempfile.mkdtemp() if spill_dir is None else spill_dir
+        os.makedirs(self.spill_dir, exist_ok=True)
+        # Spill file number by zone code, number of rows and last day
+        self.files, self.rows, self.max_time = {}, 0, None
+        if os.path.exists(os.path.join(self.spill_dir, INDEX_FILE)):
+            with open(os.path.join(self.spill_dir, INDEX_FILE)) as f:
+                index = json.load(f)
+            if index.get('record_size') != SPILL_DTYPE.itemsize:
+                raise ValueError('The spill files in {} have another record format, delete them.'.format(self.spill_dir))
+            self.files, self.rows = index['files'], index['rows']
+            self.max_time = pd.Timestamp(index['max_time']) if index['max_time'] else None
+        self._buffers, self._buffered = {}, 0
+
+    def _path(self, zone):
+        return os.path.join(self.spill_dir, '{}.bin'.format(self.files[zone]))
+
+    def ingest(self, path):
+        """Append the rows of a csv file with the train.csv columns, read in chunks
+
+        Args:
+            path (STR): File path
+        Return: self
+        """
+        names = {c: c.lower().strip() for c in pd.read_csv(path, nrows=0).columns}
+        dtype = {c: CSV_DTYPES[n] for c, n in names.items() if n in CSV_DTYPES}
+        parse_dates = [c for c, n in names.items() if n in CSV_DATES]
+
+        # Rows per chunk from the memory of the first parsed rows
+        sample = pd.read_csv(path, nrows=1000, dtype=dtype, parse_dates=parse_dates)
+        row_bytes = sample.memory_usage(index=True, deep=True).sum() / max(len(sample), 1)
+        chunk_rows = max(int(self.memory_mb * 2**20 / 4 / max(row_bytes, 1)), 1000)
+        for chunk in pd.read_csv(path, dtype=dtype, parse_dates=parse_dates, chunksize=chunk_rows):
+            chunk.rename(columns=names, inplace=True)
+            self._route(chunk)
+        self.flush()
+        return self
+
+    def _route(self, chunk):
+        codes, zones = pd.factorize(chunk['zone_code'])
+        order = np.argsort(codes, kind='mergesort')
+        bounds = np.searchsorted(codes[order], np.arange(len(zones) + 1))
+        records = np.empty(len(chunk), SPILL_DTYPE)
+        for name in SPILL_DTYPE.names:
+            records[name] = chunk[name].values
+        records = records[order]
+        for i, zone in enumerate(zones):
+            self._buffers.setdefault(zone, []).append(records[bounds[i]:bounds[i+1]])
+        self._buffered += records.nbytes
+        self.rows += len(chunk)
+        last = chunk['update_time'].max()
+        self.max_time = last if self.max_time is None else max(self.max_time, last)
+        if self._buffered > self.memory_mb * 2**20 / 4:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered rows to the spill files"""
+        for zone, parts in self._buffers.items():
+            if zone not in self.files:
+                self.files[zone] = len(self.files)
+            with open(self._path(zone), 'ab') as f:
+                for part in parts:
+                    part.tofile(f)
+        self._buffers, self._buffered = {}, 0
+        with open(os.path.join(self.spill_dir, INDEX_FILE), 'w') as f:
+            json.dump({'files': self.files, 'rows': self.rows, 'record_size': SPILL_DTYPE.itemsize,
+                       'max_time': str(self.max_time) if self.max_time is not None else None}, f)
+
+    @property
+    def zones(self):
+        """Zone codes, sorted"""
+        return sorted(self.files)
+
+    def read(self, zone):
+        """Rows of a zone with the load_csv columns"""
+        records = np.fromfile(self._path(zone), SPILL_DTYPE)
+        df = pd.DataFrame({name: records[name] for name in SPILL_DTYPE.names})
+        df.insert(1, 'zone_code', zone)
+        return df
+
+    def iter_zones(self):
+        """Yield the code and the rows of each zone, with the missing values filled"""
+        for zone in self.zones:
+            yield zone, fill_missing_values(self.read(zone))
+
+    def zone_features(self, zfeatures, aufeatures, return_scalers=False):
+        """Zone features as zone_features computes them on the whole data, one zone at a time
+
+        The autocorrelation features match up to floating point rounding.
+
+        Args:
+            zfeatures (list): List of zone median features
+            aufeatures (list): List of zone autocorr features
+            return_scalers (bool): Also return the 2 fitted MinMaxScalers
+        Return: 2 dataframes (and the scalers if return_scalers)
+        """
+        max_time = np.datetime64(self.max_time.floor('D'))
+        stats = [zone_statistics(df, max_time) for _, df in self.iter_zones()]
+        zones, zones_autocorr = [pd.concat(frames, ignore_index=True) for frames in zip(*stats)]
+        # Same zone codes dtype as the ones of load_csv
+        for table in [zones, zones_autocorr]:
+            table['zone_code'] = pd.Categorical(table['zone_code'], categories=self.zones)
+        zones, zones_autocorr, scalers = scale_zone_features(zones, zones_autocorr, zfeatures, aufeatures)
+        if return_scalers:
+            return zones, zones_autocorr, scalers
+        return zones, zones_autocorr
+
+    def close(self):
+        """Remove the spill files if the directory is temporary"""
+        if self.temporary:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
@@ -0,0 +1,87 @@
+# Synthetic train.csv / test_id.csv shaped data for benchmarks, with configurable size, gaps and seasonality
+import os
+import numpy as np
+import pandas as pd
+
+# Relative amplitudes of the daily, weekly and yearly cycles, noise level and yearly growth
+SEASONALITY = {'daily': 0.5, 'weekly': 0.1, 'yearly': 0.15, 'noise': 0.05, 'trend': 0.2}
+
+def generate(n_zones=10, days=400, gap_rate=0.03, seasonality=None, start='2017-10-01', seed=0, first_zone=0):
+    """Generate hourly data in the train.csv format
+
+    Each zone has its own level and phase; the first week and the last hour of
+    every zone are always present so that the gaps can be filled.
+
+    Args:
+        n_zones (int): Number of zones
+        days (int): Number of days of history
+        gap_rate (float): Fraction of the hourly rows removed
+        seasonality (dict): Amplitudes overriding SEASONALITY
+        start (STR): First day
+        seed (int): Random seed
+        first_zone (int): Number of the first zone, to generate the zones in chunks
+    Return: the dataframe
+    """
+    s = dict(SEASONALITY, **(seasonality or {}))
+    rng = np.random.RandomState(seed + first_zone)
+    hours = np.arange(days * 24)
+    ds = pd.Timestamp(start) + pd.to_timedelta(hours, unit='h')
+    t = hours / 24.
+
+    # Shape shared by the 2 targets: cycles with a zone phase, growth and noise
+    phase = rng.uniform(-1, 1, (n_zones, 1))
+    shape = (s['daily'] * np.sin(2 * np.pi * (t / 1 + phase / 8))
+             + s['weekly'] * np.sin(2 * np.pi * (t / 7 + phase))
+             + s['yearly'] * np.sin(2 * np.pi * (t / 365.25 + phase))
+             + s['trend'] * t / 365.25)
+    bw = np.exp(rng.normal(8, 1, (n_zones, 1)) + shape + s['noise'] * rng.randn(n_zones, len(hours)))
+    users = np.round(np.exp(rng.normal(10, 1, (n_zones, 1)) + shape + s['noise'] * rng.randn(n_zones, len(hours))))
+
+    keep = rng.rand(n_zones, len(hours)) >= gap_rate
+    keep[:, :24 * 7] = True
+    keep[:, -1] = True
+    zone, hour = np.nonzero(keep)
+    return pd.DataFrame({
+        'UPDATE_TIME': ds[hour].normalize().strftime('%Y-%m-%d'),
+        'ZONE_CODE': np.char.add('ZONE', np.char.zfill((zone + first_zone + 1).astype(str), 5)),
+        'HOUR_ID': ds[hour].hour,
+        'BANDWIDTH_TOTAL': bw[zone, hour].round(2),
+        'MAX_USER': users[zone, hour]
+    }, columns=['UPDATE_TIME', 'ZONE_CODE', 'HOUR_ID', 'BANDWIDTH_TOTAL', 'MAX_USER'])
+
+def generate_test(n_zones=10, days=400, test_days=30, start='2017-10-01'):
+    """Generate the rows to predict in the test_id.csv format, the test_days days after the history"""
+    first = pd.Timestamp(start) + pd.Timedelta(days=days)
+    dates = pd.date_range(first, periods=test_days).strftime('%Y-%m-%d')
+    zones = np.char.add('ZONE', np.char.zfill((np.arange(n_zones) + 1).astype(str), 5))
+    n = n_zones * test_days * 24
+    return pd.DataFrame({
+        'id': np.arange(n),
+        'UPDATE_TIME': np.tile(np.repeat(dates, 24), n_zones),
+        'ZONE_CODE': np.repeat(zones, test_days * 24),
+        'HOUR_ID': np.tile(np.arange(24), n_zones * test_days)
+    }, columns=['id', 'UPDATE_TIME', 'ZONE_CODE', 'HOUR_ID'])
+
+def write_dataset(data_dir, n_zones=10, days=400, gap_rate=0.03, seasonality=None, test_days=30, seed=0, chunk_zones=200):
+    """Write train.csv and test_id.csv into a directory, generating the zones in chunks
+
+    Args:
+        data_dir (STR): Output directory
+        n_zones (int): Number of zones
+        days (int): Number of days of history
+        gap_rate (float): Fraction of the hourly rows removed
+        seasonality (dict): Amplitudes overriding SEASONALITY
+        test_days (int): Number of days to predict
+        seed (int): Random seed
+        chunk_zones (int): Number of zones generated at a time
+    Return: the paths of the 2 files
+    """
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    train_path, test_path = os.path.join(data_dir, 'train.csv'), os.path.join(data_dir, 'test_id.csv')
+    with open(train_path, 'w') as f:
+        for i, first in enumerate(range(0, n_zones, chunk_zones)):
+            chunk = generate(min(chunk_zones, n_zones - first), days, gap_rate, seasonality, seed=seed, first_zone=first)
+            chunk.to_csv(f, index=False, header=i == 0)
+    generate_test(n_zones, days, test_days).to_csv(test_path, index=False)
+    return train_path, test_path
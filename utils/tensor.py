@@ -0,0 +1,109 @@
+# Dense zone x hour arrays of the targets, with copy-free zone, hour and date range views
+import os
+import json
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['bandwidth_total', 'max_user']
+META_FILE = 'meta.json'
+WEEK_HOURS = 24 * 7
+
+class ZoneTensor(object):
+    """Hourly values of every zone in (zones x hours) arrays
+
+    Row i holds the zone zones[i] (the zone registry) and column t the hour
+    start + t. The first hour is a midnight and the number of hours a whole
+    number of weeks, so that the hours of a day and of a week are regular
+    strides. Hours without data are NaN.
+
+    Args:
+        zones (array): Zone codes, in row order
+        start (datetime64): First hour
+        values (dict): (zones x hours) arrays by column name
+    """
+
+    def __init__(self, zones, start, values):
+        self.zones = zones
+        self.index = {z: i for i, z in enumerate(zones)}
+        self.start = np.datetime64(start, 'h')
+        self.values = values
+
+    @classmethod
+    def from_frame(cls, df, columns=COLUMNS):
+        """Scatter a long-format dataframe (load_csv or fill_missing_values columns) into a tensor
+
+        Args:
+            df (DataFrame): Input dataframe
+            columns (list): Value columns
+        Return: the ZoneTensor, the zones sorted by code
+        """
+        ds = df['ds'].values if 'ds' in df else (df['update_time'].values + df['hour_id'].values.astype('timedelta64[h]'))
+        hours = ds.astype('datetime64[h]')
+        start = hours.min().astype('datetime64[D]').astype('datetime64[h]')
+        t = (hours - start).astype(np.int64)
+        n_hours = -(-(t.max() + 1) // WEEK_HOURS) * WEEK_HOURS
+        codes, zones = pd.factorize(df['zone_code'], sort=True)
+        values = {}
+        for col in columns:
+            values[col] = np.full((len(zones), n_hours), np.nan, dtype=np.result_type(df[col].dtype, np.float32))
+            values[col][codes, t] = df[col].values
+        return cls(zones, start, values)
+
+    @property
+    def n_hours(self):
+        return next(iter(self.values.values())).shape[1]
+
+    def hour(self, t):
+        """Column of a datetime"""
+        return int((np.datetime64(t, 'h') - self.start).astype(np.int64))
+
+    def zone_view(self, col, zone):
+        """Hourly values of a zone (a view)"""
+        return self.values[col][self.index[zone]]
+
+    def hour_view(self, col, hour_id):
+        """(zones x days) values at an hour of the day (a strided view)"""
+        return self.values[col][:, hour_id::24]
+
+    def range_view(self, col, start, end):
+        """(zones x hours) values from start to end excluded (a view)"""
+        return self.values[col][:, max(self.hour(start), 0):max(self.hour(end), 0)]
+
+    def bounds(self):
+        """First and last hour with data of each zone (-1 if none)"""
+        valid = np.any([~np.isnan(v) for v in self.values.values()], axis=0)
+        has = valid.any(axis=1)
+        first = np.where(has, valid.argmax(axis=1), -1)
+        last = np.where(has, self.n_hours - 1 - valid[:, ::-1].argmax(axis=1), -1)
+        return first, last
+
+    def map(self, fn):
+        """New tensor with fn applied to the value arrays (e.g. np.log1p)"""
+        return ZoneTensor(self.zones, self.start, {col: fn(v) for col, v in self.values.items()})
+
+    def to_frame(self):
+        """Long-format dataframe of the hours with data, by zone then time"""
+        valid = np.any([~np.isnan(v) for v in self.values.values()], axis=0)
+        z, t = np.nonzero(valid)
+        df = pd.DataFrame({'ds': self.start + t.astype('timedelta64[h]'), 'zone_code': self.zones.take(z)})
+        df['hour_id'] = (t % 24).astype(np.int8)
+        for col, v in self.values.items():
+            df[col] = v[z, t]
+        return df
+
+    def save(self, path):
+        """Save into a directory of .npy files (memory-mappable) and a meta file"""
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for col, v in self.values.items():
+            np.save(os.path.join(path, '{}.npy'.format(col)), v)
+        with open(os.path.join(path, META_FILE), 'w') as f:
+            json.dump({'zones': [str(z) for z in self.zones], 'start': str(self.start), 'columns': list(self.values)}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a tensor saved by save, memory-mapped by default"""
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        values = {col: np.load(os.path.join(path, '{}.npy'.format(col)), mmap_mode=mmap_mode) for col in meta['columns']}
+        return cls(pd.Index(meta['zones']), np.datetime64(meta['start']), values)
@@ -0,0 +1,239 @@
+# Utilities for building the feature matrices and training the models
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.base import clone
+from concurrent.futures import ProcessPoolExecutor
+
+# Features of the models: time and special days features, zone medians (ZFEATURES), Ridge
+# predictions (RFEATURES) and zone autocorrelations (AUFEATURES), in the column order of the matrices
+FEATURES = ['zone_code', 'hour_id', 'dow_norm', 'month', 'doy', 'year', 'day', 'week', 'abnormal_bw', 'abnormal_u', 'holiday']
+ZFEATURES = ['median_user_1m', 'median_bw_1m', 'median_user_3m',
+             'median_bw_3m', 'median_user_6m', 'median_bw_6m', 'median_user_1y', 'median_bw_1y',
+             'median_bw_per_user_6m', 'median_bw_per_user_3m', 'median_bw_per_user_1m', 'median_bw_per_user_1y'
+             ]
+AUFEATURES = ['lag_user_1d', 'lag_user_3d', 'lag_user_1w', 'lag_bw_1d', 'lag_bw_3d', 'lag_bw_1w']
+RFEATURES = ['ridge_bw', 'ridge_u']
+TARGETS = ['bandwidth_total', 'max_user']
+
+def feature_matrix(df, cols):
+    """Build a contiguous float32 feature matrix
+
+    Args:
+        df (DataFrame): Input dataframe
+        cols (list): Feature columns, in order
+    Return: the 2-D array
+    """
+    return np.ascontiguousarray(df[cols].values, dtype=np.float32)
+
+def zone_ids(codes, le):
+    """Zone id of each zone code: its position in the classes of a fitted LabelEncoder (-1 if unknown)"""
+    return pd.Index(le.classes_).get_indexer(np.asarray(codes))
+
+def zone_table(zones, zones_autocorr, le):
+    """Zone features by zone id: row i holds the median and autocorrelation features of le.classes_[i]"""
+    table = zones.merge(zones_autocorr, on='zone_code')
+    table.index = np.asarray(table.pop('zone_code'))
+    return table.reindex(le.classes_)
+
+def gather_matrix(df, columns, ids, table, filled_later=()):
+    """Build a float32 feature matrix, gathering the zone features by zone id
+
+    The columns of df are copied and the ones of the zone table gathered by the
+    zone id of each row into one preallocated array, in the given column order.
+    The columns filled later (such as the predictions of a first model) are left
+    at 0, to be filled in place.
+
+    Args:
+        df (DataFrame): Input dataframe
+        columns (list): Feature columns, in order ('zone_code' takes the zone ids)
+        ids (array): Zone id of each row of df
+        table (DataFrame): Zone features by zone id, from zone_table
+        filled_later (list): Columns left at 0
+    Return: the 2-D array
+    """
+    missing = [col for col in columns if col != 'zone_code' and col not in table and col not in df and col not in filled_later]
+    if missing:
+        raise KeyError('Feature columns not found: {}.'.format(missing))
+    X = np.zeros((len(df), len(columns)), dtype=np.float32)
+    for j, col in enumerate(columns):
+        if col == 'zone_code':
+            X[:, j] = ids
+        elif col in table:
+            X[:, j] = table[col].values[ids]
+        elif col in df:
+            X[:, j] = df[col].values
+    return X
+
+def split_cores(n_models, n_jobs=None):
+    """Split the cores between the models trained at the same time
+
+    Args:
+        n_models (int): Number of models
+        n_jobs (list): Number of threads of each model, the cores are split evenly if None
+    Return: the list of thread counts
+    """
+    if n_jobs is not None:
+        assert len(n_jobs) == n_models, 'One thread count per model is needed.'
+        return list(n_jobs)
+    cores = os.cpu_count() or 1
+    return [max(cores // n_models + (i < cores % n_models), 1) for i in range(n_models)]
+
+def holdout_mask(df, days, time_col='ds'):
+    """Mark the rows in the last days of each zone as the holdout set
+
+    Args:
+        df (DataFrame): Input dataframe
+        days (int): Number of days held out per zone
+        time_col (STR): Time column
+    Return: a boolean array
+    """
+    last = df.groupby('zone_code')[time_col].transform('max')
+    return (df[time_col] > last - pd.Timedelta(days=days)).values
+
+def _fit_model(model, X_path, Y_path, i, fit_params, holdout_path=None):
+    """Fit a model on a column of the memory-mapped targets (runs in a worker process)"""
+    X = np.load(X_path, mmap_mode='r')
+    y = np.load(Y_path, mmap_mode='r')[:, i]
+    start = time.time()
+    if holdout_path is None:
+        model.fit(X, y, **fit_params)
+    else:
+        holdout = np.load(holdout_path)
+        model.fit(X[~holdout], y[~holdout], eval_set=[(X[holdout], y[holdout])], **fit_params)
+    model.fit_time_ = time.time() - start
+    return model
+
+def fit_parallel(models, X, Y, n_jobs=None, fit_params=None, holdout=None, boosters=None):
+    """Fit one model per target column at the same time, each in its own process
+
+    The feature matrix and the targets are written once to memory-mapped files
+    which all the workers read without copying.
+
+    Args:
+        models (list): Unfitted models, one per column of Y
+        X (array): Feature matrix
+        Y (array): Targets, one column per model
+        n_jobs (list): Number of threads of each model, the cores are split evenly if None
+        fit_params (dict): Extra arguments of the fit calls
+        holdout (array): Boolean mask of the rows used as the evaluation set instead of for fitting
+        boosters (list): Trained XGBoost boosters to continue, one per model (n_estimators rounds are added)
+    Return: the fitted models, with their fit time in seconds as fit_time_
+    """
+    for model, threads in zip(models, split_cores(len(models), n_jobs)):
+        model.set_params(n_jobs=threads)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        X_path, Y_path = os.path.join(tmp_dir, 'X.npy'), os.path.join(tmp_dir, 'Y.npy')
+        np.save(X_path, np.ascontiguousarray(X))
+        np.save(Y_path, np.ascontiguousarray(Y))
+        holdout_path = None
+        if holdout is not None:
+            holdout_path = os.path.join(tmp_dir, 'holdout.npy')
+            np.save(holdout_path, np.asarray(holdout, dtype=bool))
+        params = [dict(fit_params or {}) for _ in models]
+        if boosters is not None:
+            for p, booster in zip(params, boosters):
+                p['xgb_model'] = booster
+        with ProcessPoolExecutor(max_workers=len(models)) as pool:
+            futures = [pool.submit(_fit_model, m, X_path, Y_path, i, params[i], holdout_path)
+                       for i, m in enumerate(models)]
+            return [f.result() for f in futures]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def tune_rounds(models, X, Y, holdout, early_stopping_rounds=50, n_jobs=None):
+    """Pick the number of boosting rounds of each model with early stopping on the holdout MAE
+
+    Copies of the models are fitted on the rows outside the holdout, then the
+    n_estimators of each model is set to its best iteration + 1 for the final fit.
+
+    Args:
+        models (list): Unfitted XGBoost models, one per column of Y
+        X (array): Feature matrix
+        Y (array): Targets, one column per model
+        holdout (array): Boolean mask of the holdout rows
+        early_stopping_rounds (int): Rounds without improvement before stopping
+        n_jobs (list): Number of threads of each model, the cores are split evenly if None
+    Return: a list with the tree method, fit time, best iteration and holdout MAE of each model
+    """
+    fit_params = {'eval_metric': 'mae', 'early_stopping_rounds': early_stopping_rounds, 'verbose': False}
+    fitted = fit_parallel([clone(m) for m in models], X, Y, n_jobs, fit_params, holdout=holdout)
+    report = []
+    for m, f in zip(models, fitted):
+        m.set_params(n_estimators=f.best_iteration + 1)
+        report.append({
+            'tree_method': f.get_params()['tree_method'],
+            'fit_time': f.fit_time_,
+            'best_iteration': f.best_iteration,
+            'holdout_mae': f.best_score
+        })
+    return report
+
+def compare_tree_methods(models, X, Y, holdout, targets, methods=('exact', 'approx', 'hist'), **kwargs):
+    """Compare the fit time and holdout MAE of the tree methods
+
+    Args:
+        models (list): Unfitted XGBoost models, one per column of Y
+        X (array): Feature matrix
+        Y (array): Targets, one column per model
+        holdout (array): Boolean mask of the holdout rows
+        targets (list): Target names, one per model
+        methods (list): Tree methods to compare
+        kwargs: Extra arguments of tune_rounds
+    Return: a dataframe with one row per target and tree method
+    """
+    rows = []
+    for method in methods:
+        candidates = [clone(m).set_params(tree_method=method) for m in models]
+        for target, r in zip(targets, tune_rounds(candidates, X, Y, holdout, **kwargs)):
+            r['target'] = target
+            rows.append(r)
+    return pd.DataFrame(rows, columns=['target', 'tree_method', 'fit_time', 'best_iteration', 'holdout_mae'])
+
+def holdout_mae(boosters, X, Y):
+    """MAE of trained boosters on some rows
+
+    Args:
+        boosters (list): XGBoost boosters, one per column of Y
+        X (array): Feature matrix
+        Y (array): Targets, one column per booster
+    Return: the list of MAEs
+    """
+    dmatrix = xgb.DMatrix(X)
+    return [float(np.abs(b.predict(dmatrix) - Y[:, i]).mean()) for i, b in enumerate(boosters)]
+
+def warm_start(models, boosters, X, Y, rounds, holdout=None, n_jobs=None):
+    """Add boosting rounds to trained boosters on new data (continued training)
+
+    Args:
+        models (list): Unfitted XGBoost models with the parameters of the boosters, one per column of Y
+        boosters (list): Trained XGBoost boosters, one per column of Y
+        X (array): Feature matrix of the new data
+        Y (array): Targets of the new data, one column per model
+        rounds (int): Number of rounds added to each booster
+        holdout (array): Boolean mask of the rows used to measure the MAE instead of for fitting
+        n_jobs (list): Number of threads of each model, the cores are split evenly if None
+    Return: the fitted models, with their holdout MAE as holdout_mae_ if holdout is given
+    """
+    models = [clone(m).set_params(n_estimators=rounds) for m in models]
+    fitted = fit_parallel(models, X, Y, n_jobs, {'eval_metric': 'mae', 'verbose': False}, holdout=holdout, boosters=boosters)
+    if holdout is not None:
+        for m in fitted:
+            m.holdout_mae_ = m.evals_result()['validation_0']['mae'][-1]
+    return fitted
+
+def drift_check(maes, reference, threshold):
+    """Check that the holdout MAEs did not degrade past a threshold
+
+    Args:
+        maes (list): Holdout MAEs of the models
+        reference (list): Reference MAEs, one per model
+        threshold (float): Allowed relative increase of the MAE
+    Return: True if all the MAEs are within the threshold
+    """
+    return all(m <= r * (1 + threshold) for m, r in zip(maes, reference))
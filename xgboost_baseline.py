@@ -14,6 +14,9 @@ import xgboost as xgb
 from sklearn.linear_model import Ridge
 from sklearn.preprocessing import LabelEncoder
 from utils.preprocessing import *
+from utils.training import feature_matrix, fit_parallel, holdout_mask, tune_rounds, compare_tree_methods
+from utils.search import load_config
+from utils.profiling import start_run, stage
 import sys, os, logging, warnings
 
 # Disable future warnings
@@ -26,11 +29,32 @@ BASE_DIR = os.path.join('data')
 TRAIN_PATH = os.path.join(BASE_DIR, 'train.csv')
 TEST_PATH = os.path.join(BASE_DIR, 'test_id.csv')
 
+# Number of threads of each XGBoost model trained in parallel, e.g. [12, 4] (cores split evenly if None)
+N_JOBS = None
+# Tree method of the XGBoost models, and number of days per zone held out to pick the
+# number of boosting rounds with early stopping on MAE (all n_estimators rounds if None)
+TREE_METHOD = 'exact'
+HOLDOUT_DAYS = None
+# With a holdout, also fit every tree method and save their fit times and holdout MAEs
+COMPARE_TREE_METHODS = False
+TREE_METHODS_REPORT = 'tree_methods.csv'
+# XGBoost parameters found by search.py (the values below if the file does not exist)
+SEARCH_CONFIG = 'search_config_baseline.json'
+# JSON run report with the wall/CPU time, peak RSS and row counts of each stage, and optional
+# per-stage profiles in PROFILE_DIR (PROFILE_MODE 'cprofile' or 'sample', none if None)
+RUN_REPORT = 'run_report_baseline.json'
+PROFILE_MODE = None
+PROFILE_DIR = 'profiles'
+
 # Main program
 if __name__ == "__main__":
+    start_run('xgboost_baseline', RUN_REPORT, PROFILE_DIR, PROFILE_MODE)
+
     # =========== LOAD THE DATA ===========
     try:
-        df, test_df = load_csv(TRAIN_PATH), load_csv(TEST_PATH)
+        with stage('load_data') as counters:
+            df, test_df = load_csv(TRAIN_PATH), load_csv(TEST_PATH)
+            counters['rows'] = len(df)
         logging.info('Training data and testing data loaded.')
     except Exception as e:
         logging.error('Could not load the data. {}'.format(e))
@@ -39,42 +63,47 @@ if __name__ == "__main__":
     # =========== FEATURE ENGINEERING ===========
     try:
         # Time features
-        df, test_df = add_time_features(df), add_time_features(test_df)
+        with stage('add_time_features'):
+            df, test_df = add_time_features(df), add_time_features(test_df)
         
         # Special events featuers
-        df, test_df = add_special_days_features(df), add_special_days_features(test_df)
+        with stage('add_special_days_features'):
+            df, test_df = add_special_days_features(df), add_special_days_features(test_df)
 
         # Zone features
         zfeatures = ['median_user_1m', 'median_bw_1m', 'median_user_3m', 'median_bw_3m', 'median_user_6m', 'median_bw_6m', 'median_user_1y', 'median_bw_1y']
         aufeatures = ['lag_user_1d', 'lag_user_3d', 'lag_user_1w', 'lag_bw_1d', 'lag_bw_3d', 'lag_bw_1w']   
-        zones, zones_autocorr = zone_features(df, zfeatures, aufeatures)
+        with stage('zone_features') as counters:
+            zones, zones_autocorr = zone_features(df, zfeatures, aufeatures)
+            counters['zones'] = len(zones)
 
         features = ['zone_code', 'hour_id', 'dow_norm', 'month', 'doy', 'year', 'day', 'week', 'abnormal_bw', 'abnormal_u', 'holiday']
         rfeatures = ['ridge_bw', 'ridge_u']
+        targets = ['bandwidth_total', 'max_user']
 
-        # Merge the data with the zone features 
-        dfr = pd.merge(df,zones,on='zone_code')
-        dfr = dfr.merge(zones_autocorr, how='inner', on=['zone_code']).sort_values(by=['update_time','zone_code'], ascending=[True,True])
+        with stage('merge_zone_features') as counters:
+            # Merge the data with the zone features 
+            dfr = pd.merge(df,zones,on='zone_code')
+            dfr = dfr.merge(zones_autocorr, how='inner', on=['zone_code']).sort_values(by=['update_time','zone_code'], ascending=[True,True])
 
-        test = pd.merge(test_df,zones,on='zone_code')
-        test = test.merge(zones_autocorr, how='inner', on=['zone_code'])
+            test = pd.merge(test_df,zones,on='zone_code')
+            test = test.merge(zones_autocorr, how='inner', on=['zone_code'])
 
-        # Label encoding for zone codes
-        le = LabelEncoder()
-        le.fit(dfr['zone_code'])
-        dfr['zone_code'] = le.transform(dfr['zone_code'])
-        test['zone_code'] = le.transform(test['zone_code'])
+            # Label encoding for zone codes
+            le = LabelEncoder()
+            le.fit(dfr['zone_code'])
+            dfr['zone_code'] = le.transform(dfr['zone_code'])
+            test['zone_code'] = le.transform(test['zone_code'])
+            counters['rows'] = len(dfr)
 
         # Add one more feature: linear regression prediction
-        lr1 = Ridge(alpha=1)
-        lr1.fit(dfr[features + zfeatures], np.log1p(dfr['bandwidth_total']))
-        dfr['ridge_bw'] = lr1.predict(dfr[features + zfeatures])
-        test['ridge_bw'] = lr1.predict(test[features + zfeatures])
-
-        lr2 = Ridge(alpha=1)
-        lr2.fit(dfr[features + zfeatures], np.log1p(dfr['max_user']))
-        dfr['ridge_u'] = lr2.predict(dfr[features + zfeatures])
-        test['ridge_u'] = lr2.predict(test[features + zfeatures])
+        # (one Ridge solve fits both targets)
+        with stage('ridge') as counters:
+            lr = Ridge(alpha=1)
+            lr.fit(dfr[features + zfeatures], np.log1p(dfr[targets]))
+            dfr['ridge_bw'], dfr['ridge_u'] = lr.predict(dfr[features + zfeatures]).T
+            test['ridge_bw'], test['ridge_u'] = lr.predict(test[features + zfeatures]).T
+            counters['rows'] = len(dfr)
         logging.info('New features added. Ready for training.')
     except Exception as e:
         logging.error('Something wrong with feature engineering. {}'.format(e))
@@ -91,7 +120,7 @@ if __name__ == "__main__":
         booster = 'gbtree',
         subsample = 0.8,
         colsample_bytree = 0.7,
-        tree_method = 'exact',
+        tree_method = TREE_METHOD,
         silent = 0,
         gamma = 0,
         random_state = 1023
@@ -106,26 +135,42 @@ if __name__ == "__main__":
         booster = 'gbtree',
         subsample = 0.8,
         colsample_bytree = 0.7,
-        tree_method = 'exact',
+        tree_method = TREE_METHOD,
         silent = 0,
         gamma = 0,
         random_state = 1023
     )
 
+    # Searched parameters
+    search_config = load_config(SEARCH_CONFIG)
+    if search_config is not None:
+        m1.set_params(**search_config['params']['bandwidth_total'])
+        m2.set_params(**search_config['params']['max_user'])
+        logging.info('Model parameters loaded from {}.'.format(SEARCH_CONFIG))
+
     # Fit the model to the data
     try:
         logging.info("Training started...")
-        for i, col in enumerate(['bandwidth_total', 'max_user']):
-            X_train = dfr[features+zfeatures+rfeatures+aufeatures]
-            y_train = dfr[col]
-            if i == 0:
-                m = m1
-                m.fit(X_train, np.log1p(y_train), eval_metric='mae')
-                test[col] = np.expm1(m.predict(test[features+zfeatures+rfeatures+aufeatures]))
-            else:
-                m = m2
-                m.fit(X_train, np.log1p(y_train), eval_metric='mae')
-                test[col] = np.expm1(m.predict(test[features+zfeatures+rfeatures+aufeatures]))
+        with stage('feature_matrix') as counters:
+            # Both targets are fitted at the same time on one shared feature matrix
+            X_train = feature_matrix(dfr, features+zfeatures+rfeatures+aufeatures)
+            X_test = feature_matrix(test, features+zfeatures+rfeatures+aufeatures)
+            Y_train = np.log1p(dfr[targets].values)
+            counters['rows'], counters['features'] = X_train.shape
+        with stage('xgboost') as counters:
+            if HOLDOUT_DAYS:
+                holdout = holdout_mask(dfr, HOLDOUT_DAYS)
+                if COMPARE_TREE_METHODS:
+                    compare_tree_methods([m1, m2], X_train, Y_train, holdout, targets, n_jobs=N_JOBS).to_csv(TREE_METHODS_REPORT, index=False)
+                    logging.info('Tree methods report saved to {}.'.format(TREE_METHODS_REPORT))
+                for col, r in zip(targets, tune_rounds([m1, m2], X_train, Y_train, holdout, n_jobs=N_JOBS)):
+                    logging.info('{}: best iteration {best_iteration}, holdout MAE {holdout_mae:.5f}, fit time {fit_time:.1f}s.'.format(col, **r))
+            m1, m2 = fit_parallel([m1, m2], X_train, Y_train, n_jobs=N_JOBS, fit_params={'eval_metric': 'mae'})
+            counters['rows'] = len(X_train)
+        with stage('xgboost_predict') as counters:
+            for m, col in zip([m1, m2], targets):
+                test[col] = np.expm1(m.predict(X_test))
+            counters['rows'] = len(X_test)
         logging.info("Training complete. Ready for the submission.")
     except Exception as e:
         logging.error("Could not train the data. {}".format(e))
@@ -133,10 +178,12 @@ if __name__ == "__main__":
             
     # =========== SUBMISSION ===========
     try:
-        test['bandwidth_total'] = test['bandwidth_total'].round(2)
-        test['max_user'] = test['max_user'].round()
-        test['label'] = test['bandwidth_total'].astype(str) + ' ' + test['max_user'].astype(int).astype(str)
-        test[['id', 'label']].to_csv('submission.csv', index=False)
+        with stage('submission') as counters:
+            test['bandwidth_total'] = test['bandwidth_total'].round(2)
+            test['max_user'] = test['max_user'].round()
+            test['label'] = test['bandwidth_total'].astype(str) + ' ' + test['max_user'].astype(int).astype(str)
+            test[['id', 'label']].to_csv('submission.csv', index=False)
+            counters['rows'] = len(test)
         logging.info('Submission file successfully created.')
     except Exception as e:
         logging.error("Could not save the csv file. {}".format(e))